@@ -0,0 +1,3065 @@
+# -*- coding: utf-8 -*-
+"""
+Qt-free core of the KOMP file audit
+
+Directory scanning, the persistent directory index, the KOMP protocol
+definitions and the filename audit, importable by the GUI and by headless
+scripts and batch workers.
+
+pandas is imported by the functions that build DataFrames rather than at
+module load, so importing this module (and scanning, hashing or parsing
+single barcodes) stays fast.
+"""
+
+#%% import libraries
+
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import sqlite3
+import tarfile
+import zipfile
+import csv
+import hashlib
+import struct
+import threading
+import queue
+import time
+import json
+import re
+import os
+
+#%% define constants
+
+# number of concurrent directory listings used when scanning a directory tree
+SCAN_WORKERS = 16
+
+# number of file entries yielded together by the directory scanner
+SCAN_BATCH_SIZE = 5000
+
+class ScanEntry(namedtuple('ScanEntry',['filename','directory','size','mtime'])):
+    """
+    A scanned file. The files of one listing share a single directory
+    string, and the full path is only joined when asked for.
+    """
+    __slots__ = ()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory,self.filename)
+
+# archives scanned like directories, by reading their member listing
+ARCHIVE_EXTENSIONS = (
+    '.zip',
+    '.tar',
+    '.tar.gz',
+    '.tgz',
+    '.tar.bz2',
+    '.tbz2',
+    '.tar.xz',
+    '.txz'
+    )
+
+# location of the persistent directory index used to skip unchanged folders
+DIRECTORY_INDEX_PATH = os.path.join(
+    os.path.expanduser('~'),
+    '.komp_file_audit',
+    'directory_index.sqlite'
+    )
+
+# location of the sqlite store of past audit runs
+AUDIT_HISTORY_PATH = os.path.join(
+    os.path.expanduser('~'),
+    '.komp_file_audit',
+    'audit_history.sqlite'
+    )
+
+# expected files for each KOMP test
+#   file_suffixes - appended to the padded barcode of each mouse
+#   basename_length - padded length of 'M' + zeros + barcode
+#   assignment - assignment tags required for a mouse to be expected,
+#                None to expect every mouse
+KOMP_PROTOCOLS = {
+    'std':{
+        'file_suffixes':['.csv'],
+        'basename_length':8,
+        'assignment':None
+        },
+    'xray-faxitron':{
+        'file_suffixes':['.dcm','-2.dcm','-h.dcm','-l.dcm','-v.dcm'],
+        'basename_length':8,
+        'assignment':['T','t','D','d']
+        },
+    'xray-bruker':{
+        'file_suffixes':['.bip','-2.bip','-h.bip','-l.bip','-v.bip'],
+        'basename_length':8,
+        'assignment':['T','t','D','d']
+        },
+    'body comp':{
+        'file_suffixes':['.txt','.jpg'],
+        'basename_length':8,
+        'assignment':None
+        },
+    # echo views exported as DICOM cine loops - parasternal long axis and
+    # short axis B-mode and M-mode, and mitral inflow pulsed wave Doppler
+    'echo':{
+        'file_suffixes':[
+            '-plax-b.dcm',
+            '-plax-m.dcm',
+            '-sax-b.dcm',
+            '-sax-m.dcm',
+            '-mv-pw.dcm'
+            ],
+        'basename_length':8,
+        'assignment':None
+        },
+    'ecg':{
+        'file_suffixes':['.txt','.adicht'],
+        'basename_length':8,
+        'assignment':['E','e']
+        },
+    }
+
+# grammar of animal ids and the filenames built from them, e.g.
+#   M00001234-wt (T)-h.dcm -> prefix 'M0000', barcode '1234',
+#                              assignment '(T)', suffix '-h.dcm'
+BARCODE_PATTERN = re.compile(
+    r'^(?P<prefix>M?0*)(?P<barcode>.+?)(-wt)?(\s)?(?P<assignment>\(.*?\))?(?P<suffix>[\.|-].*)?$'
+    )
+
+# fast path for the common case of ids/filenames without -wt, whitespace or
+# assignment tags. The prefix always takes a leading M and every leading
+# zero; the (?!0) lookahead then requires the barcode to start with a
+# non-zero character, and (?!-wt) rejects a suffix starting with -wt. Names
+# such as 'M0000' or 'M.csv', where BARCODE_PATTERN must shorten the
+# prefix, therefore do not match and fall through to BARCODE_PATTERN. Any
+# name it does match parses identically with BARCODE_PATTERN, in a single
+# linear pass.
+SIMPLE_BARCODE_PATTERN = re.compile(
+    r'^(?P<prefix>(?:M|(?!M))0*(?!0))(?P<barcode>[^-.|\s(]+)(?P<suffix>(?!-wt)[\.|-].*)?$'
+    )
+
+# rows per sheet allowed by Excel - longer categories are split over sheets
+EXCEL_MAX_ROWS = 1048576
+
+# rows per parquet row group when exporting reports
+REPORT_CHUNK_SIZE = 100000
+
+# report export formats by file extension
+REPORT_FORMATS = ['.xlsx','.csv','.parquet']
+
+# colony export formats read by import_animal_list
+ANIMAL_LIST_FORMATS = ['.csv','.tsv','.txt','.xlsx']
+
+# rows read at a time from colony exports
+IMPORT_CHUNK_SIZE = 50000
+
+# a barcode read from a colony export - anything but an assignment tag
+# or prefix left on its own
+ANIMAL_BARCODE_PATTERN = r'[^()\s]*[0-9A-Za-z][^()\s]*'
+
+# KOMP test name that audits every protocol in KOMP_PROTOCOLS at once
+ALL_PROTOCOLS = 'all protocols'
+
+REPORT_CATEGORIES = [
+    'passing_files',
+    'missing_files',
+    'unexpected_files',
+    'passing_mice',
+    'missing_mice',
+    'unexpected_mice'
+    ]
+
+# report category pairing unexpected files with the missing file they most
+# likely were meant to be
+NEAR_MISS_CATEGORIES = ['near_miss_files']
+
+# largest barcode edit distance (adjacent transpositions count as one) and
+# suffix edit distance of a near miss
+NEAR_MISS_DISTANCE = 1
+NEAR_MISS_SUFFIX_DISTANCE = 2
+
+# report category of the filenames found in more than one folder
+DUPLICATE_CATEGORIES = ['duplicate_filenames']
+
+# report categories added by the optional integrity stage
+INTEGRITY_CATEGORIES = [
+    'empty_files',
+    'small_files',
+    'duplicate_files'
+    ]
+
+# report categories added by the optional header check
+HEADER_CATEGORIES = [
+    'header_id_mismatch',
+    'header_date_mismatch',
+    'header_study_mismatch',
+    'header_unreadable'
+    ]
+
+# report category of the changes since the previous audit in the history
+HISTORY_CATEGORIES = ['changes_since_last_audit']
+
+# number of file headers read concurrently by the header check
+HEADER_WORKERS = 16
+
+# bytes first read from a DICOM file; the read doubles while the wanted
+# tags lie further in, up to DICOM_MAX_READ_SIZE
+DICOM_READ_SIZE = 16384
+DICOM_MAX_READ_SIZE = 1048576
+
+# DICOM tags read by read_dicom_header, in the order of the dataset
+DICOM_TAGS = {
+    (0x0008,0x0020):'StudyDate',
+    (0x0008,0x0022):'AcquisitionDate',
+    (0x0008,0x0023):'ContentDate',
+    (0x0010,0x0020):'PatientID',
+    (0x0020,0x000D):'StudyInstanceUID',
+    (0x0020,0x0010):'StudyID'
+    }
+
+# bytes read from the start of a body comp or ECG text export; the header
+# lines holding the animal id and date come first, so the rest of the
+# file (the measurements) is never read
+TEXT_READ_SIZE = 4096
+
+# header line of a text export, e.g. 'Animal ID: M00001234' or
+# 'Date\t2024-03-05'
+TEXT_HEADER_PATTERN = re.compile(r'^\s*([A-Za-z][\w /#.]*?)\s*[:=\t]\s*(.*?)\s*$')
+
+# header keys of text exports holding the animal id and acquisition date,
+# lower case, most specific first
+TEXT_ID_KEYS = (
+    'animal id',
+    'mouse id',
+    'subject id',
+    'sample id',
+    'animal',
+    'subject',
+    'sample',
+    'name',
+    'id'
+    )
+TEXT_DATE_KEYS = (
+    'acquisition date',
+    'measurement date',
+    'date',
+    'date/time',
+    'datetime'
+    )
+
+# explicit VRs with a reserved field and a 4 byte length
+DICOM_LONG_VRS = {
+    b'OB',b'OD',b'OF',b'OL',b'OV',b'OW',b'SQ',b'SV',b'UC',b'UN',b'UR',b'UT',b'UV'
+    }
+
+# passing files smaller than this fraction of the median size of the
+# passing files with the same suffix are reported as suspiciously small
+SMALL_FILE_FRACTION = 0.1
+
+# number of files checksummed concurrently by the integrity stage
+HASH_WORKERS = 8
+
+# bytes read at a time when checksumming a file
+HASH_CHUNK_SIZE = 1024*1024
+
+# seconds between directory mtime polls when watchdog is not installed
+WATCH_POLL_INTERVAL = 0.5
+
+# seconds to keep collecting file events once one has arrived
+WATCH_SETTLE_TIME = 0.1
+
+# seconds between samples of process memory while a run stage is timed
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+# JSON lines log holding one record of stage timings per audit run
+RUN_LOG_PATH = os.path.join(
+    os.path.expanduser('~'),
+    '.komp_file_audit',
+    'audit_runs.jsonl'
+    )
+
+
+
+#%% define functions
+def parse_animal_text(raw_animal_list):
+    """
+    Split pasted animal list text on newlines and tabs into a sorted list
+    """
+    parsed_list = []
+    for r in raw_animal_list.split('\n'):
+        for c in r.split('\t'):
+            if c == '':
+                continue
+            parsed_list.append(c)
+
+    return sorted(parsed_list)
+
+
+
+def sniff_delimiter(path):
+    """
+    Return the delimiter of a csv-like text file from its first lines
+    """
+    with open(path,newline='',errors='replace') as f:
+        sample = f.read(65536)
+    try:
+        return csv.Sniffer().sniff(sample,delimiters=',\t;|').delimiter
+    except csv.Error:
+        return '\t' if '\t' in sample else ','
+
+
+
+def animal_list_columns(path):
+    """
+    Return the column names in the header row of a colony export
+    """
+    if os.path.splitext(path)[1].lower() == '.xlsx':
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(path,read_only=True)
+        try:
+            header = next(workbook.active.iter_rows(values_only=True),())
+        finally:
+            workbook.close()
+        return [str(c) for c in header if c is not None]
+
+    import pandas
+
+    return pandas.read_csv(
+        path,
+        sep=sniff_delimiter(path),
+        nrows=0,
+        dtype=str
+        ).columns.tolist()
+
+
+
+def guess_animal_column(columns):
+    """
+    Return the first column whose name looks like an animal id column
+    """
+    for c in columns:
+        if re.search(r'barcode|animal|mouse|mice|\bid\b',str(c),re.IGNORECASE):
+            return c
+
+    return columns[0] if columns else None
+
+
+
+def read_animal_chunks(path,column,chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Yield the values of column of a colony export as Series of chunk_size
+    rows, without loading the whole file
+    """
+    import pandas
+
+    if os.path.splitext(path)[1].lower() == '.xlsx':
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(path,read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(c) for c in next(rows,())]
+            if column not in header:
+                raise ValueError(f'column not found : {column}')
+            index = header.index(column)
+            chunk = []
+            for row in rows:
+                chunk.append(row[index] if index < len(row) else None)
+                if len(chunk) >= chunk_size:
+                    yield pandas.Series(chunk,dtype=object)
+                    chunk = []
+            if chunk:
+                yield pandas.Series(chunk,dtype=object)
+        finally:
+            workbook.close()
+        return
+
+    if column not in animal_list_columns(path):
+        raise ValueError(f'column not found : {column}')
+    for chunk in pandas.read_csv(
+            path,
+            sep=sniff_delimiter(path),
+            usecols=[column],
+            dtype=str,
+            chunksize=chunk_size
+            ):
+        yield chunk[column]
+
+
+
+def import_animal_list(path,column=None,chunk_size=IMPORT_CHUNK_SIZE,progress=None):
+    """
+    Read the animal ids in column of a colony csv/tsv/xlsx export
+
+    The file is read in chunks of chunk_size rows. Each chunk is stripped
+    and parsed with parse_filenames; a cell without a barcode, such as a
+    lone '(T)' tag, is counted as unparsed. Ids are deduplicated on their
+    barcode, so '12345 (T)' and 'M00012345' count as one animal. The first
+    id seen is kept unless a later one carries an assignment tag it lacks,
+    as the xray and ecg audits select animals by their tag; ids of one
+    barcode with different tags are counted as conflicts. column defaults
+    to guess_animal_column. progress, if given, is called with the number
+    of rows read after each chunk.
+
+    Returns a mouse_list DataFrame with a sorted parsed_mouse_list column
+    and a dict of rows, blank, unparsed, duplicate and conflict counts.
+    """
+    import pandas
+
+    if column is None:
+        column = guess_animal_column(animal_list_columns(path))
+
+    # barcode -> (id, assignment tag) kept for it
+    ids = {}
+    counts = Counter(rows=0,blank=0,unparsed=0,duplicate=0,conflict=0)
+    for chunk in read_animal_chunks(path,column,chunk_size):
+        rows = len(chunk)
+        chunk = chunk.dropna().astype(str).str.strip()
+        chunk = chunk[chunk != '']
+        counts['rows'] += rows
+        counts['blank'] += rows - len(chunk)
+        parsed = parse_filenames(chunk)
+        parsed_ok = parsed['barcode'].astype(object).str.fullmatch(
+            ANIMAL_BARCODE_PATTERN,
+            na=False
+            ).astype(bool)
+        counts['unparsed'] += int((~parsed_ok).sum())
+        for animal_id, barcode, assignment in zip(
+                chunk[parsed_ok].tolist(),
+                parsed.loc[parsed_ok,'barcode'].tolist(),
+                parsed.loc[parsed_ok,'assignment'].fillna('').tolist()
+                ):
+            if barcode not in ids:
+                ids[barcode] = (animal_id,assignment)
+                continue
+            counts['duplicate'] += 1
+            if ids[barcode][1] == '' and assignment != '':
+                ids[barcode] = (animal_id,assignment)
+            elif assignment not in ['',ids[barcode][1]]:
+                counts['conflict'] += 1
+        if progress is not None:
+            progress(counts['rows'])
+
+    return (
+        pandas.DataFrame(
+            {'parsed_mouse_list':sorted(i for i, tag in ids.values())}
+            ),
+        dict(counts)
+        )
+
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+
+def list_archive(archive):
+    """
+    List the file members of a zip or tar archive without extracting them
+
+    Zip listings come from the central directory. Tar headers are read
+    sequentially; the data of uncompressed members is seeked over, but a
+    compressed tar has to be decompressed to reach each header. Member
+    paths are archive/member, e.g. cohort.zip/day1/M00012345.csv.
+    Unreadable archives are skipped like unreadable directories.
+    """
+    files = []
+    # member folder -> directory string shared by its files
+    directories = {}
+
+    def member_directory(name):
+        folder = name.rpartition('/')[0]
+        if folder not in directories:
+            directories[folder] = os.path.join(archive,*folder.split('/'))
+        return directories[folder]
+
+    try:
+        if archive.lower().endswith('.zip'):
+            with zipfile.ZipFile(archive) as z:
+                for info in z.infolist():
+                    if info.is_dir():
+                        continue
+                    files.append(
+                        ScanEntry(
+                            info.filename.rsplit('/',1)[-1],
+                            member_directory(info.filename),
+                            info.file_size,
+                            time.mktime(info.date_time+(0,0,-1))
+                            )
+                        )
+        else:
+            with tarfile.open(archive,'r:*') as t:
+                for member in t:
+                    if not member.isfile():
+                        continue
+                    files.append(
+                        ScanEntry(
+                            member.name.rsplit('/',1)[-1],
+                            member_directory(member.name),
+                            member.size,
+                            member.mtime
+                            )
+                        )
+    except (OSError, zipfile.BadZipFile, tarfile.TarError):
+        pass
+
+    return files
+
+
+
+def split_archive_path(path):
+    """
+    Return (archive, member) for a path listed by list_archive, else None
+    """
+    head, member = os.path.split(path)
+    while head != os.path.dirname(head):
+        if is_archive(head) and os.path.isfile(head):
+            return head, member
+        head, tail = os.path.split(head)
+        member = tail+'/'+member
+
+    return None
+
+
+
+@contextmanager
+def open_file(path):
+    """
+    Open a file, or an archive member listed by list_archive, for reading
+    in binary mode
+
+    A member opened here is reached by decompressing a compressed tar up to
+    it; read_files reads many members in one pass instead. path may also
+    be a file already open for binary reading, such as a member handed out
+    by read_files, which is used as it is.
+    """
+    if hasattr(path,'read'):
+        yield path
+        return
+    archive = None if os.path.exists(path) else split_archive_path(path)
+    if archive is None:
+        with open(path,'rb') as f:
+            yield f
+    elif archive[0].lower().endswith('.zip'):
+        with zipfile.ZipFile(archive[0]) as z, z.open(archive[1]) as f:
+            yield f
+    else:
+        with tarfile.open(archive[0],'r:*') as t:
+            f = t.extractfile(archive[1])
+            if f is None:
+                raise OSError(f'not a file : {path}')
+            with f:
+                yield f
+
+
+
+def read_files(read,paths,max_workers=HASH_WORKERS):
+    """
+    Return read(path, f) for each of paths, f the file opened for reading
+    in binary mode, or None where the file could not be opened
+
+    Plain files are read on a thread pool. Archive members are grouped by
+    archive and each archive is read in a single sequential pass, in
+    member order, so a compressed tar is decompressed once instead of from
+    its start for every member; the archives are read on the same pool.
+    read should handle errors while reading f itself.
+    """
+    results = [None]*len(paths)
+    plain = []
+    # archive -> member name -> indexes of its paths
+    members = {}
+    for i, path in enumerate(paths):
+        archive = None if os.path.exists(path) else split_archive_path(path)
+        if archive is None:
+            plain.append(i)
+        else:
+            members.setdefault(archive[0],{}).setdefault(archive[1],[]).append(i)
+
+    def read_member(indexes, f):
+        result = read(paths[indexes[0]],f)
+        for i in indexes:
+            results[i] = result
+
+    def read_plain(i):
+        try:
+            with open(paths[i],'rb') as f:
+                read_member([i],f)
+        except OSError:
+            pass
+
+    def read_archive(archive):
+        wanted = dict(members[archive])
+        try:
+            if archive.lower().endswith('.zip'):
+                with zipfile.ZipFile(archive) as z:
+                    for info in z.infolist():
+                        if info.filename in wanted:
+                            with z.open(info) as f:
+                                read_member(wanted.pop(info.filename),f)
+            else:
+                # stream mode only reads forwards, through each member once
+                with tarfile.open(archive,'r|*') as t:
+                    for member in t:
+                        if not wanted:
+                            break
+                        if member.name in wanted and member.isfile():
+                            read_member(
+                                wanted.pop(member.name),
+                                t.extractfile(member)
+                                )
+        except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError):
+            pass
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_plain,i) for i in plain]+[
+            executor.submit(read_archive,archive) for archive in members
+            ]
+        for future in futures:
+            future.result()
+
+    return results
+
+
+
+def list_directory(directory):
+    """
+    List a single directory with os.scandir
+
+    Returns a list of ScanEntry for the files and a list of paths for the
+    subdirectories. Size and mtime come from DirEntry.stat(), which reuses
+    the data returned with the directory listing where the platform
+    provides it (Windows/SMB shares) instead of issuing a stat per file.
+    Unreadable directories and entries are skipped, as os.walk does.
+
+    Archives are returned as subdirectories, and an archive passed as
+    directory is listed with list_archive, so archives are scanned in
+    place wherever they sit in the tree.
+    """
+    if is_archive(directory) and os.path.isfile(directory):
+        return list_archive(directory), []
+
+    files = []
+    subdirectories = []
+    try:
+        with os.scandir(directory) as directory_iterator:
+            for entry in directory_iterator:
+                try:
+                    if entry.is_dir():
+                        # match os.walk - symlinked directories are not followed
+                        if not entry.is_symlink():
+                            subdirectories.append(entry.path)
+                        continue
+                    if is_archive(entry.name):
+                        subdirectories.append(entry.path)
+                        continue
+                    stat_result = entry.stat()
+                except OSError:
+                    continue
+                files.append(
+                    ScanEntry(
+                        entry.name,
+                        directory,
+                        stat_result.st_size,
+                        stat_result.st_mtime
+                        )
+                    )
+    except OSError:
+        pass
+
+    return files, subdirectories
+
+
+
+def scandir_walk(
+        root,
+        max_workers=SCAN_WORKERS,
+        lister=list_directory,
+        progress=None
+        ):
+    """
+    Walk a directory tree listing subdirectories concurrently
+
+    Each directory is listed by lister (default list_directory) on a
+    bounded thread pool, so the network round trips of a NAS share overlap
+    instead of running one after another. Yields (directory, files) tuples
+    in completion order. If given, progress is called with the running
+    directory and file counts after each listing; it may raise to stop
+    the walk.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    directory_count = 0
+    file_count = 0
+    try:
+        pending = {executor.submit(lister,root):root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                files, subdirectories = future.result()
+                for s in subdirectories:
+                    pending[executor.submit(lister,s)] = s
+                directory_count += 1
+                file_count += len(files)
+                if progress is not None:
+                    progress(directory_count, file_count)
+                yield directory, files
+    finally:
+        # drop queued listings if the walk is stopped early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+
+def scan_directory(
+        root,
+        max_workers=SCAN_WORKERS,
+        batch_size=SCAN_BATCH_SIZE,
+        lister=list_directory,
+        progress=None
+        ):
+    """
+    Scan a directory tree and yield lists of ScanEntry in batches
+
+    Batches are yielded while the walk is still running so callers can
+    display partial results.
+    """
+    batch = []
+    for directory, files in scandir_walk(root,max_workers,lister,progress):
+        batch.extend(files)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+
+def parse_filenames(names):
+    """
+    Split a Series of filenames or mouse ids into BARCODE_PATTERN columns
+
+    Returns a DataFrame of prefix, barcode, assignment and suffix columns
+    aligned with names. Plain names are parsed with SIMPLE_BARCODE_PATTERN
+    in one vectorized pass; only the rest go through BARCODE_PATTERN.
+    """
+    import pandas
+
+    names = names.astype(str)
+    parsed = names.str.extract(SIMPLE_BARCODE_PATTERN)
+    unparsed = parsed['barcode'].isna()
+    if unparsed.any():
+        parsed = pandas.concat(
+            [
+                parsed[~unparsed],
+                names[unparsed].str.extract(BARCODE_PATTERN)
+                ]
+            ).reindex(names.index)
+
+    return parsed.reindex(columns=['prefix','barcode','assignment','suffix'])
+
+
+
+def parse_barcode(name):
+    """
+    Return the barcode of a single filename or mouse id, as parse_filenames
+    """
+    parsed = re.search(SIMPLE_BARCODE_PATTERN,name)
+    if parsed is None:
+        parsed = re.search(BARCODE_PATTERN,name)
+    if parsed is None:
+        return None
+
+    return parsed['barcode']
+
+
+
+def expected_file_table(
+        mouse_list,
+        file_suffixes,
+        basename_length,
+        assignment=None,
+        mice=None,
+        unique=True
+        ):
+    """
+    Build the table of expected filename, barcode and suffix rows
+
+    Mice without a matching assignment tag are left out when assignment
+    is given. mice may pass in parse_filenames of the mouse list when it
+    has already been parsed. With unique=False a filename expected for
+    several listed mice is kept once per mouse.
+    """
+    import pandas
+
+    if mice is None:
+        mice = parse_filenames(mouse_list['parsed_mouse_list'])
+    if assignment is not None:
+        mice = mice[
+            mice['assignment'].fillna('').astype(str).str.contains(
+                '|'.join(re.escape(i) for i in assignment)
+                )
+            ]
+    mice = mice.dropna(subset=['barcode'])
+    # unpadded ids get 'M' and zero padding up to basename_length
+    mice = mice.assign(
+        stem=(mice['prefix']+mice['barcode']).where(
+            mice['prefix'] != '',
+            'M'+mice['barcode'].str.pad(basename_length,fillchar='0')
+            )
+        )
+    expected = mice[['stem','barcode']].merge(
+        pandas.DataFrame({'suffix':list(file_suffixes)}),
+        how='cross'
+        )
+    expected['filename'] = expected['stem']+expected['suffix']
+    expected = expected[['filename','barcode','suffix']]
+    if not unique:
+        return expected
+
+    return expected.drop_duplicates('filename')
+
+
+
+def actual_file_table(file_list):
+    """
+    Parse the filenames of file_list once into filename, barcode and suffix
+
+    The barcode and suffix columns of a file_list built by file_list_frame
+    are used as they are.
+    """
+    import pandas
+
+    if {'barcode','suffix'}.issubset(file_list.columns):
+        actual = file_list[['filename','barcode','suffix']].drop_duplicates(
+            'filename'
+            )
+        # joins on a categorical key are slower than on plain strings
+        return actual.assign(suffix=actual['suffix'].astype(object))
+
+    actual = pandas.DataFrame(
+        {'filename':file_list['filename'].astype(str)}
+        ).drop_duplicates('filename')
+    actual[['barcode','suffix']] = parse_filenames(
+        actual['filename']
+        )[['barcode','suffix']]
+
+    return actual
+
+
+
+def compare_file_tables(expected,actual):
+    """
+    Join expected and actual file tables on barcode and suffix
+
+    The filename is part of the key so differently padded names do not
+    match. Returns the filename_audit result sets.
+    """
+    matched_actual = actual.merge(
+        expected,
+        on=['barcode','suffix','filename'],
+        how='left',
+        indicator=True
+        )
+    matched_expected = expected.merge(
+        actual,
+        on=['barcode','suffix','filename'],
+        how='left',
+        indicator=True
+        )
+    missing = matched_expected[matched_expected['_merge'] == 'left_only']
+    passing = matched_actual[matched_actual['_merge'] == 'both']
+    unexpected = matched_actual[matched_actual['_merge'] == 'left_only']
+
+    missing_files = set(missing['filename'].tolist())
+    passing_files = set(passing['filename'].tolist())
+    unexpected_files = set(unexpected['filename'].tolist())
+    
+    missing_mice = set(missing['barcode'].dropna().tolist())
+    passing_mice = set(passing['barcode'].dropna().tolist())
+    unexpected_mice = set(unexpected['barcode'].dropna().tolist())
+    
+    passing_mice = passing_mice.difference(missing_mice).difference(unexpected_mice)
+    
+    return passing_files, missing_files, unexpected_files, \
+        passing_mice, missing_mice, unexpected_mice
+
+
+
+def filename_audit(mouse_list,file_list,file_suffixes,basename_length,assignment=None):
+    """
+    Compare the files expected for mouse_list against file_list
+
+    Actual filenames are parsed once into barcode/suffix columns and
+    matched to the expected rows with a hash join, so the cost is linear
+    in the number of files.
+
+    Returns sets of passing, missing and unexpected files and mice.
+    """
+    return compare_file_tables(
+        expected_file_table(
+            mouse_list,
+            file_suffixes,
+            basename_length,
+            assignment
+            ),
+        actual_file_table(file_list)
+        )
+
+
+
+def edit_distance(a,b,max_distance=None):
+    """
+    Return the optimal string alignment distance between a and b - the
+    number of insertions, deletions, substitutions and adjacent
+    transpositions turning one into the other
+
+    With max_distance, a distance larger than max_distance is only known to
+    be larger - the calculation stops as soon as it exceeds max_distance.
+    """
+    # a common prefix and suffix do not change the distance
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a)-start and end < len(b)-start and a[-1-end] == b[-1-end]:
+        end += 1
+    a, b = a[start:len(a)-end], b[start:len(b)-end]
+    if len(a) == 0 or len(b) == 0:
+        return max(len(a),len(b))
+    if len(a) == 1 and len(b) == 1:
+        return 1
+    if len(a) == 2 and b == a[::-1]:
+        return 1
+    if max_distance is not None and max_distance < 2 and max(len(a),len(b)) > 1:
+        # with the common ends stripped, one edit leaves at most a swapped pair
+        return 2
+    if max_distance is not None and abs(len(a)-len(b)) > max_distance:
+        return max_distance+1
+
+    before_previous = None
+    previous = list(range(len(b)+1))
+    for i in range(1,len(a)+1):
+        current = [i]+[0]*len(b)
+        for j in range(1,len(b)+1):
+            current[j] = min(
+                previous[j]+1,
+                current[j-1]+1,
+                previous[j-1]+(a[i-1] != b[j-1])
+                )
+            if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1]:
+                current[j] = min(current[j],before_previous[j-2]+1)
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance+1
+        before_previous, previous = previous, current
+
+    return previous[-1]
+
+
+
+def is_transposition(a,b):
+    """
+    Return True if b is a with two adjacent characters swapped
+    """
+    if len(a) != len(b):
+        return False
+    differences = [i for i in range(len(a)) if a[i] != b[i]]
+
+    return len(differences) == 2 and differences[1] == differences[0]+1 and \
+        a[differences[0]] == b[differences[1]] and \
+        a[differences[1]] == b[differences[0]]
+
+
+
+def near_miss_files(
+        missing_files,
+        unexpected_files,
+        max_distance=NEAR_MISS_DISTANCE,
+        max_suffix_distance=NEAR_MISS_SUFFIX_DISTANCE
+        ):
+    """
+    Suggest the missing file each unexpected file was most likely meant to
+    be
+
+    An unexpected file is paired with a missing file of the same barcode
+    when only the zero padding differs, or when its suffix is within
+    max_suffix_distance (ignoring case) of the missing suffix. Otherwise
+    its barcode is looked up in a BarcodeIndex of the missing barcodes, so
+    transposed or mistyped digits are found without comparing every pair
+    of files. A typo is only suggested when one missing barcode (with the
+    same suffix) explains it - in densely numbered cohorts many barcodes
+    are one digit apart. Returns a DataFrame of unexpected_file,
+    suggested_file and reason rows.
+    """
+    import pandas
+
+    # barcode -> suffix -> missing filename
+    targets = {}
+    missing = pandas.Series(sorted(missing_files),dtype=object)
+    parsed = parse_filenames(missing).fillna('')
+    for filename, barcode, suffix in zip(missing,parsed['barcode'],parsed['suffix']):
+        if barcode != '':
+            targets.setdefault(barcode,{})[suffix] = filename
+    # a typo is only suggested for a missing file of the same suffix, so
+    # each suffix gets its own index
+    indexes = {}
+    for barcode, suffixes in targets.items():
+        for suffix in suffixes:
+            indexes.setdefault(suffix,[]).append(barcode)
+    indexes = {
+        suffix:BarcodeIndex(barcodes,max_distance)
+        for suffix, barcodes in indexes.items()
+        }
+    lengths = {
+        length+d
+        for length in {len(b) for b in targets}
+        for d in range(-max_distance,max_distance+1)
+        }
+
+    unexpected = pandas.Series(sorted(unexpected_files),dtype=object)
+    parsed = parse_filenames(unexpected).fillna('')
+    parsed['filename'] = unexpected
+    # skip files that can not be near any missing file before searching
+    known = parsed['barcode'].isin(targets.keys())
+    typo = ~known & parsed['suffix'].isin(indexes.keys()) & \
+        parsed['barcode'].str.len().isin(lengths)
+
+    rows = []
+    for filename, barcode, suffix in zip(
+            parsed.loc[known,'filename'],
+            parsed.loc[known,'barcode'],
+            parsed.loc[known,'suffix']
+            ):
+        suffixes = targets[barcode]
+        if suffix in suffixes:
+            rows.append((filename,suffixes[suffix],'zero padding'))
+            continue
+        distance, closest = min(
+            (edit_distance(suffix.lower(),s.lower()),s) for s in suffixes
+            )
+        if distance <= max_suffix_distance:
+            rows.append((filename,suffixes[closest],'wrong suffix'))
+
+    searched = {}
+    for filename, barcode, suffix in zip(
+            parsed.loc[typo,'filename'],
+            parsed.loc[typo,'barcode'],
+            parsed.loc[typo,'suffix']
+            ):
+        # a mouse usually has several files with the same barcode typo
+        if (barcode,suffix) not in searched:
+            matches = [b for distance, b in indexes[suffix].search(barcode)]
+            transpositions = [b for b in matches if is_transposition(barcode,b)]
+            if len(transpositions) == 1:
+                searched[barcode,suffix] = (transpositions[0],'transposed digits')
+            elif len(matches) == 1:
+                searched[barcode,suffix] = (matches[0],'mistyped barcode')
+            else:
+                searched[barcode,suffix] = None
+        if searched[barcode,suffix] is not None:
+            match, reason = searched[barcode,suffix]
+            rows.append((filename,targets[match][suffix],reason))
+    rows.sort()
+
+    return pandas.DataFrame(
+        rows,
+        columns=['unexpected_file','suggested_file','reason']
+        )
+
+
+
+def multi_protocol_audit(mouse_list,file_list,protocols=KOMP_PROTOCOLS):
+    """
+    Audit file_list against every protocol in one pass
+
+    The mouse list and the filenames are parsed once. The expected rows of
+    all protocols are stacked into one table, so every actual file is
+    matched for every protocol with a single join on barcode and suffix,
+    and a combined suffix -> protocol table assigns each file to the
+    protocols whose suffixes it carries with a second join.
+
+    A file that does not pass is unexpected only for the protocols its
+    suffix belongs to, so a body comp export is not an unexpected file of
+    the xray audit. Files whose suffix belongs to no protocol (a typo such
+    as '.CSV') are listed as unexpected files of every protocol, but do
+    not make their mouse unexpected in any.
+
+    Returns a dict of protocol -> report dict (keyed by REPORT_CATEGORIES)
+    and a matrix DataFrame of mouse barcode x protocol holding 'missing',
+    'unexpected', 'passing' or '' (neither expected nor found).
+    """
+    import pandas
+
+    mice = parse_filenames(mouse_list['parsed_mouse_list'])
+    actual = actual_file_table(file_list)
+    expected = pandas.concat(
+        [
+            expected_file_table(
+                mouse_list,
+                settings['file_suffixes'],
+                settings['basename_length'],
+                settings['assignment'],
+                mice=mice
+                ).assign(protocol=test)
+            for test, settings in protocols.items()
+            ],
+        ignore_index=True
+        )
+
+    matched = expected.merge(
+        actual.assign(actual_filename=actual['filename']),
+        on=['barcode','suffix','filename'],
+        how='left'
+        )
+    found = matched['actual_filename'].notna()
+
+    # combined suffix lookup - the protocols each filename suffix belongs to
+    suffix_table = pandas.DataFrame(
+        [
+            (suffix,test)
+            for test, settings in protocols.items()
+            for suffix in settings['file_suffixes']
+            ],
+        columns=['suffix','protocol']
+        ).drop_duplicates()
+    classified = actual.merge(suffix_table,on='suffix')
+    unclassified = actual[~actual['suffix'].isin(suffix_table['suffix'])]
+
+    reports = {}
+    for test in protocols:
+        in_test = matched['protocol'] == test
+        passing = matched[in_test & found]
+        missing = matched[in_test & ~found]
+        passing_files = set(passing['filename'].tolist())
+        in_suffix = classified[classified['protocol'] == test]
+        unexpected = in_suffix[~in_suffix['filename'].isin(passing_files)]
+
+        missing_mice = set(missing['barcode'].dropna().tolist())
+        unexpected_mice = set(unexpected['barcode'].dropna().tolist())
+        passing_mice = set(passing['barcode'].dropna().tolist()).difference(
+            missing_mice
+            ).difference(unexpected_mice)
+
+        reports[test] = dict(
+            zip(
+                REPORT_CATEGORIES,
+                [
+                    passing_files,
+                    set(missing['filename'].tolist()),
+                    set(unexpected['filename'].tolist()).union(
+                        unclassified['filename'].tolist()
+                        ),
+                    passing_mice,
+                    missing_mice,
+                    unexpected_mice
+                    ]
+                )
+            )
+
+    barcodes = sorted(set(mice['barcode'].dropna().tolist()))
+    matrix = pandas.DataFrame({'barcode':barcodes})
+    for test, report in reports.items():
+        status = pandas.Series('',index=barcodes)
+        for category in ['passing_mice','unexpected_mice','missing_mice']:
+            # later categories take precedence
+            status[status.index.isin(report[category])] = category.split('_')[0]
+        matrix[test] = status.values
+
+    return reports, matrix
+
+
+
+def file_list_frame(entries,parse=True):
+    """
+    Build a file_list DataFrame of filename, directory, size and mtime
+    columns from an iterable of ScanEntry
+
+    Each directory is stored once, in a categorical directory column, and
+    full paths are joined on demand by file_paths. With parse, the barcode
+    and (categorical) suffix columns are parsed here once, and audits of
+    the list read them instead of parsing the filenames again.
+    """
+    import pandas
+
+    entries = list(entries)
+    file_list = pandas.DataFrame(
+        {
+            'filename':pandas.Series([e[0] for e in entries],dtype=str),
+            'directory':pandas.Categorical([e[1] for e in entries]),
+            'size':pandas.Series([e[2] for e in entries],dtype='int64'),
+            'mtime':pandas.Series([e[3] for e in entries],dtype='float64')
+            }
+        )
+    if parse:
+        parsed = parse_filenames(file_list['filename'])
+        file_list['barcode'] = parsed['barcode']
+        file_list['suffix'] = parsed['suffix'].astype('category')
+
+    return file_list
+
+
+
+def file_paths(files):
+    """
+    Return the full paths of the rows of a file_list DataFrame
+    """
+    directories = files['directory']
+    if hasattr(directories,'cat'):
+        # look the codes up in the directory list rather than iterating
+        # the categorical values
+        categories = directories.cat.categories.tolist()
+        directories = [categories[c] for c in directories.cat.codes.tolist()]
+    else:
+        directories = directories.tolist()
+
+    return [
+        os.path.join(directory,filename)
+        for directory, filename in zip(directories,files['filename'].tolist())
+        ]
+
+
+
+def scan_file_list(root,max_workers=SCAN_WORKERS):
+    """
+    Scan root into a file_list DataFrame, one row per file path
+    """
+    file_index = FileIndex()
+    for batch in scan_directory(root,max_workers):
+        file_index.add(batch)
+
+    return file_list_frame(file_index.values())
+
+
+
+def duplicate_filenames(file_list):
+    """
+    Return a DataFrame of filename and path rows listing every location of
+    the filenames found more than once in file_list
+    """
+    import pandas
+
+    files = file_list[file_list['filename'].duplicated(keep=False)]
+
+    return pandas.DataFrame(
+        {'filename':files['filename'].tolist(),'path':file_paths(files)}
+        ).sort_values(['filename','path'],ignore_index=True)
+
+
+
+def file_digest(path,chunk_size=HASH_CHUNK_SIZE):
+    """
+    Return the sha256 hex digest of a file (a path or an open file) read
+    in chunks, None if unreadable
+    """
+    digest = hashlib.sha256()
+    try:
+        with open_file(path) as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    except (OSError, KeyError, zipfile.BadZipFile, tarfile.TarError):
+        return None
+
+    return digest.hexdigest()
+
+
+
+def restat_files(files,max_workers=HASH_WORKERS):
+    """
+    Return a file_list DataFrame with its size and mtime read again
+
+    A scan reuses the listing of a folder whose mtime is unchanged
+    (DirectoryIndex), and rewriting a file in place does not change its
+    folder's mtime, so scanned sizes and mtimes may be stale. Files are
+    stat'ed on a thread pool; archive members and files that can no longer
+    be stat'ed keep their scanned values.
+    """
+    def stat(path):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return stat_result.st_size, stat_result.st_mtime
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        stats = list(executor.map(stat,file_paths(files)))
+
+    return files.assign(
+        size=[
+            v if s is None else s[0] for s,v in zip(stats,files['size'])
+            ],
+        mtime=[
+            v if s is None else s[1] for s,v in zip(stats,files['mtime'])
+            ]
+        ).astype({'size':'int64','mtime':'float64'})
+
+
+
+def hash_files(files,hash_cache=None,max_workers=HASH_WORKERS):
+    """
+    Checksum the files of a file_list DataFrame on a thread pool
+
+    Digests found in hash_cache for an unchanged (path, size, mtime) are
+    reused; the rest are computed and added to the cache, so size and
+    mtime should be current (see restat_files). Returns a dict of path ->
+    digest.
+    """
+    keys = list(zip(file_paths(files),files['size'],files['mtime']))
+    digests = {} if hash_cache is None else hash_cache.lookup(keys)
+    pending = [k for k in keys if k[0] not in digests]
+
+    computed = read_files(
+        lambda path, f: file_digest(f),
+        [k[0] for k in pending],
+        max_workers
+        )
+
+    new_entries = []
+    for (path, size, mtime), digest in zip(pending,computed):
+        if digest is not None:
+            digests[path] = digest
+            new_entries.append((path, size, mtime, digest))
+    if hash_cache is not None:
+        hash_cache.store(new_entries)
+
+    return digests
+
+
+
+def integrity_check(
+        passing_files,
+        file_list,
+        hash_cache=None,
+        max_workers=HASH_WORKERS,
+        small_fraction=SMALL_FILE_FRACTION
+        ):
+    """
+    Check the passing files of an audit for empty, small and duplicate files
+
+    The passing files are stat'ed again (restat_files), so files rewritten
+    since a scan that reused their folder's listing are checked as they
+    are now and are not matched to a stale cached checksum. Only files
+    sharing their size with another file can have duplicate content, so
+    only those are checksummed. Returns a dict of INTEGRITY_CATEGORIES ->
+    set; duplicates are listed one group per entry, as 'a = b = ...'.
+    """
+    files = restat_files(
+        file_list[file_list['filename'].isin(passing_files)],
+        max_workers
+        )
+    files = files.assign(
+        suffix=(
+            files['suffix'].astype(object) if 'suffix' in files.columns
+            else parse_filenames(files['filename'])['suffix']
+            ).fillna('')
+        )
+
+    empty = files['size'] == 0
+    typical_size = files['size'].where(~empty).groupby(
+        files['suffix']
+        ).transform('median')
+    small = ~empty & (files['size'] < small_fraction*typical_size)
+
+    candidates = files[~empty & files['size'].duplicated(keep=False)]
+    digests = hash_files(candidates,hash_cache,max_workers)
+    groups = {}
+    for filename, path in zip(candidates['filename'],file_paths(candidates)):
+        if path in digests:
+            groups.setdefault(digests[path],set()).add(filename)
+
+    return {
+        'empty_files':set(files.loc[empty,'filename'].tolist()),
+        'small_files':set(files.loc[small,'filename'].tolist()),
+        'duplicate_files':{
+            ' = '.join(sorted(g)) for g in groups.values() if len(g) > 1
+            }
+        }
+
+
+
+def read_dicom_elements(data,offset,explicit,tags=None,values=None,stop=None):
+    """
+    Read DICOM data elements from data[offset:], little endian
+
+    Values of tags are decoded into values. At the top level (tags given)
+    reading stops at the first tag past stop, by default the last of tags;
+    inside a sequence (tags None) it stops at an item or sequence
+    delimiter. Undefined length sequences are skipped item by item.
+    Raises IndexError when data ends first. Returns the offset reached.
+    """
+    if tags is not None and stop is None:
+        stop = max(tags)
+    while True:
+        if offset+8 > len(data):
+            raise IndexError('DICOM header incomplete')
+        group, element = struct.unpack_from('<HH',data,offset)
+        if group == 0xFFFE:
+            # items and delimiters have no VR in either transfer syntax
+            length, = struct.unpack_from('<I',data,offset+4)
+            offset += 8
+            if element in (0xE00D,0xE0DD):
+                return offset
+            if length == 0xFFFFFFFF:
+                offset = read_dicom_elements(data,offset,explicit)
+            else:
+                offset += length
+            continue
+        if tags is not None and (group,element) > stop:
+            return offset
+        if explicit and data[offset+4:offset+6] not in DICOM_LONG_VRS:
+            length, = struct.unpack_from('<H',data,offset+6)
+            offset += 8
+        elif explicit:
+            length, = struct.unpack_from('<I',data,offset+8)
+            offset += 12
+        else:
+            length, = struct.unpack_from('<I',data,offset+4)
+            offset += 8
+        if length == 0xFFFFFFFF:
+            offset = read_dicom_elements(data,offset,explicit)
+            continue
+        if offset+length > len(data):
+            raise IndexError('DICOM header incomplete')
+        if tags is not None and (group,element) in tags:
+            values[tags[(group,element)]] = data[offset:offset+length].decode(
+                'latin-1'
+                ).strip(' \0')
+        offset += length
+
+
+
+def parse_dicom_header(data,tags=DICOM_TAGS):
+    """
+    Return a dict of keyword -> value of the tags found in the start of a
+    DICOM file
+
+    The file meta group is always explicit VR little endian; the dataset
+    follows its transfer syntax. Files without the DICM preamble, big
+    endian and deflated datasets raise ValueError; IndexError means more
+    of the file is needed.
+    """
+    if len(data) >= 132 and data[128:132] != b'DICM':
+        raise ValueError('not a DICOM file')
+    meta = {}
+    offset = read_dicom_elements(
+        data,
+        132,
+        True,
+        {(0x0002,0x0010):'TransferSyntaxUID'},
+        meta,
+        stop=(0x0002,0xFFFF)
+        )
+    transfer_syntax = meta.get('TransferSyntaxUID','')
+    if transfer_syntax in ('1.2.840.10008.1.2.2','1.2.840.10008.1.2.1.99'):
+        raise ValueError(f'unsupported transfer syntax : {transfer_syntax}')
+
+    values = {}
+    read_dicom_elements(
+        data,
+        offset,
+        transfer_syntax != '1.2.840.10008.1.2',
+        tags,
+        values
+        )
+
+    return values
+
+
+
+def read_dicom_header(path,tags=DICOM_TAGS):
+    """
+    Read tags from the header of a DICOM file without reading pixel data
+
+    The first DICOM_READ_SIZE bytes are read, doubling while the tags lie
+    further in, up to DICOM_MAX_READ_SIZE.
+    """
+    with open_file(path) as f:
+        data = f.read(DICOM_READ_SIZE)
+        while True:
+            try:
+                return parse_dicom_header(data,tags)
+            except (IndexError, struct.error):
+                if len(data) >= DICOM_MAX_READ_SIZE:
+                    raise ValueError('DICOM header too long')
+                more = f.read(len(data))
+                if not more:
+                    raise ValueError('DICOM header incomplete')
+                data += more
+
+
+
+def read_dicom_ids(path):
+    """
+    Return the subject id, date and study of a DICOM file for header_check
+    """
+    values = read_dicom_header(path)
+    return {
+        'id':values.get('PatientID',''),
+        'date':values.get('AcquisitionDate') or values.get('ContentDate') \
+            or values.get('StudyDate',''),
+        'study':values.get('StudyInstanceUID') or values.get('StudyID','')
+        }
+
+
+
+def read_text_ids(path):
+    """
+    Return the animal id and date in the header lines of a text export
+    for header_check
+
+    Only the first TEXT_READ_SIZE bytes are read. The first value of each
+    header key counts, so column titles further down the file do not.
+    """
+    with open_file(path) as f:
+        data = f.read(TEXT_READ_SIZE)
+    if b'\0' in data:
+        raise ValueError('not a text file')
+    lines = data.decode('latin-1').splitlines()
+    if len(data) == TEXT_READ_SIZE:
+        # the last line may be cut short by the read
+        lines = lines[:-1]
+
+    fields = {}
+    for line in lines:
+        match = TEXT_HEADER_PATTERN.match(line)
+        if match and match.group(2):
+            fields.setdefault(match.group(1).lower(),match.group(2))
+
+    date = next((fields[k] for k in TEXT_DATE_KEYS if k in fields),'')
+    return {
+        'id':next((fields[k] for k in TEXT_ID_KEYS if k in fields),''),
+        # the date of a date/time value, so files of one session match
+        'date':date.split()[0] if date else ''
+        }
+
+
+
+# header readers used by header_check, by filename ending
+HEADER_READERS = {
+    '.dcm':read_dicom_ids,
+    '.txt':read_text_ids
+    }
+
+
+
+def header_check(
+        passing_files,
+        file_list,
+        readers=None,
+        max_workers=HEADER_WORKERS
+        ):
+    """
+    Check the ids and dates in the headers of the passing files of an audit
+
+    readers maps a filename ending (e.g. '.dcm') to a function returning a
+    dict of 'id', 'date' and optionally 'study' read from the header of a
+    file, given its path or the open file; files with other endings are
+    not read. Headers are read with read_files, on a thread pool and in
+    one pass per archive; the readers only read the start of each file,
+    so the reads are short and spend their time waiting on the file
+    server.
+
+    A file whose header id parses to a different barcode than its filename
+    is an id mismatch; a file whose header holds no id is unreadable, like
+    a file the reader fails on. Files of one mouse and reader should come
+    from one session, so a file whose date differs from the most common
+    date of those files is a date mismatch, and likewise for the study
+    where the reader returns one. Blank dates and studies are not
+    compared, so an export without a date line is not a mismatch. Returns
+    a dict of HEADER_CATEGORIES -> set.
+    """
+    if readers is None:
+        readers = HEADER_READERS
+    files = file_list[file_list['filename'].isin(passing_files)]
+    files = files[
+        files['filename'].str.lower().str.endswith(tuple(readers))
+        ].drop_duplicates('filename')
+
+    def reader_ending(filename):
+        return next(e for e in readers if filename.lower().endswith(e))
+
+    def read_ids(path, f):
+        ending = reader_ending(os.path.basename(path))
+        try:
+            return readers[ending](f)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile, tarfile.TarError):
+            return None
+
+    headers = read_files(read_ids,file_paths(files),max_workers)
+
+    unreadable = set()
+    id_mismatch = set()
+    sessions = {'date':{},'study':{}}
+    for filename, header in zip(files['filename'],headers):
+        if header is None or header['id'] == '':
+            unreadable.add(filename)
+            continue
+        barcode = parse_barcode(filename)
+        if parse_barcode(header['id']) != barcode:
+            id_mismatch.add(f'{filename} : header id {header["id"]}')
+        # files of different instruments come from different sessions
+        session = (barcode,reader_ending(filename))
+        for k in sessions:
+            if header.get(k,'') != '':
+                sessions[k].setdefault(session,[]).append((filename,header[k]))
+
+    mismatches = {}
+    for k, by_session in sessions.items():
+        mismatches[k] = set()
+        for file_values in by_session.values():
+            usual = Counter(v for f,v in file_values).most_common(1)[0][0]
+            for filename, value in file_values:
+                if value != usual:
+                    mismatches[k].add(
+                        f'{filename} : {k} {value}, other files {usual}'
+                        )
+
+    return dict(
+        zip(
+            HEADER_CATEGORIES,
+            [id_mismatch,mismatches['date'],mismatches['study'],unreadable]
+            )
+        )
+
+
+
+def run_audit(
+        mouse_list,
+        file_list,
+        test,
+        integrity=False,
+        headers=False,
+        history=None,
+        directory=None,
+        hash_cache=None,
+        run_log=None,
+        progress=None,
+        check_cancelled=None
+        ):
+    """
+    Audit file_list for test, one of the KOMP_PROTOCOLS or ALL_PROTOCOLS,
+    with the checks every front end runs after it
+
+    The audit is followed by the duplicate filename and near-miss checks,
+    integrity_check of the passing files when integrity is set (cached in
+    hash_cache, by default the HashCache), header_check when headers is
+    set, and the recording of the run of directory in history (an
+    AuditHistory) when one is given. Each step is timed as a run_log
+    stage. progress is called with a message before each step and
+    check_cancelled after it, so a GUI worker can report and stop the run.
+
+    Returns the report, a dict of category -> set or DataFrame, and a dict
+    of protocol -> the REPORT_CATEGORIES and near misses of that protocol.
+    For ALL_PROTOCOLS the report holds the categories of each protocol as
+    'protocol category' and the mouse_test_matrix.
+    """
+    if test not in KOMP_PROTOCOLS and test != ALL_PROTOCOLS:
+        raise ValueError(f'unknown KOMP test : {test}')
+    if run_log is None:
+        run_log = RunLog(path=None)
+    if progress is None:
+        progress = lambda message: None
+    if check_cancelled is None:
+        check_cancelled = lambda: None
+
+    if test == ALL_PROTOCOLS:
+        progress(
+            f'audit stage : comparing {len(file_list)} files to expected '+ \
+            f'filenames of {len(KOMP_PROTOCOLS)} protocols'
+            )
+        with run_log.stage('audit'):
+            reports, matrix = multi_protocol_audit(mouse_list,file_list)
+            duplicates = duplicate_filenames(file_list)
+    else:
+        progress(f'audit stage : comparing {len(file_list)} files to expected filenames')
+        with run_log.stage('audit'):
+            reports = {
+                test:dict(
+                    zip(
+                        REPORT_CATEGORIES,
+                        filename_audit(
+                            mouse_list,
+                            file_list,
+                            **KOMP_PROTOCOLS[test]
+                            )
+                        )
+                    )
+                }
+            duplicates = duplicate_filenames(file_list)
+    check_cancelled()
+
+    progress('audit stage : matching unexpected files to missing files')
+    with run_log.stage('near_miss'):
+        for protocol_report in reports.values():
+            protocol_report[NEAR_MISS_CATEGORIES[0]] = near_miss_files(
+                protocol_report['missing_files'],
+                protocol_report['unexpected_files']
+                )
+    check_cancelled()
+
+    if test == ALL_PROTOCOLS:
+        report = {
+            f'{protocol} {k}':v
+            for protocol, protocol_report in reports.items()
+            for k,v in protocol_report.items()
+            }
+        report['mouse_test_matrix'] = matrix
+    else:
+        report = dict(reports[test])
+    report[DUPLICATE_CATEGORIES[0]] = duplicates
+
+    passing_files = set().union(
+        *[r['passing_files'] for r in reports.values()]
+        )
+    if integrity:
+        progress(f'audit stage : checking integrity of {len(passing_files)} passing files')
+        with run_log.stage('integrity'):
+            report.update(
+                integrity_check(
+                    passing_files,
+                    file_list,
+                    HashCache() if hash_cache is None else hash_cache
+                    )
+                )
+        check_cancelled()
+    if headers:
+        progress(f'audit stage : checking headers of {len(passing_files)} passing files')
+        with run_log.stage('headers'):
+            report.update(header_check(passing_files,file_list))
+        check_cancelled()
+    if history is not None:
+        progress('audit stage : recording run in audit history')
+        with run_log.stage('history'):
+            run_ids, changes = history.record_audit(
+                reports,
+                directory,
+                len(mouse_list)
+                )
+        if changes is not None:
+            report[HISTORY_CATEGORIES[0]] = changes
+
+    return report, reports
+
+
+
+def table_file_name(category):
+    """
+    Return category as a file name part, e.g. 'body comp near_miss_files'
+    -> 'body_comp_near_miss_files'
+    """
+    return '_'.join(category.split())
+
+
+
+def write_report(report,output_path):
+    """
+    Write a report dict of category -> set to output_path
+
+    The format follows the extension of output_path, one of
+    REPORT_FORMATS. Each category is sorted once and its rows are streamed
+    to the file, so no intermediate DataFrame is built. Categories holding
+    a DataFrame (such as the multi_protocol_audit matrix) become their own
+    sheet, or a separate output_path_category file for csv and parquet,
+    with the spaces of 'protocol category' names replaced by '_'.
+    """
+    stem, extension = os.path.splitext(output_path)
+    extension = extension.lower()
+    tables = {
+        k:v for k,v in report.items() if not isinstance(v,(set,frozenset))
+        }
+    report = {k:v for k,v in report.items() if k not in tables}
+    if extension == '.xlsx':
+        write_report_excel(report,output_path,tables=tables)
+    elif extension == '.csv':
+        write_report_csv(report,output_path)
+        for k,v in tables.items():
+            v.to_csv(f'{stem}_{table_file_name(k)}.csv',index=False)
+    elif extension == '.parquet':
+        write_report_parquet(report,output_path)
+        for k,v in tables.items():
+            v.to_parquet(f'{stem}_{table_file_name(k)}.parquet',index=False)
+    else:
+        raise ValueError(f'unsupported report format : {extension}')
+
+
+
+def write_report_excel(report,output_path,max_rows=EXCEL_MAX_ROWS,tables={}):
+    """
+    Write each report category to its own sheet of an Excel workbook
+
+    The workbook is written in xlsxwriter constant_memory mode, which
+    flushes each row to disk as it is written. Categories longer than
+    max_rows continue on sheets named category_2, category_3, ...
+    DataFrames in tables are written with a header row.
+    """
+    import xlsxwriter
+
+    def sheet_name(category,shard):
+        # Excel sheet names are limited to 31 characters
+        suffix = '' if shard == 0 else f'_{shard+1}'
+        return category[:31-len(suffix)]+suffix
+
+    workbook = xlsxwriter.Workbook(output_path,{'constant_memory':True})
+    try:
+        for k,v in report.items():
+            values = sorted(v)
+            for shard, start in enumerate(range(0,max(len(values),1),max_rows)):
+                worksheet = workbook.add_worksheet(sheet_name(k,shard))
+                for row, value in enumerate(values[start:start+max_rows]):
+                    worksheet.write_string(row,0,value)
+        for k,v in tables.items():
+            rows = v.astype(str).itertuples(index=False,name=None)
+            for shard, start in enumerate(range(0,max(len(v),1),max_rows-1)):
+                worksheet = workbook.add_worksheet(sheet_name(k,shard))
+                worksheet.write_row(0,0,[str(c) for c in v.columns])
+                for row in range(1,min(max_rows,len(v)-start+1)):
+                    worksheet.write_row(row,0,next(rows))
+    finally:
+        workbook.close()
+
+
+
+def write_report_csv(report,output_path):
+    """
+    Write the report as category,value rows of a single csv file
+    """
+    with open(output_path,'w',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['category','value'])
+        for k,v in report.items():
+            writer.writerows((k,value) for value in sorted(v))
+
+
+
+def write_report_parquet(report,output_path,chunk_size=REPORT_CHUNK_SIZE):
+    """
+    Write the report as category,value rows of a parquet file
+
+    Rows are written in row groups of chunk_size. Requires pyarrow.
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema(
+        [('category',pyarrow.string()),('value',pyarrow.string())]
+        )
+    with pyarrow.parquet.ParquetWriter(output_path,schema) as writer:
+        for k,v in report.items():
+            values = sorted(v)
+            for start in range(0,len(values),chunk_size):
+                chunk = values[start:start+chunk_size]
+                writer.write_table(
+                    pyarrow.table(
+                        {'category':[k]*len(chunk),'value':chunk},
+                        schema=schema
+                        )
+                    )
+
+def memory_usage():
+    """
+    Return the resident memory of this process in bytes, None if unknown
+
+    Uses psutil when it is installed, otherwise /proc on Linux.
+    """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+
+def format_seconds(seconds):
+    return f'{seconds:.1f}s' if seconds >= 0.1 else f'{seconds*1000:.0f}ms'
+
+
+
+#%% define class
+
+class BarcodeIndex():
+    """
+    Index of barcodes for lookups within a small edit distance
+
+    Every barcode is stored under each variant left by deleting up to
+    max_distance of its characters. Two barcodes within max_distance edits
+    (or adjacent transpositions) of each other share a variant, so search
+    only checks the barcodes found under the variants of the query instead
+    of the whole set.
+    """
+
+    def __init__(self, barcodes=(), max_distance=NEAR_MISS_DISTANCE):
+        self.max_distance = max_distance
+        self.variants = {}
+        for barcode in barcodes:
+            for variant in self.deletions(barcode):
+                self.variants.setdefault(variant, set()).add(barcode)
+
+
+
+    def deletions(self, barcode):
+        variants = {barcode}
+        level = {barcode}
+        for i in range(self.max_distance):
+            level = {v[:j]+v[j+1:] for v in level for j in range(len(v))}
+            variants.update(level)
+        return variants
+
+
+
+    def search(self, barcode):
+        """
+        Return sorted (distance, barcode) pairs of the indexed barcodes
+        within max_distance of barcode
+        """
+        candidates = set()
+        for variant in self.deletions(barcode):
+            candidates.update(self.variants.get(variant, ()))
+        matches = [
+            (edit_distance(barcode, c, self.max_distance), c)
+            for c in candidates
+            ]
+
+        return sorted(m for m in matches if m[0] <= self.max_distance)
+
+
+
+class FileIndex():
+    """
+    Multi-map of filename -> the ScanEntry of every path with that name
+
+    A name found once maps straight to its ScanEntry; only names found
+    more than once keep a list of their further entries, so the index
+    costs no more than a plain dict when names are unique.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = {}
+        self.duplicates = {}
+        self.count = 0
+        self.add(entries)
+
+
+
+    def add(self, entries):
+        for entry in entries:
+            self.count += 1
+            first = self.entries.setdefault(entry.filename, entry)
+            if first is not entry:
+                self.duplicates.setdefault(entry.filename, []).append(entry)
+
+
+
+    def locations(self, filename):
+        """
+        Return the ScanEntry of every path named filename
+        """
+        if filename not in self.entries:
+            return []
+
+        return [self.entries[filename]]+self.duplicates.get(filename, [])
+
+
+
+    def values(self):
+        yield from self.entries.values()
+        for entries in self.duplicates.values():
+            yield from entries
+
+
+
+    def __len__(self):
+        return self.count
+
+
+
+class DirectoryIndex():
+    """
+    A persistent sqlite index of directory listings keyed by path and mtime
+
+    A directory's mtime changes whenever an entry is added, removed or
+    renamed inside it, so a directory whose mtime matches the index can
+    reuse its stored listing instead of being listed again. Edits to the
+    contents of an existing file do not change the directory mtime, so
+    sizes/mtimes of rewritten files may be stale until the folder changes.
+    """
+
+    def __init__(self, index_path=DIRECTORY_INDEX_PATH):
+        self.index_path = index_path
+        self.reused_directories = 0
+        self.rescanned_directories = 0
+
+
+
+    def connect(self):
+        index_directory = os.path.dirname(self.index_path)
+        if index_directory != '':
+            os.makedirs(index_directory, exist_ok=True)
+        # batch workers may scan into the same index at the same time
+        connection = sqlite3.connect(self.index_path, timeout=60)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS directories ('
+            'path TEXT PRIMARY KEY, mtime REAL, subdirectories TEXT)'
+            )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'directory TEXT, filename TEXT, size INTEGER, mtime REAL)'
+            )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS files_directory ON files (directory)'
+            )
+        return connection
+
+
+
+    def load(self, connection, root):
+        """
+        Load the stored listings for root and everything below it
+
+        Returns a dict of directory -> (mtime, subdirectories, files).
+        """
+        # range query on the primary key selects root and its descendants
+        lower = os.path.join(root,'')
+        upper = lower[:-1]+chr(ord(lower[-1])+1)
+        stored = {}
+        # directory -> the string shared by its ScanEntry
+        directories = {}
+        for path, mtime, subdirectories in connection.execute(
+                'SELECT path, mtime, subdirectories FROM directories '
+                'WHERE path = ? OR (path >= ? AND path < ?)',
+                (root,lower,upper)
+                ):
+            stored[path] = (mtime, json.loads(subdirectories), [])
+            directories[path] = path
+        for directory, filename, size, mtime in connection.execute(
+                'SELECT directory, filename, size, mtime FROM files '
+                'WHERE directory = ? OR (directory >= ? AND directory < ?)',
+                (root,lower,upper)
+                ):
+            if directory in stored:
+                stored[directory][2].append(
+                    ScanEntry(
+                        filename,
+                        directories[directory],
+                        size,
+                        mtime
+                        )
+                    )
+        return stored
+
+
+
+    def save(self, connection, root, stored, updates, visited):
+        with connection:
+            for d in set(stored).difference(visited):
+                connection.execute(
+                    'DELETE FROM directories WHERE path = ?', (d,)
+                    )
+                connection.execute(
+                    'DELETE FROM files WHERE directory = ?', (d,)
+                    )
+            for d,(mtime, subdirectories, files) in updates.items():
+                connection.execute(
+                    'INSERT OR REPLACE INTO directories VALUES (?,?,?)',
+                    (d, mtime, json.dumps(subdirectories))
+                    )
+                connection.execute(
+                    'DELETE FROM files WHERE directory = ?', (d,)
+                    )
+                connection.executemany(
+                    'INSERT INTO files VALUES (?,?,?,?)',
+                    [(d, f.filename, f.size, f.mtime) for f in files]
+                    )
+
+
+
+    def scan(
+            self,
+            root,
+            max_workers=SCAN_WORKERS,
+            batch_size=SCAN_BATCH_SIZE,
+            progress=None
+            ):
+        """
+        Scan root like scan_directory, reusing unchanged directory listings
+
+        Only directories whose mtime differs from the index are listed
+        again; the index is updated once the scan has completed. After the
+        scan, reused_directories and rescanned_directories hold the counts.
+        """
+        root = os.path.normpath(root)
+        connection = self.connect()
+        try:
+            stored = self.load(connection, root)
+            updates = {}
+            visited = set()
+
+            def indexed_lister(directory):
+                # archive listings are read again, their members are not
+                # stored in the index
+                if is_archive(directory) and os.path.isfile(directory):
+                    return list_directory(directory)
+                visited.add(directory)
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError:
+                    return [], []
+                if directory in stored and stored[directory][0] == mtime:
+                    return stored[directory][2], stored[directory][1]
+                files, subdirectories = list_directory(directory)
+                updates[directory] = (mtime, subdirectories, files)
+                return files, subdirectories
+
+            yield from scan_directory(
+                root,
+                max_workers,
+                batch_size,
+                lister=indexed_lister,
+                progress=progress
+                )
+
+            self.rescanned_directories = len(updates)
+            self.reused_directories = len(visited) - len(updates)
+            self.save(connection, root, stored, updates, visited)
+        finally:
+            connection.close()
+
+
+
+class HashCache():
+    """
+    A persistent sqlite cache of file checksums keyed by (path, size, mtime)
+
+    Stored in the same database as the DirectoryIndex by default.
+    """
+
+    def __init__(self, index_path=DIRECTORY_INDEX_PATH):
+        self.index_path = index_path
+
+
+
+    def connect(self):
+        index_directory = os.path.dirname(self.index_path)
+        if index_directory != '':
+            os.makedirs(index_directory, exist_ok=True)
+        # parallel --integrity batch jobs share the cache
+        connection = sqlite3.connect(self.index_path, timeout=60)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS file_hashes ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT)'
+            )
+        return connection
+
+
+
+    def lookup(self, keys, chunk_size=500):
+        """
+        Return {path: digest} for the (path, size, mtime) keys whose size
+        and mtime match the cache
+        """
+        wanted = {path:(size, mtime) for path, size, mtime in keys}
+        paths = list(wanted)
+        digests = {}
+        connection = self.connect()
+        try:
+            for start in range(0,len(paths),chunk_size):
+                chunk = paths[start:start+chunk_size]
+                for path, size, mtime, digest in connection.execute(
+                        'SELECT path, size, mtime, digest FROM file_hashes '
+                        f'WHERE path IN ({",".join("?"*len(chunk))})',
+                        chunk
+                        ):
+                    if wanted[path] == (size, mtime):
+                        digests[path] = digest
+        finally:
+            connection.close()
+
+        return digests
+
+
+
+    def store(self, entries):
+        """
+        Add (path, size, mtime, digest) entries to the cache
+        """
+        if not entries:
+            return
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO file_hashes VALUES (?,?,?,?)',
+                    entries
+                    )
+        finally:
+            connection.close()
+
+
+
+class AuditHistory():
+    """
+    A sqlite store of audit runs and the status of every file and mouse
+    in each run
+
+    Statuses are indexed by barcode, and runs by protocol and directory, so
+    the history of one mouse and the previous audit of a directory are
+    found without reading the other runs.
+    """
+
+    # status of a mouse found in several report categories - first wins
+    MOUSE_STATUS_ORDER = ['missing','unexpected','passing']
+
+    def __init__(self, history_path=AUDIT_HISTORY_PATH):
+        self.history_path = history_path
+
+
+
+    def connect(self):
+        history_directory = os.path.dirname(self.history_path)
+        if history_directory != '':
+            os.makedirs(history_directory, exist_ok=True)
+        # batch workers may record runs at the same time
+        connection = sqlite3.connect(self.history_path, timeout=60)
+        connection.executescript(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            'run_id INTEGER PRIMARY KEY, started TEXT, protocol TEXT, '
+            'directory TEXT, files INTEGER, animals INTEGER);'
+            'CREATE TABLE IF NOT EXISTS file_status ('
+            'run_id INTEGER, filename TEXT, barcode TEXT, status TEXT);'
+            'CREATE TABLE IF NOT EXISTS mouse_status ('
+            'run_id INTEGER, barcode TEXT, status TEXT);'
+            'CREATE INDEX IF NOT EXISTS runs_protocol '
+            'ON runs (protocol, directory, run_id);'
+            'CREATE INDEX IF NOT EXISTS file_status_run '
+            'ON file_status (run_id);'
+            'CREATE INDEX IF NOT EXISTS file_status_barcode '
+            'ON file_status (barcode, run_id);'
+            'CREATE INDEX IF NOT EXISTS mouse_status_run '
+            'ON mouse_status (run_id);'
+            'CREATE INDEX IF NOT EXISTS mouse_status_barcode '
+            'ON mouse_status (barcode, run_id);'
+            )
+        return connection
+
+
+
+    def record(self, report, protocol, directory, animals=None, started=None):
+        """
+        Store a filename_audit report (keyed by REPORT_CATEGORIES) as a new
+        run of protocol over directory and return its run_id
+        """
+        import pandas
+
+        files = {}
+        for category in ['passing_files','unexpected_files','missing_files']:
+            # later categories take precedence
+            files.update(dict.fromkeys(report[category],category.split('_')[0]))
+        filenames = pandas.Series(list(files),dtype=object)
+        barcodes = parse_filenames(filenames)['barcode']
+        barcodes = barcodes.astype(object).where(barcodes.notna(),None)
+
+        mice = {}
+        for status in reversed(self.MOUSE_STATUS_ORDER):
+            mice.update(dict.fromkeys(report[f'{status}_mice'],status))
+
+        if started is None:
+            started = time.strftime('%Y-%m-%d %H:%M:%S')
+        connection = self.connect()
+        try:
+            with connection:
+                run_id = connection.execute(
+                    'INSERT INTO runs '
+                    '(started, protocol, directory, files, animals) '
+                    'VALUES (?,?,?,?,?)',
+                    (
+                        started,
+                        protocol,
+                        os.path.normpath(os.path.abspath(directory)),
+                        len(files),
+                        animals
+                        )
+                    ).lastrowid
+                connection.executemany(
+                    'INSERT INTO file_status VALUES (?,?,?,?)',
+                    zip(
+                        [run_id]*len(files),
+                        filenames.tolist(),
+                        barcodes.tolist(),
+                        files.values()
+                        )
+                    )
+                connection.executemany(
+                    'INSERT INTO mouse_status VALUES (?,?,?)',
+                    [(run_id, barcode, status) for barcode, status in mice.items()]
+                    )
+        finally:
+            connection.close()
+
+        return run_id
+
+
+
+    def runs(self, directory=None, protocol=None):
+        """
+        Return a DataFrame of the recorded runs, optionally only those of
+        one directory and/or protocol, oldest first
+        """
+        import pandas
+
+        conditions, values = [], []
+        if directory is not None:
+            conditions.append('directory = ?')
+            values.append(os.path.normpath(os.path.abspath(directory)))
+        if protocol is not None:
+            conditions.append('protocol = ?')
+            values.append(protocol)
+        where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+        connection = self.connect()
+        try:
+            return pandas.read_sql_query(
+                f'SELECT * FROM runs {where}ORDER BY run_id',
+                connection,
+                params=values
+                )
+        finally:
+            connection.close()
+
+
+
+    def previous_run(self, run_id):
+        """
+        Return the run_id of the audit before run_id of the same protocol
+        and directory, or None
+        """
+        connection = self.connect()
+        try:
+            previous = connection.execute(
+                'SELECT p.run_id FROM runs r JOIN runs p '
+                'ON p.protocol = r.protocol AND p.directory = r.directory '
+                'AND p.run_id < r.run_id '
+                'WHERE r.run_id = ? ORDER BY p.run_id DESC LIMIT 1',
+                (run_id,)
+                ).fetchone()
+        finally:
+            connection.close()
+
+        return None if previous is None else previous[0]
+
+
+
+    def diff(self, run_id, previous_run_id=None):
+        """
+        Return a DataFrame of the files and mice whose status changed since
+        previous_run_id (by default the previous audit of the same protocol
+        and directory), with name, type, previous and current columns
+
+        Names missing from one of the runs have a blank status there.
+        Returns None when there is no previous run.
+        """
+        import pandas
+
+        if previous_run_id is None:
+            previous_run_id = self.previous_run(run_id)
+        if previous_run_id is None:
+            return None
+
+        changes = []
+        connection = self.connect()
+        try:
+            for kind, query in [
+                    ('file','SELECT filename, status FROM file_status '
+                        'WHERE run_id = ?'),
+                    ('mouse','SELECT barcode, status FROM mouse_status '
+                        'WHERE run_id = ?')
+                    ]:
+                previous = dict(connection.execute(query,(previous_run_id,)))
+                current = dict(connection.execute(query,(run_id,)))
+                for name in previous.keys() | current.keys():
+                    if previous.get(name) != current.get(name):
+                        changes.append(
+                            (
+                                name,
+                                kind,
+                                previous.get(name,''),
+                                current.get(name,'')
+                                )
+                            )
+        finally:
+            connection.close()
+
+        return pandas.DataFrame(
+            sorted(changes,key=lambda change: (change[1],change[0])),
+            columns=['name','type','previous','current']
+            )
+
+
+
+    def mouse_history(self, barcode):
+        """
+        Return a DataFrame of every recorded status of one mouse, oldest
+        first, with run_id, started, protocol, directory and status columns
+        """
+        import pandas
+
+        connection = self.connect()
+        try:
+            return pandas.read_sql_query(
+                'SELECT r.run_id, r.started, r.protocol, r.directory, m.status '
+                'FROM mouse_status m JOIN runs r ON r.run_id = m.run_id '
+                'WHERE m.barcode = ? ORDER BY r.run_id',
+                connection,
+                params=[barcode]
+                )
+        finally:
+            connection.close()
+
+
+
+    def latest_status(self, barcode):
+        """
+        Return the mouse's status in the latest audit of each protocol that
+        included it, so the tests still missing are those with status
+        'missing'
+        """
+        history = self.mouse_history(barcode)
+        latest = history.drop_duplicates('protocol',keep='last')
+
+        return latest.sort_values('protocol').reset_index(drop=True)[
+            ['protocol','status','started','directory','run_id']
+            ]
+
+
+
+    def missing_tests(self, barcode):
+        """
+        Return the sorted protocols the mouse is still missing files for
+        """
+        latest = self.latest_status(barcode)
+
+        return sorted(latest.loc[latest['status'] == 'missing','protocol'])
+
+
+
+    def record_audit(self, reports, directory, animals=None):
+        """
+        Record each protocol -> report of one audit as a run and diff it
+        against the previous audit of the same protocol and directory
+
+        Returns the run_ids and a DataFrame of the changes (as diff, with a
+        test column), or None when no protocol has a previous audit.
+        """
+        import pandas
+
+        started = time.strftime('%Y-%m-%d %H:%M:%S')
+        run_ids, changes = [], []
+        for test, report in reports.items():
+            run_id = self.record(report, test, directory, animals, started)
+            run_ids.append(run_id)
+            test_changes = self.diff(run_id)
+            if test_changes is not None:
+                changes.append(test_changes.assign(test=test))
+        if not changes:
+            return run_ids, None
+
+        return run_ids, pandas.concat(changes, ignore_index=True)
+
+
+
+class IncrementalAudit():
+    """
+    filename_audit results kept up to date as files appear and disappear
+    and as mice are added to or removed from the animal list
+
+    Built once from a full audit; afterwards add_files, remove_files,
+    add_mice and remove_mice only touch the changed filenames and recompute
+    the mouse status of their barcodes from per-barcode file counts.
+    results() matches filename_audit over the current file and animal
+    lists.
+    """
+
+    def __init__(
+            self,
+            mouse_list,
+            file_list,
+            file_suffixes,
+            basename_length,
+            assignment=None
+            ):
+        self.file_suffixes = file_suffixes
+        self.basename_length = basename_length
+        self.assignment = assignment
+        expected = expected_file_table(
+            mouse_list,
+            file_suffixes,
+            basename_length,
+            assignment,
+            unique=False
+            )
+        # filename -> number of listed mice expecting it
+        self.expected_counts = Counter(expected['filename'].tolist())
+        expected = expected.drop_duplicates('filename')
+        # mouse id -> number of times it is listed
+        self.mouse_ids = Counter(
+            mouse_list['parsed_mouse_list'].astype(str).tolist()
+            )
+        actual = actual_file_table(file_list)
+        # filename -> barcode of the mouse it is expected for
+        self.expected = dict(zip(expected['filename'],expected['barcode']))
+        # filename -> parsed barcode, for files present
+        self.barcodes = dict(zip(actual['filename'],actual['barcode']))
+        # filename -> number of paths with that name
+        self.path_counts = Counter(file_list['filename'].astype(str).tolist())
+
+        (
+            self.passing_files,
+            self.missing_files,
+            self.unexpected_files,
+            self.passing_mice,
+            self.missing_mice,
+            self.unexpected_mice
+            ) = compare_file_tables(expected,actual)
+
+        self.passing_count = Counter(
+            self.barcodes[f] for f in self.passing_files
+            )
+        self.missing_count = Counter(
+            self.expected[f] for f in self.missing_files
+            )
+        self.unexpected_count = Counter(
+            self.barcodes[f] for f in self.unexpected_files
+            )
+
+
+
+    def add_files(self, filenames):
+        """
+        Record new file paths by filename; returns the affected barcodes
+        """
+        affected = set()
+        for f in filenames:
+            self.path_counts[f] += 1
+            if self.path_counts[f] > 1:
+                continue
+            barcode = parse_barcode(f)
+            self.barcodes[f] = barcode
+            if f in self.expected:
+                self.missing_files.discard(f)
+                self.missing_count[self.expected[f]] -= 1
+                self.passing_files.add(f)
+                self.passing_count[barcode] += 1
+                affected.update([self.expected[f],barcode])
+            else:
+                self.unexpected_files.add(f)
+                self.unexpected_count[barcode] += 1
+                affected.add(barcode)
+        self.update_mice(affected)
+
+        return affected
+
+
+
+    def remove_files(self, filenames):
+        """
+        Record removed file paths by filename; returns the affected barcodes
+        """
+        affected = set()
+        for f in filenames:
+            if self.path_counts[f] == 0:
+                continue
+            self.path_counts[f] -= 1
+            if self.path_counts[f] > 0:
+                continue
+            del self.path_counts[f]
+            barcode = self.barcodes.pop(f)
+            if f in self.expected:
+                self.passing_files.discard(f)
+                self.passing_count[barcode] -= 1
+                self.missing_files.add(f)
+                self.missing_count[self.expected[f]] += 1
+                affected.update([self.expected[f],barcode])
+            else:
+                self.unexpected_files.discard(f)
+                self.unexpected_count[barcode] -= 1
+                affected.add(barcode)
+        self.update_mice(affected)
+
+        return affected
+
+
+
+    def expected_rows(self, mouse_ids):
+        """
+        Return the (filename, barcode) rows expected for mouse_ids, once
+        per listed mouse
+        """
+        import pandas
+
+        if len(mouse_ids) == 0:
+            return []
+        expected = expected_file_table(
+            pandas.DataFrame({'parsed_mouse_list':list(mouse_ids)}),
+            self.file_suffixes,
+            self.basename_length,
+            self.assignment,
+            unique=False
+            )
+
+        return list(zip(expected['filename'],expected['barcode']))
+
+
+
+    def add_mice(self, mouse_ids):
+        """
+        Record mouse ids added to the animal list; returns the affected
+        barcodes
+        """
+        mouse_ids = [str(m) for m in mouse_ids]
+        self.mouse_ids.update(mouse_ids)
+        affected = set()
+        for f, barcode in self.expected_rows(mouse_ids):
+            self.expected_counts[f] += 1
+            if self.expected_counts[f] > 1:
+                continue
+            self.expected[f] = barcode
+            if self.path_counts[f] > 0:
+                self.unexpected_files.discard(f)
+                self.unexpected_count[self.barcodes[f]] -= 1
+                self.passing_files.add(f)
+                self.passing_count[self.barcodes[f]] += 1
+                affected.update([barcode,self.barcodes[f]])
+            else:
+                self.missing_files.add(f)
+                self.missing_count[barcode] += 1
+                affected.add(barcode)
+        self.update_mice(affected)
+
+        return affected
+
+
+
+    def remove_mice(self, mouse_ids):
+        """
+        Record mouse ids removed from the animal list; returns the affected
+        barcodes. Ids that are not listed are ignored.
+        """
+        removed = []
+        for m in mouse_ids:
+            m = str(m)
+            if self.mouse_ids[m] == 0:
+                continue
+            self.mouse_ids[m] -= 1
+            if self.mouse_ids[m] == 0:
+                del self.mouse_ids[m]
+            removed.append(m)
+        affected = set()
+        for f, barcode in self.expected_rows(removed):
+            self.expected_counts[f] -= 1
+            if self.expected_counts[f] > 0:
+                continue
+            del self.expected_counts[f]
+            del self.expected[f]
+            if self.path_counts[f] > 0:
+                self.passing_files.discard(f)
+                self.passing_count[self.barcodes[f]] -= 1
+                self.unexpected_files.add(f)
+                self.unexpected_count[self.barcodes[f]] += 1
+                affected.update([barcode,self.barcodes[f]])
+            else:
+                self.missing_files.discard(f)
+                self.missing_count[barcode] -= 1
+                affected.add(barcode)
+        self.update_mice(affected)
+
+        return affected
+
+
+
+    def update_mouse_list(self, mouse_list):
+        """
+        Apply the differences between mouse_list and the animal list last
+        audited; returns the affected barcodes
+        """
+        mouse_ids = Counter(mouse_list['parsed_mouse_list'].astype(str).tolist())
+        removed = self.mouse_ids - mouse_ids
+        added = mouse_ids - self.mouse_ids
+
+        return self.remove_mice(removed.elements()) | \
+            self.add_mice(added.elements())
+
+
+
+    def update_mice(self, barcodes):
+        for b in barcodes:
+            if b is None:
+                continue
+            for mice, count in [
+                    (self.missing_mice, self.missing_count),
+                    (self.unexpected_mice, self.unexpected_count)
+                    ]:
+                if count[b] > 0:
+                    mice.add(b)
+                else:
+                    mice.discard(b)
+            if self.passing_count[b] > 0 and \
+                    b not in self.missing_mice and \
+                    b not in self.unexpected_mice:
+                self.passing_mice.add(b)
+            else:
+                self.passing_mice.discard(b)
+
+
+
+    def results(self):
+        return self.passing_files, self.missing_files, self.unexpected_files, \
+            self.passing_mice, self.missing_mice, self.unexpected_mice
+
+
+
+class WatchEventHandler():
+    """
+    watchdog event handler forwarding file system events to a FileWatcher
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+
+
+    def dispatch(self, event):
+        if event.event_type == 'created':
+            if event.is_directory:
+                self.watcher.add_directory(event.src_path)
+            else:
+                self.watcher.add_file(event.src_path)
+        elif event.event_type == 'deleted':
+            # deleted directories are not always flagged as such
+            self.watcher.remove_file(event.src_path)
+            self.watcher.remove_directory(event.src_path)
+        elif event.event_type == 'moved':
+            self.watcher.remove_file(event.src_path)
+            self.watcher.remove_directory(event.src_path)
+            if os.path.isdir(event.dest_path):
+                self.watcher.add_directory(event.dest_path)
+            else:
+                self.watcher.add_file(event.dest_path)
+
+
+
+class FileWatcher():
+    """
+    Keep an in-memory index of the files below root up to date
+
+    Uses watchdog (inotify on Linux, ReadDirectoryChangesW on Windows) when
+    it is installed. Otherwise a polling thread stats every known directory
+    each poll_interval and relists only those whose mtime changed. Changes
+    are queued as ('created', ScanEntry) and ('deleted', ScanEntry) and
+    collected with get_changes. entries seeds the index from an earlier
+    scan so starting a watch does not need a full walk. ready is set once
+    files holds the tree as it is now, after the first walk when polling.
+    """
+
+    def __init__(
+            self,
+            root,
+            entries=(),
+            poll_interval=WATCH_POLL_INTERVAL,
+            use_watchdog=True
+            ):
+        self.root = os.path.normpath(root)
+        self.files = {e.path:e for e in entries}
+        self.poll_interval = poll_interval
+        self.use_watchdog = use_watchdog
+        self.changes = queue.Queue()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.ready = threading.Event()
+        self.observer = None
+        self.poll_thread = None
+        self.mode = None
+
+
+
+    def start(self):
+        Observer = None
+        if self.use_watchdog:
+            try:
+                from watchdog.observers import Observer
+            except ImportError:
+                pass
+
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(
+                WatchEventHandler(self),
+                self.root,
+                recursive=True
+                )
+            self.observer.start()
+            self.mode = 'watchdog'
+            self.ready.set()
+        else:
+            self.poll_thread = threading.Thread(target=self.poll,daemon=True)
+            self.poll_thread.start()
+            self.mode = 'polling'
+
+
+
+    def stop(self):
+        self.stop_event.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        if self.poll_thread is not None:
+            self.poll_thread.join()
+
+
+
+    def add_entry(self, entry):
+        with self.lock:
+            known = entry.path in self.files
+            self.files[entry.path] = entry
+        if not known:
+            self.changes.put(('created',entry))
+
+
+
+    def add_file(self, path):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return
+        self.add_entry(
+            ScanEntry(
+                os.path.basename(path),
+                os.path.dirname(path),
+                stat_result.st_size,
+                stat_result.st_mtime
+                )
+            )
+
+
+
+    def remove_file(self, path):
+        with self.lock:
+            entry = self.files.pop(path,None)
+        if entry is not None:
+            self.changes.put(('deleted',entry))
+
+
+
+    def add_directory(self, directory):
+        for d, files in scandir_walk(directory):
+            for f in files:
+                self.add_entry(f)
+
+
+
+    def remove_directory(self, directory):
+        prefix = os.path.join(directory,'')
+        with self.lock:
+            removed = [
+                self.files.pop(p) for p in list(self.files)
+                if p.startswith(prefix)
+                ]
+        for entry in removed:
+            self.changes.put(('deleted',entry))
+
+
+
+    def poll(self):
+        # directory -> (mtime, file paths, subdirectories) as last listed
+        listings = {}
+
+        def recording_lister(directory):
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                return [], []
+            files, subdirectories = list_directory(directory)
+            listings[directory] = (
+                mtime,
+                {f.path for f in files},
+                subdirectories
+                )
+            return files, subdirectories
+
+        def directory_mtime(directory):
+            try:
+                return os.stat(directory).st_mtime
+            except OSError:
+                return None
+
+        # reconcile the seeded index with the tree as it is now
+        found = set()
+        for d, files in scandir_walk(self.root,lister=recording_lister):
+            for f in files:
+                found.add(f.path)
+                self.add_entry(f)
+        with self.lock:
+            vanished = set(self.files).difference(found)
+        for path in vanished:
+            self.remove_file(path)
+        self.ready.set()
+
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            while not self.stop_event.wait(self.poll_interval):
+                directories = list(listings)
+                for directory, mtime in zip(
+                        directories,
+                        executor.map(directory_mtime,directories)
+                        ):
+                    if directory not in listings:
+                        continue
+                    if mtime is None:
+                        prefix = os.path.join(directory,'')
+                        for d in [
+                                d for d in listings
+                                if d == directory or d.startswith(prefix)
+                                ]:
+                            del listings[d]
+                        self.remove_directory(directory)
+                        continue
+                    if mtime == listings[directory][0]:
+                        continue
+
+                    old_files = listings[directory][1]
+                    old_subdirectories = set(listings[directory][2])
+                    files, subdirectories = recording_lister(directory)
+                    for f in files:
+                        if f.path not in old_files:
+                            self.add_entry(f)
+                    new_paths = {f.path for f in files}
+                    for path in old_files.difference(new_paths):
+                        self.remove_file(path)
+                    for s in set(subdirectories).difference(old_subdirectories):
+                        for d, files in scandir_walk(s,lister=recording_lister):
+                            for f in files:
+                                self.add_entry(f)
+
+
+
+    def get_changes(self, timeout):
+        """
+        Wait up to timeout for a change, then collect the changes arriving
+        within WATCH_SETTLE_TIME of each other, for at most five times that
+
+        Returns a list of (kind, ScanEntry) in the order they happened.
+        """
+        changes = []
+        try:
+            changes.append(self.changes.get(timeout=timeout))
+            # keep a steady stream of events from delaying updates forever
+            batch_end = time.monotonic() + 5*WATCH_SETTLE_TIME
+            while time.monotonic() < batch_end:
+                changes.append(self.changes.get(timeout=WATCH_SETTLE_TIME))
+        except queue.Empty:
+            pass
+
+        return changes
+
+
+
+class RunLog():
+    """
+    Timing spans and peak memory of the stages of one audit run
+
+    Each stage is timed with
+
+        with run_log.stage('scan'):
+            ...
+
+    while a background thread samples the process memory, so stages may
+    run on any thread. save appends the run as one JSON line to path.
+    """
+
+    def __init__(
+            self,
+            path=RUN_LOG_PATH,
+            sample_interval=MEMORY_SAMPLE_INTERVAL,
+            **details
+            ):
+        self.path = path
+        self.sample_interval = sample_interval
+        self.details = details
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.stages = []
+        self.lock = threading.Lock()
+
+
+
+    @contextmanager
+    def stage(self, name):
+        samples = [memory_usage()]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.sample_interval):
+                samples.append(memory_usage())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        status = 'ok'
+        start_time = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start_time
+            stop.set()
+            sampler.join()
+            samples.append(memory_usage())
+            samples = [m for m in samples if m is not None]
+            with self.lock:
+                self.stages.append(
+                    {
+                        'stage':name,
+                        'seconds':round(seconds,4),
+                        'peak_mb':round(max(samples)/2**20,1) if samples else None,
+                        'status':status
+                        }
+                    )
+
+
+
+    def summary(self):
+        """
+        Return a one line summary such as 'scan 12.3s / audit 0.4s'
+        """
+        with self.lock:
+            return ' / '.join(
+                f'{s["stage"]} {format_seconds(s["seconds"])}'
+                for s in self.stages
+                )
+
+
+
+    def record(self):
+        with self.lock:
+            return {
+                'started':self.started,
+                **self.details,
+                'total_seconds':round(sum(s['seconds'] for s in self.stages),4),
+                'peak_mb':max(
+                    [s['peak_mb'] for s in self.stages if s['peak_mb'] is not None],
+                    default=None
+                    ),
+                'stages':list(self.stages)
+                }
+
+
+
+    def save(self):
+        """
+        Append the run to the JSON lines log at path
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),exist_ok=True)
+        with open(self.path,'a') as f:
+            f.write(json.dumps(self.record())+'\n')
@@ -0,0 +1,626 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP/JSON audit service for the KOMP file audit
+
+Keeps a warm scan index of each directory it is asked about, so several
+workstations auditing the same share are answered from memory instead of
+each walking the file server. A directory is walked once on its first
+request; after that a request finding its file list older than the
+refresh age checks it again through the DirectoryIndex, which stats its
+folders and relists only those that changed. Nothing runs between
+requests, so an idle directory puts no load on the file server. Endpoints
+
+    GET  /status - watched directories, file counts and index ages
+    GET  /files?directory=DIR - the file list of DIR, as columns
+    POST /audit - {"directory":DIR, "test":TEST, "animals":[ids]}
+
+/audit runs filename_audit for one of the KOMP_PROTOCOLS (or 'all
+protocols') and returns each report category as a sorted list, or a list
+of records for table categories. Reports are cached until the directory
+changes. Paths are resolved on the service host, so every workstation
+should name a share by the same path (e.g. its UNC path).
+
+The GUI fetches its file list from /files when an audit service URL is
+set; request_file_list and request_audit are the client side for scripts.
+
+usage:
+    python KOMP_Audit_Service.py [--host HOST] [--port PORT] [--allow DIR ...]
+        [--refresh-age SECONDS]
+"""
+
+#%% import libraries
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from KOMP_Audit_Core import FileWatcher, DirectoryIndex, ScanEntry
+from KOMP_Audit_Core import file_list_frame, parse_animal_text, run_audit
+from KOMP_Audit_Core import KOMP_PROTOCOLS, ALL_PROTOCOLS
+import urllib.request
+import urllib.parse
+import urllib.error
+import importlib.util
+import argparse
+import threading
+import queue
+import gzip
+import json
+import time
+import sys
+import os
+
+#%% define constants
+
+# port the service listens on
+SERVICE_PORT = 8765
+
+# seconds a file list is served as it is before a request checks its
+# directory for changes again; a check stats every folder of the tree, so
+# clients requesting a directory many times in a row share one check
+SERVICE_REFRESH_AGE = 5.0
+
+# seconds a directory's file list is kept in memory without being requested
+SERVICE_IDLE_TIMEOUT = 3600
+
+# audit reports kept per directory until its files change
+SERVICE_CACHED_AUDITS = 16
+
+# seconds a client waits for a response; the first request for a
+# directory waits for its walk
+SERVICE_TIMEOUT = 600
+
+
+
+#%% define functions
+
+def report_json(report):
+    """
+    Return a report dict with sets as sorted lists and DataFrames as lists
+    of records, ready for json.dumps
+    """
+    return {
+        k:v.to_dict('records') if hasattr(v,'to_dict') else sorted(v)
+        for k,v in report.items()
+        }
+
+
+
+def audit_report(file_list,test,animals):
+    """
+    Audit file_list for test against a list of animal ids with run_audit
+
+    The report holds the categories of a batch job without its optional
+    integrity, header and history checks.
+    """
+    import pandas
+
+    mouse_list = pandas.DataFrame(
+        {'parsed_mouse_list':parse_animal_text('\n'.join(animals))}
+        )
+    report, reports = run_audit(mouse_list,file_list,test)
+
+    return report
+
+
+
+def audit_request(payload):
+    """
+    Return the directory, test and animals of an /audit request body,
+    raising ValueError if any is missing or of the wrong type
+    """
+    if not isinstance(payload,dict):
+        raise ValueError('request body must be a JSON object')
+    directory = payload.get('directory')
+    test = payload.get('test')
+    animals = payload.get('animals')
+    if not isinstance(directory,str):
+        raise ValueError('directory must be a string')
+    if not isinstance(test,str) or \
+            test != ALL_PROTOCOLS and test not in KOMP_PROTOCOLS:
+        raise ValueError(f'unknown KOMP test : {test}')
+    if not isinstance(animals,list) or \
+            not all(isinstance(a,str) for a in animals):
+        raise ValueError('animals must be a list of strings')
+
+    return directory, test, animals
+
+
+
+def service_request(service_url,path,payload=None,timeout=SERVICE_TIMEOUT):
+    """
+    Send a request to an audit service and return the decoded JSON reply
+
+    A payload is sent as a JSON POST. Errors reported by the service are
+    raised as ValueError with the service's message, and a service that
+    cannot be reached as OSError.
+    """
+    request = urllib.request.Request(
+        service_url.rstrip('/')+path,
+        data=None if payload is None else json.dumps(payload).encode(),
+        headers={'Accept-Encoding':'gzip','Content-Type':'application/json'}
+        )
+    try:
+        with urllib.request.urlopen(request,timeout=timeout) as response:
+            body = response.read()
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read())['error']
+        except (ValueError, KeyError):
+            message = str(e)
+        raise ValueError(f'audit service : {message}')
+    except urllib.error.URLError as e:
+        raise OSError(f'audit service unreachable : {e.reason}')
+
+    return json.loads(body)
+
+
+
+def request_file_list(service_url,directory,timeout=SERVICE_TIMEOUT):
+    """
+    Return the file_list DataFrame of directory as indexed by an audit
+    service
+    """
+    files = service_request(
+        service_url,
+        '/files?'+urllib.parse.urlencode({'directory':directory}),
+        timeout=timeout
+        )
+    directories = files['directories']
+
+    return file_list_frame(
+        [
+            ScanEntry(filename,directories[d],size,mtime)
+            for filename, d, size, mtime in zip(
+                files['filename'],
+                files['directory'],
+                files['size'],
+                files['mtime']
+                )
+            ]
+        )
+
+
+
+def request_audit(service_url,directory,test,animals,timeout=SERVICE_TIMEOUT):
+    """
+    Audit directory on an audit service
+
+    Returns a dict of report category -> sorted list, or list of records
+    for table categories.
+    """
+    return service_request(
+        service_url,
+        '/audit',
+        {'directory':directory,'test':test,'animals':list(animals)},
+        timeout=timeout
+        )['report']
+
+
+
+#%% define classes
+
+class WatchedDirectory():
+    """
+    The warm scan index of one directory served by the audit service
+
+    A request finding the file list older than refresh_age scans the
+    directory with directory_index, which reuses the listing of every
+    folder whose mtime is unchanged, so a check costs one stat per folder.
+    With watchdog installed and use_watchdog, a FileWatcher keeps the
+    files up to date from file events instead. The file list is rebuilt
+    only when the files changed; version counts the rebuilds, and the
+    encoded file list and cached audit reports belong to the current
+    version.
+    """
+
+    def __init__(
+            self,
+            root,
+            refresh_age=SERVICE_REFRESH_AGE,
+            use_watchdog=False,
+            directory_index=None
+            ):
+        self.root = root
+        self.refresh_age = refresh_age
+        self.use_watchdog = use_watchdog
+        self.directory_index = DirectoryIndex() if directory_index is None \
+            else directory_index
+        self.watcher = None
+        self.lock = threading.Lock()
+        self.entries = None
+        self.checked = None
+        self.file_list = None
+        self.version = 0
+        self.refreshed = None
+        self.files_body = None
+        self.audits = {}
+        self.last_used = time.monotonic()
+
+
+
+    def scan(self):
+        entries = []
+        for batch in self.directory_index.scan(self.root):
+            entries.extend(batch)
+        self.checked = time.monotonic()
+        return entries
+
+
+
+    def start(self):
+        if importlib.util.find_spec('watchdog') is None:
+            # without watchdog the directory is checked on request
+            self.use_watchdog = False
+            return
+        # watchdog only reports changes, so it is seeded with a scan
+        self.watcher = FileWatcher(self.root,self.scan())
+        self.watcher.start()
+
+
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+
+
+
+    def current(self):
+        """
+        Return the file_list and its version, rebuilt if files changed
+        since the last request
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            if self.use_watchdog and self.watcher is None:
+                self.start()
+            changed = self.file_list is None
+            if self.watcher is not None:
+                try:
+                    while True:
+                        self.watcher.changes.get_nowait()
+                        changed = True
+                except queue.Empty:
+                    pass
+                if changed:
+                    with self.watcher.lock:
+                        self.entries = set(self.watcher.files.values())
+            elif self.checked is None or \
+                    self.last_used - self.checked >= self.refresh_age:
+                entries = set(self.scan())
+                # archive members are listed again on every check, so the
+                # listings are compared rather than the folder mtimes
+                changed = changed or entries != self.entries
+                self.entries = entries
+            if changed:
+                self.file_list = file_list_frame(sorted(self.entries))
+                self.version += 1
+                self.refreshed = time.time()
+                self.files_body = None
+                self.audits = {}
+
+            return self.file_list, self.version
+
+
+
+    def files(self):
+        """
+        Return the gzipped JSON of the file list as columns, directories
+        stored once
+        """
+        file_list, version = self.current()
+        with self.lock:
+            if self.version == version and self.files_body is not None:
+                return self.files_body
+
+        directory = file_list['directory']
+        body = gzip.compress(
+            json.dumps(
+                {
+                    'root':self.root,
+                    'version':version,
+                    'directories':directory.cat.categories.tolist(),
+                    'filename':file_list['filename'].tolist(),
+                    'directory':directory.cat.codes.tolist(),
+                    'size':file_list['size'].tolist(),
+                    'mtime':file_list['mtime'].tolist()
+                    }
+                ).encode(),
+            compresslevel=1
+            )
+        with self.lock:
+            if self.version == version:
+                self.files_body = body
+
+        return body
+
+
+
+    def audit(self, test, animals):
+        """
+        Return the gzipped JSON of an audit of the current file list,
+        cached until the files change
+        """
+        file_list, version = self.current()
+        key = (test, tuple(sorted(animals)))
+        with self.lock:
+            if self.version == version and key in self.audits:
+                return self.audits[key]
+
+        start_time = time.perf_counter()
+        report = audit_report(file_list,test,animals)
+        body = gzip.compress(
+            json.dumps(
+                {
+                    'directory':self.root,
+                    'test':test,
+                    'version':version,
+                    'files_scanned':len(file_list),
+                    'seconds':round(time.perf_counter() - start_time,3),
+                    'report':report_json(report)
+                    },
+                default=str
+                ).encode(),
+            compresslevel=1
+            )
+        with self.lock:
+            if self.version == version:
+                if len(self.audits) >= SERVICE_CACHED_AUDITS:
+                    self.audits.pop(next(iter(self.audits)))
+                self.audits[key] = body
+
+        return body
+
+
+
+    def status(self):
+        return {
+            'directory':self.root,
+            'mode':'on request' if self.watcher is None else self.watcher.mode,
+            'checked_seconds':None if self.checked is None else round(
+                time.monotonic() - self.checked,1
+                ),
+            'files':0 if self.file_list is None else len(self.file_list),
+            'version':self.version,
+            'refreshed':self.refreshed,
+            'idle_seconds':round(time.monotonic() - self.last_used,1),
+            'cached_audits':len(self.audits)
+            }
+
+
+
+class ScanCache():
+    """
+    The WatchedDirectory of every directory requested from the service
+
+    allowed_roots limits the directories served to those below any of
+    them; directories idle for idle_timeout are dropped from memory. The
+    directories share directory_index, by default the DirectoryIndex the
+    GUI scans with, so a restarted service starts warm.
+    """
+
+    def __init__(
+            self,
+            allowed_roots=None,
+            refresh_age=SERVICE_REFRESH_AGE,
+            use_watchdog=False,
+            idle_timeout=SERVICE_IDLE_TIMEOUT,
+            directory_index=None
+            ):
+        self.allowed_roots = None if allowed_roots is None else [
+            os.path.normcase(os.path.normpath(os.path.abspath(r)))
+            for r in allowed_roots
+            ]
+        self.refresh_age = refresh_age
+        self.use_watchdog = use_watchdog
+        self.idle_timeout = idle_timeout
+        self.directory_index = DirectoryIndex() if directory_index is None \
+            else directory_index
+        self.directories = {}
+        self.lock = threading.Lock()
+
+
+
+    def directory(self, path):
+        root = os.path.normpath(os.path.abspath(path))
+        key = os.path.normcase(root)
+        if self.allowed_roots is not None and not any(
+                key == r or key.startswith(os.path.join(r,''))
+                for r in self.allowed_roots
+                ):
+            raise PermissionError(f'directory not served : {path}')
+        if not os.path.isdir(root):
+            raise ValueError(f'directory not found : {path}')
+
+        with self.lock:
+            self.expire()
+            if key not in self.directories:
+                self.directories[key] = WatchedDirectory(
+                    root,
+                    self.refresh_age,
+                    self.use_watchdog,
+                    self.directory_index
+                    )
+            return self.directories[key]
+
+
+
+    def expire(self):
+        now = time.monotonic()
+        for key in [
+                k for k,d in self.directories.items()
+                if now - d.last_used > self.idle_timeout
+                ]:
+            self.directories.pop(key).stop()
+
+
+
+    def status(self):
+        with self.lock:
+            directories = list(self.directories.values())
+
+        return {'directories':[d.status() for d in directories]}
+
+
+
+    def close(self):
+        with self.lock:
+            for d in self.directories.values():
+                d.stop()
+            self.directories = {}
+
+
+
+class AuditServiceHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the audit service; the server holds the ScanCache
+    as scan_cache
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/status':
+            self.handle_request(
+                lambda: json.dumps(self.server.scan_cache.status()).encode()
+                )
+        elif url.path == '/files':
+            self.handle_request(
+                lambda: self.server.scan_cache.directory(
+                    query['directory'][0]
+                    ).files(),
+                compressed=True
+                )
+        else:
+            self.send_json(404,{'error':f'unknown endpoint : {url.path}'})
+
+
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/audit':
+            self.send_json(404,{'error':f'unknown endpoint : {url.path}'})
+            return
+
+        def run_audit():
+            length = int(self.headers.get('Content-Length',0))
+            directory, test, animals = audit_request(
+                json.loads(self.rfile.read(length))
+                )
+            return self.server.scan_cache.directory(directory).audit(
+                test,
+                animals
+                )
+
+        self.handle_request(run_audit,compressed=True)
+
+
+
+    def handle_request(self, respond, compressed=False):
+        """
+        Send the body returned by respond, or the error it raised as JSON
+        """
+        try:
+            body = respond()
+        except PermissionError as e:
+            self.send_json(403,{'error':str(e)})
+        except (ValueError, KeyError, OSError) as e:
+            self.send_json(400,{'error':f'{type(e).__name__} : {e}'})
+        except Exception as e:
+            # always answer, so a client is not left waiting on a failure
+            self.log_error('%s',repr(e))
+            self.send_json(500,{'error':f'{type(e).__name__} : {e}'})
+        else:
+            if compressed and 'gzip' not in self.headers.get('Accept-Encoding',''):
+                body = gzip.decompress(body)
+                compressed = False
+            self.send_body(200,body,compressed)
+
+
+
+    def send_json(self, status, payload):
+        self.send_body(status,json.dumps(payload).encode())
+
+
+
+    def send_body(self, status, body, compressed=False):
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        if compressed:
+            self.send_header('Content-Encoding','gzip')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+def make_server(
+        host='127.0.0.1',
+        port=SERVICE_PORT,
+        scan_cache=None
+        ):
+    """
+    Return an audit service bound to host:port; call serve_forever() to
+    run it and shutdown() and scan_cache.close() to stop it
+    """
+    server = ThreadingHTTPServer((host,port),AuditServiceHandler)
+    server.daemon_threads = True
+    server.scan_cache = ScanCache() if scan_cache is None else scan_cache
+
+    return server
+
+
+
+#%% define main
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve warm scan indexes and KOMP audits over HTTP'
+        )
+    parser.add_argument(
+        '--host',default='127.0.0.1',
+        help='address to listen on, 0.0.0.0 to serve other workstations '+ \
+            '(default: 127.0.0.1)'
+        )
+    parser.add_argument(
+        '--port',type=int,default=SERVICE_PORT,
+        help=f'port to listen on (default: {SERVICE_PORT})'
+        )
+    parser.add_argument(
+        '--allow',nargs='+',default=None,metavar='DIR',
+        help='only serve directories below these (default: any directory)'
+        )
+    parser.add_argument(
+        '--refresh-age',type=float,default=SERVICE_REFRESH_AGE,
+        help='seconds a file list is served before a request checks its '+ \
+            f'directory for changes again (default: {SERVICE_REFRESH_AGE})'
+        )
+    parser.add_argument(
+        '--watchdog',action='store_true',
+        help='follow directories with watchdog events instead of checking '+ \
+            'them on request; only for local disks, file shares do not '+ \
+            'report remote changes'
+        )
+    args = parser.parse_args(argv)
+
+    server = make_server(
+        args.host,
+        args.port,
+        ScanCache(args.allow,args.refresh_age,args.watchdog)
+        )
+    print(f'KOMP audit service listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.scan_cache.close()
+
+    return 0
+
+
+
+#%% run main()
+
+if __name__ == '__main__':
+    sys.exit(main())
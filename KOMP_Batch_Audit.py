@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch mode for the KOMP file audit
+
+Runs a manifest of audit jobs across a process pool without starting Qt.
+The manifest is a csv file with one job per row and the columns
+
+    animal_list - text file of animal ids, one per line or tab separated,
+                  or a colony csv/tsv/xlsx export
+    directory - directory, or zip/tar archive, to audit
+    test - KOMP test, one of the KOMP_PROTOCOLS keys or 'all protocols'
+    name - (optional) basename for the job's report file
+    animal_column - (optional) column of the colony export holding the
+                    animal ids, guessed from the header when blank
+
+Relative paths are resolved against the folder holding the manifest. Each
+job writes a report (xlsx, csv or parquet) to the output directory and one
+row to summary.csv, and the stage timings of every job are logged to
+runs.jsonl. Every job is also recorded in the audit history, and its report
+lists the changes since the previous audit of the same directory.
+
+usage:
+    python KOMP_Batch_Audit.py manifest.csv -o reports [-w WORKERS] [-f FORMAT]
+"""
+
+#%% import libraries
+
+from concurrent.futures import ProcessPoolExecutor
+from KOMP_Audit_Core import KOMP_PROTOCOLS, REPORT_CATEGORIES, REPORT_FORMATS
+from KOMP_Audit_Core import ALL_PROTOCOLS
+from KOMP_Audit_Core import INTEGRITY_CATEGORIES, HEADER_CATEGORIES
+from KOMP_Audit_Core import parse_animal_text, import_animal_list
+from KOMP_Audit_Core import scan_file_list, write_report, is_archive
+from KOMP_Audit_Core import run_audit, RunLog
+from KOMP_Audit_Core import AuditHistory, HISTORY_CATEGORIES
+from KOMP_Audit_Core import DUPLICATE_CATEGORIES, NEAR_MISS_CATEGORIES
+import argparse
+import json
+import time
+import sys
+import re
+import os
+
+#%% define functions
+
+def read_manifest(manifest_path):
+    import pandas
+
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_path))
+    manifest = pandas.read_csv(manifest_path,dtype=str).fillna('')
+    missing_columns = {'animal_list','directory','test'}.difference(
+        manifest.columns
+        )
+    if missing_columns:
+        raise ValueError(
+            f'manifest is missing columns : {", ".join(sorted(missing_columns))}'
+            )
+
+    jobs = []
+    for i,row in enumerate(manifest.to_dict('records')):
+        name = row.get('name','')
+        if name == '':
+            name = '{:03d}_{}_{}'.format(
+                i+1,
+                row['test'],
+                os.path.basename(os.path.normpath(row['directory']))
+                )
+        jobs.append(
+            {
+                'job':i+1,
+                'name':re.sub(r'[^\w\-.]+','_',name),
+                'animal_list':os.path.join(
+                    manifest_directory,row['animal_list']
+                    ),
+                'directory':os.path.join(manifest_directory,row['directory']),
+                'test':row['test'],
+                'animal_column':row.get('animal_column','')
+                }
+            )
+
+    return jobs
+
+
+
+def run_job(
+        job,
+        output_directory,
+        report_format='.xlsx',
+        integrity=False,
+        headers=False,
+        history=True
+        ):
+    """
+    Run a single audit job and write its report
+
+    Returns a summary dict for the job; failures are recorded in the
+    summary rather than raised so one bad job does not stop the batch.
+    The stage timings are returned under 'stages'.
+    """
+    import pandas
+
+    start_time = time.perf_counter()
+    summary = dict(job)
+    run_log = RunLog(path=None)
+    try:
+        if job['test'] not in KOMP_PROTOCOLS and job['test'] != ALL_PROTOCOLS:
+            raise ValueError(f'unknown KOMP test : {job["test"]}')
+        if not os.path.isdir(job['directory']) and not (
+                is_archive(job['directory']) and os.path.isfile(job['directory'])
+                ):
+            raise ValueError(f'directory not found : {job["directory"]}')
+
+        extension = os.path.splitext(job['animal_list'])[1].lower()
+        if job['animal_column'] != '' or extension in ['.csv','.tsv','.xlsx']:
+            mouse_list, counts = import_animal_list(
+                job['animal_list'],
+                job['animal_column'] or None
+                )
+        else:
+            with open(job['animal_list']) as f:
+                mouse_list = pandas.DataFrame(
+                    {'parsed_mouse_list':parse_animal_text(f.read())}
+                    )
+        with run_log.stage('scan'):
+            file_list = scan_file_list(job['directory'])
+
+        report, reports = run_audit(
+            mouse_list,
+            file_list,
+            job['test'],
+            integrity=integrity,
+            headers=headers,
+            history=AuditHistory() if history else None,
+            directory=job['directory'],
+            run_log=run_log
+            )
+        report_path = os.path.join(output_directory,job['name']+report_format)
+        with run_log.stage('save'):
+            write_report(report,report_path)
+
+        summary['status'] = 'ok'
+        summary['report'] = report_path
+        summary['animals'] = len(mouse_list)
+        summary['files_scanned'] = len(file_list)
+        for k,v in report.items():
+            if k != 'mouse_test_matrix':
+                summary[k] = len(v)
+    except Exception as e:
+        summary['status'] = f'error - {type(e).__name__} : {e}'
+
+    summary['seconds'] = round(time.perf_counter() - start_time,3)
+    summary['timings'] = run_log.summary()
+    summary['stages'] = run_log.stages
+
+    return summary
+
+
+
+def run_batch(
+        jobs,
+        output_directory,
+        workers=None,
+        report_format='.xlsx',
+        integrity=False,
+        headers=False,
+        history=True
+        ):
+    """
+    Run jobs across a process pool and write summary.csv and runs.jsonl
+
+    Each job is independent (its own scan, audit and report), so
+    throughput scales with the number of worker processes.
+    """
+    import pandas
+
+    os.makedirs(output_directory,exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        summaries = list(
+            executor.map(
+                run_job,
+                jobs,
+                [output_directory]*len(jobs),
+                [report_format]*len(jobs),
+                [integrity]*len(jobs),
+                [headers]*len(jobs),
+                [history]*len(jobs)
+                )
+            )
+
+    with open(os.path.join(output_directory,'runs.jsonl'),'w') as f:
+        for s in summaries:
+            f.write(json.dumps(s,default=str)+'\n')
+
+    summary = pandas.DataFrame(summaries).drop(columns='stages')
+    for c in summary.columns:
+        if c in ['animals','files_scanned']+DUPLICATE_CATEGORIES+ \
+                INTEGRITY_CATEGORIES+HEADER_CATEGORIES+HISTORY_CATEGORIES or (
+                c.split(' ')[-1] in REPORT_CATEGORIES+NEAR_MISS_CATEGORIES
+                ):
+            # keep counts integer when failed jobs leave blanks
+            summary[c] = summary[c].astype('Int64')
+    summary.to_csv(os.path.join(output_directory,'summary.csv'),index=False)
+
+    return summary
+
+
+
+#%% define main
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Audit KOMP data directories listed in a manifest'
+        )
+    parser.add_argument('manifest',help='csv of animal_list,directory,test jobs')
+    parser.add_argument(
+        '-o','--output',default='.',help='directory for reports and summary.csv'
+        )
+    parser.add_argument(
+        '-w','--workers',type=int,default=None,
+        help='number of worker processes (default: number of cores)'
+        )
+    parser.add_argument(
+        '-f','--format',default='xlsx',
+        choices=[f.lstrip('.') for f in REPORT_FORMATS],
+        help='report file format (default: xlsx)'
+        )
+    parser.add_argument(
+        '--integrity',action='store_true',
+        help='also check passing files for empty, small and duplicate files'
+        )
+    parser.add_argument(
+        '--headers',action='store_true',
+        help='also check the ids and dates in the headers of passing DICOM files'
+        )
+    parser.add_argument(
+        '--no-history',action='store_true',
+        help='do not record the jobs in the audit history'
+        )
+    args = parser.parse_args(argv)
+
+    jobs = read_manifest(args.manifest)
+    start_time = time.perf_counter()
+    summary = run_batch(
+        jobs,
+        args.output,
+        args.workers,
+        '.'+args.format,
+        args.integrity,
+        args.headers,
+        not args.no_history
+        )
+    elapsed = time.perf_counter() - start_time
+
+    for row in summary.to_dict('records'):
+        print(f'[{row["job"]}] {row["name"]} : {row["status"]}')
+    print(f'{len(jobs)} jobs completed in {elapsed:.1f}s')
+
+    return 0 if (summary['status'] == 'ok').all() else 1
+
+
+
+#%% run main()
+
+if __name__ == '__main__':
+    sys.exit(main())
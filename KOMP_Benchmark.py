@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the KOMP file audit
+
+Generates a synthetic KOMP cohort (mouse list) and a matching directory
+tree for each requested file count, then times each stage of an audit and
+records its peak memory:
+
+    scan - scan_file_list of the generated tree
+    index_scan - DirectoryIndex scan, cold and then warm
+    audit - filename_audit of the cohort against the scan
+    multi_audit - multi_protocol_audit of every protocol
+    model - PandasModel of the file list, first block and all rows
+            (skipped when PyQt5 is not installed)
+    save - write_report of the audit, once per report format
+
+The cold start of a headless script (a fresh interpreter importing
+KOMP_Audit_Core) is recorded as import_core with files 0.
+
+Stages are timed in one pass and, unless --no-memory is given, their peak
+memory is traced with tracemalloc in a second pass. Results are saved as
+JSON; pass --compare with an earlier results file to print the change of
+each stage between versions.
+
+usage:
+    python KOMP_Benchmark.py -n 1000 100000 1000000 -o benchmark.json
+"""
+
+#%% import libraries
+
+from KOMP_Audit_Core import KOMP_PROTOCOLS, REPORT_CATEGORIES, REPORT_FORMATS
+from KOMP_Audit_Core import DirectoryIndex, expected_file_table
+from KOMP_Audit_Core import filename_audit, multi_protocol_audit
+from KOMP_Audit_Core import scan_file_list, write_report
+import subprocess
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import random
+import shutil
+import math
+import time
+import json
+import sys
+import gc
+import os
+
+#%% define constants
+
+# file counts benchmarked when none are given
+BENCHMARK_SIZES = [1000, 100000, 1000000]
+
+# default shape of the generated cohorts and trees
+BENCHMARK_SETTINGS = {
+    'protocol':'xray-faxitron',
+    'prefix_fraction':0.5,
+    'assignment_fraction':0.8,
+    'wt_fraction':0.05,
+    'missing_rate':0.05,
+    'unexpected_rate':0.05,
+    'depth':3,
+    'files_per_directory':500,
+    'seed':0
+    }
+
+# written beside each generated tree so it is reused by later runs
+TREE_MARKER = '{root}.json'
+
+#%% define functions
+
+def generate_mouse_list(
+        count,
+        protocol='std',
+        prefix_fraction=0.5,
+        assignment_fraction=0.8,
+        wt_fraction=0.05,
+        seed=0
+        ):
+    """
+    Return count unique mouse ids formatted as they appear in animal lists
+
+    A prefix_fraction of ids are written 'M000...' with the barcode padded
+    to the protocol basename_length, the rest as a bare barcode.
+    wt_fraction get a '-wt' marker. When the protocol has assignment tags,
+    assignment_fraction of the mice get one of them, e.g. '(T)', and the
+    rest get a tag the protocol does not expect.
+    """
+    settings = KOMP_PROTOCOLS[protocol]
+    rng = random.Random(seed)
+    start = rng.randint(10000, 50000)
+    other_tags = [
+        t for t in ['T','E','D'] if t not in (settings['assignment'] or [])
+        ]
+
+    mice = []
+    for barcode in range(start, start+count):
+        mouse = str(barcode)
+        if rng.random() < prefix_fraction:
+            mouse = 'M'+mouse.rjust(settings['basename_length'],'0')
+        if rng.random() < wt_fraction:
+            mouse += '-wt'
+        if settings['assignment'] is not None:
+            if rng.random() < assignment_fraction:
+                mouse += f' ({rng.choice(settings["assignment"]).upper()})'
+            else:
+                mouse += f' ({rng.choice(other_tags)})'
+        mice.append(mouse)
+
+    return mice
+
+
+
+def tree_directories(count, depth, files_per_directory):
+    """
+    Return the relative leaf directories of a tree holding count files,
+    depth levels deep with about files_per_directory files in each leaf
+    """
+    leaves = max(1, math.ceil(count/files_per_directory))
+    fanout = max(1, math.ceil(leaves**(1/depth)))
+    directories = []
+    for leaf in range(leaves):
+        parts = []
+        for level in range(depth):
+            parts.append(f'level{level}_{leaf//fanout**(depth-level-1)%fanout}')
+        directories.append(os.path.join(*parts))
+
+    return directories
+
+
+
+def generate_directory(
+        root,
+        file_count,
+        protocol='std',
+        prefix_fraction=0.5,
+        assignment_fraction=0.8,
+        wt_fraction=0.05,
+        missing_rate=0.05,
+        unexpected_rate=0.05,
+        depth=3,
+        files_per_directory=500,
+        seed=0
+        ):
+    """
+    Write a synthetic KOMP directory of about file_count empty files
+
+    The cohort from generate_mouse_list is sized so its expected files
+    number file_count. missing_rate of the expected files are left out and
+    unexpected_rate * file_count unexpected files (unknown barcodes and
+    unknown suffixes) are added, spread over a tree from tree_directories.
+
+    Returns the mouse list. A tree already generated with the same
+    parameters is reused.
+    """
+    import pandas
+
+    parameters = {
+        'file_count':file_count,
+        'protocol':protocol,
+        'prefix_fraction':prefix_fraction,
+        'assignment_fraction':assignment_fraction,
+        'wt_fraction':wt_fraction,
+        'missing_rate':missing_rate,
+        'unexpected_rate':unexpected_rate,
+        'depth':depth,
+        'files_per_directory':files_per_directory,
+        'seed':seed
+        }
+    marker = TREE_MARKER.format(root=root)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            generated = json.load(f)
+        if generated['parameters'] == parameters:
+            return generated['mouse_list']
+    if os.path.exists(root):
+        shutil.rmtree(root)
+
+    settings = KOMP_PROTOCOLS[protocol]
+    # only assigned mice are expected under assignment protocols
+    expected_per_mouse = len(settings['file_suffixes']) * (
+        1 if settings['assignment'] is None else assignment_fraction
+        )
+    mouse_list = generate_mouse_list(
+        max(1, round(file_count/expected_per_mouse)),
+        protocol,
+        prefix_fraction,
+        assignment_fraction,
+        wt_fraction,
+        seed
+        )
+
+    rng = random.Random(seed)
+    filenames = [
+        f for f in expected_file_table(
+            pandas.DataFrame({'parsed_mouse_list':mouse_list}),
+            settings['file_suffixes'],
+            settings['basename_length'],
+            settings['assignment']
+            )['filename'].tolist()
+        if rng.random() >= missing_rate
+        ]
+    for i in range(round(file_count*unexpected_rate)):
+        if i % 2 == 0:
+            filenames.append(f'M{rng.randint(1, 9999):07d}{settings["file_suffixes"][0]}')
+        else:
+            filenames.append(f'{rng.choice(filenames)}.bak')
+    rng.shuffle(filenames)
+
+    directories = tree_directories(len(filenames), depth, files_per_directory)
+    for i, directory in enumerate(directories):
+        path = os.path.join(root,directory)
+        os.makedirs(path, exist_ok=True)
+        for filename in filenames[i*files_per_directory:(i+1)*files_per_directory]:
+            open(os.path.join(path,filename),'wb').close()
+
+    with open(marker,'w') as f:
+        json.dump({'parameters':parameters,'mouse_list':mouse_list}, f)
+
+    return mouse_list
+
+
+
+def time_stage(function, *args, trace_memory=False, **kwargs):
+    """
+    Run function once, returning its result, the elapsed seconds and the
+    peak memory in MB allocated while it ran (None if not traced)
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start_time
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return result, seconds, peak_mb
+
+
+
+def cold_start(module='KOMP_Audit_Core', repeat=5):
+    """
+    Return the median seconds for a fresh interpreter to import module
+    """
+    seconds = []
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', f'import {module}'],
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+        seconds.append(time.perf_counter() - start_time)
+
+    return sorted(seconds)[len(seconds)//2]
+
+
+
+def render_model(file_list, fetch_all=False):
+    from KOMP_File_Audit import PandasModel
+
+    model = PandasModel(file_list)
+    while fetch_all and model.canFetchMore():
+        model.fetchMore()
+
+    return model
+
+
+
+def index_scan(directory_index, root):
+    return sum(len(batch) for batch in directory_index.scan(root))
+
+
+
+def run_benchmark(
+        file_count,
+        work_directory,
+        settings=BENCHMARK_SETTINGS,
+        trace_memory=False,
+        progress=print
+        ):
+    """
+    Generate the tree for file_count files and time each audit stage
+
+    Returns a list of result dicts with stage, files, seconds and peak_mb.
+    tracemalloc slows the pure python stages several times over, so
+    seconds from a trace_memory run should not be compared with others.
+    """
+    import pandas
+
+    root = os.path.join(work_directory,f'tree_{file_count}')
+    progress(f'{file_count} files : generating {root}')
+    start_time = time.perf_counter()
+    mouse_list = generate_directory(root, file_count, **settings)
+    progress(f'{file_count} files : generated in {time.perf_counter()-start_time:.1f}s')
+    mouse_list = pandas.DataFrame({'parsed_mouse_list':mouse_list})
+    protocol = KOMP_PROTOCOLS[settings['protocol']]
+
+    results = []
+    def record(stage, function, *args, **kwargs):
+        result, seconds, peak_mb = time_stage(
+            function, *args, trace_memory=trace_memory, **kwargs
+            )
+        results.append(
+            {
+                'stage':stage,
+                'files':file_count,
+                'seconds':round(seconds,4),
+                'peak_mb':None if peak_mb is None else round(peak_mb,2)
+                }
+            )
+        progress(
+            f'{file_count} files : {stage} {seconds:.3f}s'+ \
+            ('' if peak_mb is None else f', peak {peak_mb:.1f} MB')
+            )
+        return result
+
+    file_list = record('scan', scan_file_list, root)
+
+    index_path = os.path.join(work_directory,f'index_{file_count}.sqlite')
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    directory_index = DirectoryIndex(index_path)
+    record('index_scan_cold', index_scan, directory_index, root)
+    record('index_scan_warm', index_scan, directory_index, root)
+
+    audit_results = record(
+        'audit', filename_audit, mouse_list, file_list, **protocol
+        )
+    record('multi_audit', multi_protocol_audit, mouse_list, file_list)
+
+    try:
+        import PyQt5
+    except ImportError:
+        progress(f'{file_count} files : model skipped - PyQt5 not installed')
+    else:
+        record('model_first_block', render_model, file_list)
+        record('model_all_rows', render_model, file_list, fetch_all=True)
+
+    report = dict(zip(REPORT_CATEGORIES, audit_results))
+    for report_format in REPORT_FORMATS:
+        output_path = os.path.join(work_directory,f'report_{file_count}{report_format}')
+        try:
+            record(f'save{report_format}', write_report, report, output_path)
+        except ImportError as e:
+            progress(f'{file_count} files : save{report_format} skipped - {e}')
+
+    return results
+
+
+
+def compare_results(results, baseline):
+    """
+    Return a DataFrame of seconds and peak_mb per stage and file count for
+    results and baseline (as saved by main), with their ratio
+    """
+    import pandas
+
+    current = pandas.DataFrame(results['results'])
+    previous = pandas.DataFrame(baseline['results'])
+    comparison = previous.merge(
+        current,
+        on=['stage','files'],
+        how='right',
+        suffixes=('_baseline','')
+        )
+    comparison['time_ratio'] = (
+        comparison['seconds'] / comparison['seconds_baseline']
+        ).round(2)
+
+    return comparison[
+        [
+            'files','stage','seconds_baseline','seconds','time_ratio',
+            'peak_mb_baseline','peak_mb'
+            ]
+        ]
+
+
+
+#%% define main
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the KOMP file audit')
+    parser.add_argument(
+        '-n','--files',type=int,nargs='+',default=BENCHMARK_SIZES,
+        help='file counts to benchmark (default: 1000 100000 1000000)'
+        )
+    parser.add_argument(
+        '-o','--output',default='benchmark.json',help='results json file'
+        )
+    parser.add_argument(
+        '-d','--work-directory',default=None,
+        help='directory for generated trees, kept for later runs '+ \
+            '(default: a temporary directory removed afterwards)'
+        )
+    parser.add_argument(
+        '--compare',default=None,help='earlier results json to compare against'
+        )
+    parser.add_argument(
+        '--no-memory',action='store_true',
+        help='skip the second pass measuring peak memory with tracemalloc'
+        )
+    for k,v in BENCHMARK_SETTINGS.items():
+        parser.add_argument(
+            '--'+k.replace('_','-'),type=type(v),default=v,
+            help=f'(default: {v})'
+            )
+    args = parser.parse_args(argv)
+
+    settings = {k:getattr(args,k) for k in BENCHMARK_SETTINGS}
+    work_directory = args.work_directory or tempfile.mkdtemp(prefix='komp_benchmark_')
+    os.makedirs(work_directory, exist_ok=True)
+    try:
+        seconds = cold_start()
+        print(f'import_core {seconds:.3f}s')
+        results = [
+            {'stage':'import_core','files':0,'seconds':round(seconds,4),'peak_mb':None}
+            ]
+        for file_count in args.files:
+            timings = run_benchmark(file_count, work_directory, settings)
+            if not args.no_memory:
+                # peak memory comes from a second, traced pass
+                peaks = {
+                    r['stage']:r['peak_mb'] for r in run_benchmark(
+                        file_count,
+                        work_directory,
+                        settings,
+                        trace_memory=True
+                        )
+                    }
+                for r in timings:
+                    r['peak_mb'] = peaks.get(r['stage'])
+            results.extend(timings)
+    finally:
+        if args.work_directory is None:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    output = {
+        'created':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python':sys.version.split()[0],
+        'platform':platform.platform(),
+        'trace_memory':not args.no_memory,
+        'settings':settings,
+        'results':results
+        }
+    with open(args.output,'w') as f:
+        json.dump(output, f, indent=1)
+    print(f'results saved to {args.output}')
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(compare_results(output, baseline).to_string(index=False))
+
+    return 0
+
+
+
+#%% run main()
+
+if __name__ == '__main__':
+    sys.exit(main())
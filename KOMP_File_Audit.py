@@ -10,16 +10,55 @@ __VERSION__ = '1.0.0'
 #%% import libraries
 
 from PyQt5 import QtGui, QtWidgets
-from PyQt5.QtCore import pyqtSlot, Qt
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, Qt
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer
 from PyQt5.QtCore import QAbstractTableModel, QModelIndex 
 from PyQt5.QtWidgets import QMainWindow, QApplication, QLabel, QPushButton 
 from PyQt5.QtWidgets import QTextEdit, QTableView, QHBoxLayout, QVBoxLayout
-from PyQt5.QtWidgets import QFileDialog, QComboBox
+from PyQt5.QtWidgets import QFileDialog, QComboBox, QLineEdit, QWidget
+from PyQt5.QtWidgets import QCheckBox, QInputDialog
+from PyQt5.QtGui import QTextCursor
+from collections import deque
+from KOMP_Audit_Core import SCAN_BATCH_SIZE, KOMP_PROTOCOLS, REPORT_CATEGORIES
+from KOMP_Audit_Core import REPORT_FORMATS, INTEGRITY_CATEGORIES, ALL_PROTOCOLS
+from KOMP_Audit_Core import HEADER_CATEGORIES, run_audit
+from KOMP_Audit_Core import DirectoryIndex, HashCache, ScanEntry
+from KOMP_Audit_Core import FileWatcher, IncrementalAudit
+from KOMP_Audit_Core import parse_animal_text, write_report
+from KOMP_Audit_Core import file_list_frame, RunLog
+from KOMP_Audit_Core import ANIMAL_LIST_FORMATS, animal_list_columns
+from KOMP_Audit_Core import guess_animal_column, import_animal_list
+from KOMP_Audit_Core import ARCHIVE_EXTENSIONS, is_archive
+from KOMP_Audit_Core import AuditHistory, HISTORY_CATEGORIES, parse_barcode
+from KOMP_Audit_Core import parse_filenames, FileIndex
+from KOMP_Audit_Core import DUPLICATE_CATEGORIES
+from KOMP_Audit_Core import NEAR_MISS_CATEGORIES, near_miss_files
+from KOMP_Audit_Service import request_file_list
 import pandas
+import threading
+import time
 import sys
-import re
 import os
 
+#%% define constants
+
+# minimum number of seconds between progress messages from background work
+PROGRESS_INTERVAL = 1.0
+
+# seconds a watch waits for file events before checking for cancellation
+WATCH_CHECK_INTERVAL = 0.25
+
+# number of rows a table model renders each time the view fetches more
+MODEL_FETCH_SIZE = 10000
+
+# number of messages retained in the feedback panel
+LOG_MAX_ENTRIES = 500
+
+# milliseconds to wait after typing before a report view filter is applied
+FILTER_DELAY = 300
+
+
+
 #%% define functions
 def html_text_color(text,color):
     text_output = f'<span style="color:{color}">{text}</span><br>'
@@ -28,49 +67,272 @@ def html_text_color(text,color):
 
 
 
-def filename_audit(mouse_list,file_list,file_suffixes,basename_length,assignment=None):
-    barcode_finder = re.compile(
-        '^(?P<prefix>M?0*)(?P<barcode>.+?)(-wt)?(\s)?(?P<assignment>\(.*?\))?(?P<suffix>[\.|-].*)?$'
+def scan_task(directory_index,root,run_log,progress,partial,check_cancelled):
+    """
+    Background task scanning root into a file_list DataFrame, one row per
+    file path
+
+    Files are collected in a FileIndex, so a filename found in several
+    folders keeps every path. Intermediate lists of ScanEntry are passed to
+    partial at doubling intervals so the file table can fill in while the
+    scan runs, with a total copy cost that stays linear in file count. The
+    scan and the building of the file_list are timed as run_log stages.
+    """
+    file_index = FileIndex()
+    refresh_at = SCAN_BATCH_SIZE
+    last_report = [time.monotonic()]
+
+    def scan_progress(directory_count,file_count):
+        check_cancelled()
+        if time.monotonic() - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = time.monotonic()
+            progress(
+                f'scanning : {directory_count} directories scanned, '+ \
+                f'{file_count} files found'
+                )
+
+    with run_log.stage('scan'):
+        for batch in directory_index.scan(root,progress=scan_progress):
+            file_index.add(batch)
+            if len(file_index) >= refresh_at:
+                partial(list(file_index.values()))
+                refresh_at = 2 * len(file_index)
+
+    progress(f'indexing {len(file_index)} files')
+    with run_log.stage('index'):
+        return file_list_frame(file_index.values())
+
+
+
+def service_scan_task(service_url,root,run_log,progress,partial,check_cancelled):
+    """
+    Background task fetching the file_list of root from an audit service
+    instead of scanning it, timed as the scan stage
+    """
+    progress(f'requesting file list of {root} from {service_url}')
+    with run_log.stage('scan'):
+        file_list = request_file_list(service_url,root)
+    check_cancelled()
+
+    return file_list
+
+
+
+def import_task(path,column,progress,partial,check_cancelled):
+    """
+    Background task reading the animal ids in column of a colony export
+
+    Returns the mouse_list DataFrame and the import counts.
+    """
+    def import_progress(rows):
+        check_cancelled()
+        progress(f'importing animal list : {rows} rows read')
+
+    return import_animal_list(path,column,progress=import_progress)
+
+
+
+def save_task(report,output_path,run_log,progress,partial,check_cancelled):
+    """
+    Background task writing the report to output_path
+    """
+    progress(f'saving report : {output_path}')
+    with run_log.stage('save'):
+        write_report(report,output_path)
+    return output_path
+
+
+
+def audit_task(
+        mouse_list,
+        file_list,
+        test,
+        hash_cache,
+        check_headers,
+        history,
+        directory,
+        run_log,
+        progress,
+        partial,
+        check_cancelled
+        ):
+    """
+    Background task running run_audit for test, with integrity_check when
+    a hash_cache is given and header_check when check_headers is set, and
+    recording the run in history
+
+    Returns the report and the per-protocol reports of run_audit.
+    """
+    results = run_audit(
+        mouse_list,
+        file_list,
+        test,
+        integrity=hash_cache is not None,
+        headers=check_headers,
+        history=history,
+        directory=directory,
+        hash_cache=hash_cache,
+        run_log=run_log,
+        progress=progress,
+        check_cancelled=check_cancelled
+        )
+    progress('audit stage : building report')
+
+    return results
+
+
+
+def watch_task(
+        root,
+        mouse_list,
+        file_list,
+        protocol,
+        progress,
+        partial,
+        check_cancelled
+        ):
+    """
+    Background task keeping an audit of root current until cancelled
+
+    File events from a FileWatcher are applied to an IncrementalAudit as
+    they arrive and the new counts are passed to partial. Returns the
+    IncrementalAudit and a FileIndex of the watched files.
+    """
+    progress('watch : building initial audit')
+    audit = IncrementalAudit(mouse_list,file_list,**protocol)
+    watcher = FileWatcher(
+        root,
+        [
+            ScanEntry(*r) for r in file_list[list(ScanEntry._fields)].itertuples(
+                index=False,
+                name=None
+                )
+            ]
         )
-    
-    anticipated_files = []
-    # generate expected filename list
-    for a in list(mouse_list['parsed_mouse_list']):
-        parsed_mouse = re.search(barcode_finder,a)
-        if assignment is not None and not any(
-                [i in parsed_mouse['assignment'] for i in assignment]
-                ):
-            continue
-        
-        if parsed_mouse['prefix'] == '':
-            prefix = 'M'+'0'*(basename_length-len(parsed_mouse['barcode']))
-        else:
-            prefix = parsed_mouse['prefix']
-        for s in file_suffixes:
-            anticipated_files.append(prefix+parsed_mouse['barcode']+s)
-            
-    anticipated_set = set(anticipated_files)
-    
-    actual_set = set(list(file_list['filename']))
-    
-    # compare expected vs actual for match vs mismatch
-    missing_files = anticipated_set.difference(actual_set)
-    passing_files = anticipated_set.intersection(actual_set)
-    unexpected_files = actual_set.difference(anticipated_set)
-    
-    missing_mice = {re.search(barcode_finder,a)['barcode'] for a in missing_files}
-    passing_mice = {re.search(barcode_finder,a)['barcode'] for a in passing_files}
-    unexpected_mice = {re.search(barcode_finder,a)['barcode'] for a in unexpected_files}
-    
-    passing_mice = passing_mice.difference(missing_mice).difference(unexpected_mice)
-    
-    return passing_files, missing_files, unexpected_files, \
-        passing_mice, missing_mice, unexpected_mice
+    watcher.start()
+    progress(f'watch : watching {root} ({watcher.mode}) - press Cancel to stop')
+    try:
+        while True:
+            check_cancelled()
+            changes = watcher.get_changes(WATCH_CHECK_INTERVAL)
+            if not changes:
+                continue
+            for kind, entry in changes:
+                if kind == 'created':
+                    audit.add_files([entry.filename])
+                else:
+                    audit.remove_files([entry.filename])
+            partial(
+                {
+                    'created':sum(kind == 'created' for kind, e in changes),
+                    'deleted':sum(kind == 'deleted' for kind, e in changes),
+                    'counts':[len(r) for r in audit.results()]
+                    }
+                )
+    except WorkerCancelled:
+        pass
+    finally:
+        watcher.stop()
+
+    with watcher.lock:
+        file_index = FileIndex(watcher.files.values())
+
+    return audit, file_index
+
+
+
+def reaudit_task(mouse_list,file_list,settings,progress,partial,check_cancelled):
+    """
+    Background task building the IncrementalAudit that later animal list
+    edits are applied to
+
+    Returns the IncrementalAudit and None for the affected barcodes, as
+    every barcode is audited.
+    """
+    progress(f'animal list edited : re-auditing {len(mouse_list)} animals')
+    return IncrementalAudit(mouse_list,file_list,**settings), None
+
+
+
+def near_miss_task(missing_files,unexpected_files,progress,partial,check_cancelled):
+    """
+    Background task suggesting near misses for the unexpected files left
+    by an animal list edit
+    """
+    return near_miss_files(missing_files,unexpected_files)
 
 
 
 #%% define class
 
+class WorkerCancelled(Exception):
+    pass
+
+
+
+class WorkerSignals(QObject):
+    """
+    Signals emitted by a Worker, delivered to the GUI thread
+    """
+    progress = pyqtSignal(str)
+    partial = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    error = pyqtSignal(str)
+
+
+
+class Worker(QRunnable):
+    """
+    Run a task function on the global QThreadPool
+
+    The task is called with the keyword arguments progress (send a message
+    to the feedback panel), partial (send an intermediate result) and
+    check_cancelled (raises WorkerCancelled once cancel() has been called).
+    Its return value is emitted with the finished signal.
+    """
+
+    def __init__(self, function, *args, **kwargs):
+        super(Worker,self).__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancel_event = threading.Event()
+
+
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise WorkerCancelled()
+
+
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            result = self.function(
+                *self.args,
+                progress=self.signals.progress.emit,
+                partial=self.signals.partial.emit,
+                check_cancelled=self.check_cancelled,
+                **self.kwargs
+                )
+        except WorkerCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.error.emit(f'{type(e).__name__} : {e}')
+        else:
+            self.signals.finished.emit(result)
+
+
+
+
 class PandasModel(QAbstractTableModel):
     """
     A model to interface a Qt view with pandas dataframe
@@ -78,11 +340,42 @@ class PandasModel(QAbstractTableModel):
     code adapted from example located at
     https://doc.qt.io/qtforpython/examples/example_external__pandas.html
     
+    The dataframe is referenced rather than copied. Cells are rendered to
+    strings one block of rows at a time as the view fetches them, and
+    painting a cell is a list lookup, so large tables scroll smoothly
+    without doubling memory. Cells can be edited unless editable is False.
     """
 
-    def __init__(self, dataframe: pandas.DataFrame, parent=None):
+    def __init__(
+            self,
+            dataframe: pandas.DataFrame,
+            parent=None,
+            fetch_size=MODEL_FETCH_SIZE,
+            editable=True
+            ):
         QAbstractTableModel.__init__(self, parent)
-        self._dataframe = dataframe.copy()
+        self._dataframe = dataframe
+        self._fetch_size = fetch_size
+        self._editable = editable
+        self._columns = [[] for c in dataframe.columns]
+        self.render_rows(min(fetch_size,len(dataframe)))
+
+
+
+    def render_rows(self, stop):
+        """
+        Extend the rendered string columns up to row stop
+        """
+        start = len(self._columns[0]) if self._columns else 0
+        for c, column in enumerate(self._columns):
+            column.extend(
+                [str(v) for v in self._dataframe.iloc[start:stop, c].tolist()]
+                )
+
+
+
+    def loaded_rows(self):
+        return len(self._columns[0]) if self._columns else 0
 
 
 
@@ -92,12 +385,38 @@ class PandasModel(QAbstractTableModel):
         Return row count of the pandas DataFrame
         """
         if parent == QModelIndex():
-            return len(self._dataframe)
+            return self.loaded_rows()
 
         return 0
 
 
 
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        """Override method from QAbstractTableModel
+
+        Return True while rows of the DataFrame remain unrendered
+        """
+        if parent == QModelIndex():
+            return self.loaded_rows() < len(self._dataframe)
+        return False
+
+
+
+    def fetchMore(self, parent=QModelIndex()):
+        """Override method from QAbstractTableModel
+
+        Render and insert the next block of rows
+        """
+        start = self.loaded_rows()
+        stop = min(start+self._fetch_size, len(self._dataframe))
+        if stop <= start:
+            return
+        self.beginInsertRows(QModelIndex(), start, stop-1)
+        self.render_rows(stop)
+        self.endInsertRows()
+
+
+
     def columnCount(self, parent=QModelIndex()) -> int:
         """Override method from QAbstractTableModel
 
@@ -109,9 +428,45 @@ class PandasModel(QAbstractTableModel):
 
     
     def setData(self, index, value, role):
-        if role == Qt.EditRole:
-            self._dataframe.iloc[index.row(),index.column()] = value
+        if role == Qt.EditRole and self._editable:
+            # an exception here would abort the application, so a value
+            # the column cannot hold is refused instead
+            try:
+                self._dataframe.iloc[index.row(),index.column()] = value
+            except (TypeError, ValueError):
+                return False
+            self._columns[index.column()][index.row()] = str(value)
+            self.dataChanged.emit(index, index)
             return True
+        return False
+
+
+
+    def set_data_batch(self, edits):
+        """
+        Apply many (row, column, value) edits with one write per column
+
+        A single dataChanged signal covers the edited block.
+        """
+        by_column = {}
+        for row, column, value in edits:
+            by_column.setdefault(column, {})[row] = value
+        if not by_column:
+            return
+
+        loaded_rows = self.loaded_rows()
+        for column, values in by_column.items():
+            rows = list(values.keys())
+            self._dataframe.iloc[rows, column] = list(values.values())
+            for row, value in values.items():
+                if row < loaded_rows:
+                    self._columns[column][row] = str(value)
+
+        all_rows = [r for values in by_column.values() for r in values]
+        self.dataChanged.emit(
+            self.index(min(all_rows), min(by_column)),
+            self.index(max(all_rows), max(by_column))
+            )
 
 
     def data(self, index: QModelIndex, role=Qt.ItemDataRole):
@@ -123,8 +478,7 @@ class PandasModel(QAbstractTableModel):
             return None
 
         if role == Qt.DisplayRole or role == Qt.EditRole:
-            value = str(self._dataframe.iloc[index.row(), index.column()])
-            return value
+            return self._columns[index.column()][index.row()]
 
         return None
 
@@ -135,6 +489,8 @@ class PandasModel(QAbstractTableModel):
         
         # use of | performs a bitwise 'or' comparison. in this case it
         # results in creation of a Qt.ItemFlag ...
+        if not self._editable:
+            return Qt.ItemIsSelectable|Qt.ItemIsEnabled
         return Qt.ItemIsSelectable|Qt.ItemIsEnabled|Qt.ItemIsEditable
     
     
@@ -157,6 +513,101 @@ class PandasModel(QAbstractTableModel):
 
 
 
+class FeedbackLog(QTextEdit):
+    """
+    The feedback panel - a QTextEdit that appends messages at the end and
+    keeps only the most recent max_entries of them, so layout time stays
+    bounded however many audits are run
+    """
+
+    def __init__(self, parent=None, max_entries=LOG_MAX_ENTRIES):
+        super(FeedbackLog,self).__init__(parent)
+        self.max_entries = max_entries
+        self.entry_lengths = deque()
+
+
+
+    def insertHtml(self, html):
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        start = cursor.position()
+        cursor.insertHtml(html)
+        self.entry_lengths.append(cursor.position()-start)
+
+        while len(self.entry_lengths) > self.max_entries:
+            trim = QTextCursor(self.document())
+            trim.setPosition(
+                self.entry_lengths.popleft(),
+                QTextCursor.KeepAnchor
+                )
+            trim.removeSelectedText()
+
+        self.moveCursor(QTextCursor.End)
+        self.ensureCursorVisible()
+
+
+
+class ReportView(QWidget):
+    """
+    A window listing one report category with a substring filter
+
+    values is a set, or a DataFrame filtered on its first column. Rows are
+    rendered by PandasModel as they are scrolled into view.
+    """
+
+    def __init__(self, title, values, parent=None):
+        super(ReportView,self).__init__(parent, Qt.Window)
+        self.setWindowTitle(title)
+        self.setGeometry(150,150,500,600)
+        if isinstance(values, pandas.DataFrame):
+            self.values = values.astype(str).reset_index(drop=True)
+        else:
+            self.values = pandas.Series(
+                sorted(values), dtype=str, name=title
+                ).to_frame()
+
+        self.filter = QLineEdit(self)
+        self.filter.setPlaceholderText('filter...')
+        self.count_label = QLabel(self)
+        self.view = QTableView(self)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.setAlternatingRowColors(True)
+        self.view.setSelectionBehavior(QTableView.SelectRows)
+
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.filter)
+        self.layout.addWidget(self.count_label)
+        self.layout.addWidget(self.view)
+        self.setLayout(self.layout)
+
+        # wait for a pause in typing before filtering large categories
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DELAY)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter.textChanged.connect(self.filter_timer.start)
+
+        self.apply_filter()
+
+
+
+    @pyqtSlot()
+    def apply_filter(self):
+        text = self.filter.text()
+        if text == '':
+            shown = self.values
+        else:
+            shown = self.values[
+                self.values.iloc[:,0].str.contains(
+                    text, case=False, regex=False
+                    )
+                ]
+        self.model = PandasModel(shown.reset_index(drop=True))
+        self.view.setModel(self.model)
+        self.count_label.setText(f'{len(shown)} of {len(self.values)}')
+
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow,self).__init__()
@@ -179,6 +630,25 @@ class MainWindow(QMainWindow):
         self.file_list = pandas.DataFrame({'file_list':['']})
         
         self.report = {}
+        
+        self.directory_index = DirectoryIndex()
+        
+        self.hash_cache = HashCache()
+        
+        # protocol settings of the last single test audit, and its audit
+        # state once the animal list is edited
+        self.audit_settings = None
+        self.incremental_audit = None
+        
+        self.history = AuditHistory()
+        
+        self.worker = None
+        
+        self.report_views = []
+        
+        # stage timings of the last scan, until an audit run takes them up
+        self.scan_log = RunLog()
+        self.scan_stages = []
                 
         self.KOMP_test_settings = {
             'std':self.check_std,
@@ -186,7 +656,8 @@ class MainWindow(QMainWindow):
             'xray-bruker':self.check_xray,
             'body comp':self.check_body_comp,
             'echo':self.check_echo,
-            'ecg':self.check_ecg
+            'ecg':self.check_ecg,
+            ALL_PROTOCOLS:self.check_all
             }
         
         
@@ -222,11 +693,13 @@ class MainWindow(QMainWindow):
         # display the data model
         self.animal_view.setModel(self.animal_df)
         self.animal_layout.addWidget(self.animal_view)
+        self.animal_edit_triggers = self.animal_view.editTriggers()
+        self.animal_df.dataChanged.connect(self.animal_list_changed)
 
 
         # setup table for files
         self.file_view = QTableView(self)
-        self.file_df = PandasModel(self.file_list)
+        self.file_df = PandasModel(self.file_list,editable=False)
         # adjust aesthetics
         self.file_view.horizontalHeader().setStretchLastSection(True)
         self.file_view.setAlternatingRowColors(True)
@@ -240,7 +713,7 @@ class MainWindow(QMainWindow):
         self.files_layout.addWidget(self.file_label)
 
         # add feedback window
-        self.text1 = QTextEdit(self)
+        self.text1 = FeedbackLog(self)
         self.text1.insertHtml(
             html_text_color(
                 f'<strong><em>KOMP File Audit - VERSION {__VERSION__}</em></strong>',
@@ -254,14 +727,33 @@ class MainWindow(QMainWindow):
         self.parse_animal_list = QPushButton('Parse Animal List')
         self.parse_animal_list.clicked.connect(self.parse_animal_list_action)
         self.controls_layout.addWidget(self.parse_animal_list)
+        #    import animal list from a colony export
+        self.import_animal_list = QPushButton('Import Animal List')
+        self.import_animal_list.clicked.connect(self.import_animal_list_action)
+        self.controls_layout.addWidget(self.import_animal_list)
         #    clear animal list
         self.clear_animal_list = QPushButton('Clear Animal List')
         self.clear_animal_list.clicked.connect(self.clear_animal_list_action)
         self.controls_layout.addWidget(self.clear_animal_list)
+        #    add or remove animals, updating the last audit in place
+        self.add_animals = QPushButton('Add Animals')
+        self.add_animals.clicked.connect(self.add_animals_action)
+        self.controls_layout.addWidget(self.add_animals)
+        self.remove_animals = QPushButton('Remove Animals')
+        self.remove_animals.clicked.connect(self.remove_animals_action)
+        self.controls_layout.addWidget(self.remove_animals)
         #    select file directory to walk
         self.select_file_directory = QPushButton('Select File Directory for Audit')
         self.select_file_directory.clicked.connect(self.select_file_directory_action)
         self.controls_layout.addWidget(self.select_file_directory)
+        #    select a zip or tar archive to audit without extracting it
+        self.select_archive = QPushButton('Select Archive for Audit')
+        self.select_archive.clicked.connect(self.select_archive_action)
+        self.controls_layout.addWidget(self.select_archive)
+        #    optional audit service holding warm scans of shared directories
+        self.service_url = QLineEdit(self)
+        self.service_url.setPlaceholderText('Audit Service URL (optional)')
+        self.controls_layout.addWidget(self.service_url)
         
         #    select settings for check
         self.KOMP_test_label = QLabel('Select KOMP Test')
@@ -271,11 +763,25 @@ class MainWindow(QMainWindow):
         self.controls_layout.addWidget(self.KOMP_test)
         self.KOMP_test.setStyleSheet('background-color: white')
         self.KOMP_test.setStyleSheet('selection-background-color: blue')
+        #    optional integrity check of passing files
+        self.check_integrity = QCheckBox('Check File Integrity')
+        self.controls_layout.addWidget(self.check_integrity)
+        #    optional check of the ids, dates and studies in file headers (DICOM
+        #    and body comp/ECG text exports)
+        self.check_headers = QCheckBox('Verify File Headers')
+        self.controls_layout.addWidget(self.check_headers)
+        #    optional one line summary of stage timings after each run
+        self.show_timings = QCheckBox('Show Timings')
+        self.controls_layout.addWidget(self.show_timings)
         #    run comparison
         self.run_audit = QPushButton('Run Audit')
         self.run_audit.setStyleSheet('background-color: green')
         self.run_audit.clicked.connect(self.run_audit_action)
         self.controls_layout.addWidget(self.run_audit)
+        #    watch directory and update the audit live
+        self.watch_directory = QPushButton('Watch Directory')
+        self.watch_directory.clicked.connect(self.watch_directory_action)
+        self.controls_layout.addWidget(self.watch_directory)
         #    save report
         #    parse animal list
         self.report_label = QLabel('Report:')
@@ -283,6 +789,25 @@ class MainWindow(QMainWindow):
         self.save_report = QPushButton('Save Report')
         self.save_report.clicked.connect(self.save_report_action)
         self.controls_layout.addWidget(self.save_report)
+        #    view report categories
+        self.report_category = QComboBox(self)
+        self.report_category.addItems(
+            REPORT_CATEGORIES+NEAR_MISS_CATEGORIES+DUPLICATE_CATEGORIES+ \
+                INTEGRITY_CATEGORIES+HEADER_CATEGORIES+HISTORY_CATEGORIES
+            )
+        self.controls_layout.addWidget(self.report_category)
+        self.view_report = QPushButton('View Report')
+        self.view_report.clicked.connect(self.view_report_action)
+        self.controls_layout.addWidget(self.view_report)
+        #    latest status of one mouse across recorded audits
+        self.mouse_history = QPushButton('Mouse History')
+        self.mouse_history.clicked.connect(self.mouse_history_action)
+        self.controls_layout.addWidget(self.mouse_history)
+        #    cancel background work
+        self.cancel = QPushButton('Cancel')
+        self.cancel.clicked.connect(self.cancel_action)
+        self.cancel.setEnabled(False)
+        self.controls_layout.addWidget(self.cancel)
         
         
         
@@ -310,19 +835,10 @@ class MainWindow(QMainWindow):
                 )
             return
 
-        parsed_list = []
-        for r in raw_animal_list.split('\n'):
-            for c in r.split('\t'):
-                if c == '':
-                    continue
-                parsed_list.append(c)
-
         self.mouse_list = pandas.DataFrame(
-            {'parsed_mouse_list':sorted(parsed_list)}
+            {'parsed_mouse_list':parse_animal_text(raw_animal_list)}
             )
-        self.animal_df = PandasModel(self.mouse_list)
-        self.animal_view.setModel(self.animal_df)
-        self.animal_view.resizeColumnToContents(0)
+        self.show_animal_list()
         self.text1.insertHtml(
             html_text_color(
                 f'<strong>{len(self.mouse_list)}</strong> animals found.',
@@ -333,105 +849,636 @@ class MainWindow(QMainWindow):
 
     
     @pyqtSlot()
-    def clear_animal_list_action(self):
-        self.reset_report()
+    def import_animal_list_action(self):
         self.text1.insertHtml(
-            html_text_color('clearing animal list','blue')
+            html_text_color('selecting colony export to import','blue')
             )
-        self.mouse_list = pandas.DataFrame({'mouse_list':['']})
-        self.animal_df = PandasModel(self.mouse_list)
-        self.animal_view.setModel(self.animal_df)
-        self.animal_view.resizeColumnToContents(0)
-
-
-        
-    @pyqtSlot()
-    def select_file_directory_action(self):
-        self.reset_report()
-        self.text1.insertHtml(
-            html_text_color('selecting file directory for audit','blue')
+        path, selected_filter = QFileDialog.getOpenFileName(
+            caption = 'Import Animal List',
+            filter = 'Colony export ({})'.format(
+                ' '.join('*'+f for f in ANIMAL_LIST_FORMATS)
+                )
             )
-        self.selected_directory = QFileDialog.getExistingDirectory()
-        self.file_label.setText(f'Directory: "{self.selected_directory}"')
-        if self.selected_directory == '' or self.selected_directory is None:
+        if path == '':
+            self.text1.insertHtml(
+                html_text_color('<strong>No file selected!</strong>','red')
+                )
+            return
+
+        try:
+            columns = animal_list_columns(path)
+        except Exception as e:
             self.text1.insertHtml(
                 html_text_color(
-                    '<strong>No file directory selected!</strong',
+                    f'<strong>Unable to read {path} - {type(e).__name__} : {e}</strong>',
                     'red'
                     )
                 )
-        else:
+            return
+        if len(columns) == 0:
             self.text1.insertHtml(
-                html_text_color(
-                    f'directory selected, checking files : {self.selected_directory}',
-                    'black'
-                    )
+                html_text_color('<strong>No columns found!</strong>','red')
                 )
-            self.populate_file_list()
-            
+            return
+
+        column, ok = QInputDialog.getItem(
+            self,
+            'Import Animal List',
+            'Column holding the animal ids',
+            columns,
+            columns.index(guess_animal_column(columns)),
+            False
+            )
+        if not ok:
+            return
+
+        self.reset_report()
+        self.start_worker(
+            Worker(import_task,path,column),
+            self.apply_animal_list
+            )
 
 
 
-    @pyqtSlot()
-    def run_audit_action(self):
+    def apply_animal_list(self,result):
+        self.mouse_list, counts = result
+        self.show_animal_list()
         self.text1.insertHtml(
             html_text_color(
-                f'attempting to run audit - {self.KOMP_test.currentText()}',
-                'blue'
+                f'<strong>{len(self.mouse_list)}</strong> animals imported '+ \
+                f'from {counts["rows"]} rows ({counts["duplicate"]} duplicate, '+ \
+                f'{counts["blank"]} blank, {counts["unparsed"]} unparsed, '+ \
+                f'{counts["conflict"]} with conflicting tags)',
+                'orange' if counts['conflict'] else 'black'
                 )
             )
-        
-        if self.mouse_list[self.mouse_list!=''].count()[0]!=0 and \
-                self.file_list[self.file_list!=''].count()[0]!=0:
-            self.KOMP_test_settings[self.KOMP_test.currentText()](
-                self.KOMP_test.currentText()
-                )
 
-        else:
+
+
+    @pyqtSlot()
+    def add_animals_action(self):
+        if 'parsed_mouse_list' not in self.mouse_list.columns:
             self.text1.insertHtml(
                 html_text_color(
-                    '<strong>Missing Inputs - Audit Aborted!</strong',
+                    '<strong>Parse or import an animal list first!</strong>',
                     'red'
                     )
                 )
+            return
+        text, ok = QInputDialog.getMultiLineText(
+            self,
+            'Add Animals',
+            'Animal ids to add, one per line'
+            )
+        added = parse_animal_text(text) if ok else []
+        if len(added) == 0:
+            return
+
+        self.mouse_list = pandas.concat(
+            [self.mouse_list,pandas.DataFrame({'parsed_mouse_list':added})],
+            ignore_index=True
+            ).sort_values('parsed_mouse_list',ignore_index=True)
+        self.show_animal_list()
+        self.text1.insertHtml(
+            html_text_color(
+                f'<strong>{len(added)}</strong> animals added - '+ \
+                f'{len(self.mouse_list)} animals listed',
+                'black'
+                )
+            )
+        self.animal_list_changed()
+
 
-        
 
     @pyqtSlot()
-    def save_report_action(self):
-        output_path = QFileDialog.getSaveFileName(
-            caption = 'Save Report',
-            filter = ('Excel (*.xlsx)')
-            )[0]
-        
-        if output_path != '' and self.report!={}:
-            
-            writer=pandas.ExcelWriter(output_path,engine='xlsxwriter')
-            
-            for k,v in self.report.items():
-                pandas.DataFrame(
-                    sorted(v)
-                    ).to_excel(writer,k, index=False, header=False)
-                
-            writer.save()
-            self.text1.insertHtml(
-                html_text_color(
-                    f'<strong>Report Saved : {output_path}</strong>',
-                    'black'
-                    )
-                )
-        else:
+    def remove_animals_action(self):
+        if 'parsed_mouse_list' not in self.mouse_list.columns:
             self.text1.insertHtml(
                 html_text_color(
-                    '<strong>Unable to save report!</strong>',
+                    '<strong>Parse or import an animal list first!</strong>',
                     'red'
                     )
                 )
-            
-
-    def reset_report(self):
+            return
+        text, ok = QInputDialog.getMultiLineText(
+            self,
+            'Remove Animals',
+            'Animal ids or barcodes to remove, one per line'
+            )
+        barcodes = {parse_barcode(i) for i in parse_animal_text(text)} if ok else set()
+        barcodes.discard(None)
+        if len(barcodes) == 0:
+            return
+
+        removed = parse_filenames(
+            self.mouse_list['parsed_mouse_list']
+            )['barcode'].isin(barcodes)
+        self.mouse_list = self.mouse_list[~removed].reset_index(drop=True)
+        self.show_animal_list()
+        self.text1.insertHtml(
+            html_text_color(
+                f'<strong>{removed.sum()}</strong> animals removed - '+ \
+                f'{len(self.mouse_list)} animals listed',
+                'black'
+                )
+            )
+        self.animal_list_changed()
+
+
+
+    def show_animal_list(self):
+        self.animal_df = PandasModel(self.mouse_list)
+        self.animal_df.dataChanged.connect(self.animal_list_changed)
+        self.animal_view.setModel(self.animal_df)
+        self.animal_view.resizeColumnToContents(0)
+
+
+
+    def animal_list_changed(self):
+        """
+        Apply edits of the parsed animal list to the last single test audit
+
+        The first edit after an audit re-audits in the background to build
+        the IncrementalAudit; later edits only recompute the changed
+        barcodes. The list cannot be edited while a worker runs (set_busy),
+        so no edit is made behind a running audit.
+        """
+        if self.audit_settings is None or \
+                'parsed_mouse_list' not in self.mouse_list.columns:
+            return
+
+        if self.incremental_audit is None:
+            self.start_worker(
+                Worker(
+                    reaudit_task,
+                    self.mouse_list.copy(),
+                    self.file_list,
+                    self.audit_settings
+                    ),
+                self.apply_animal_edits
+                )
+            return
+
+        self.apply_animal_edits(
+            (
+                self.incremental_audit,
+                self.incremental_audit.update_mouse_list(self.mouse_list)
+                )
+            )
+
+
+
+    def apply_animal_edits(self,result):
+        self.incremental_audit, affected = result
+        self.report.update(
+            zip(REPORT_CATEGORIES,self.incremental_audit.results())
+            )
+        # near misses are matched in the background, see apply_near_misses
+        self.report.pop(NEAR_MISS_CATEGORIES[0],None)
+        # integrity and header checks ran on the old passing files, and the
+        # history compares the audit as it was recorded
+        stale = [
+            c for c in INTEGRITY_CATEGORIES+HEADER_CATEGORIES+HISTORY_CATEGORIES
+            if c in self.report
+            ]
+        for category in stale:
+            del self.report[category]
+        passing_files, missing_files, unexpected_files, \
+            passing_mice, missing_mice, unexpected_mice = [
+                len(r) for r in self.incremental_audit.results()
+                ]
+        self.text1.insertHtml(
+            html_text_color(
+                'animal list edit : '+ \
+                ('all' if affected is None else f'{len(affected)}')+ \
+                ' barcodes updated - '+ \
+                f'files {passing_files} passing, {missing_files} missing, '+ \
+                f'{unexpected_files} unexpected - '+ \
+                f'mice {passing_mice} passing, {missing_mice} missing, '+ \
+                f'{unexpected_mice} unexpected',
+                'black'
+                )
+            )
+        if stale:
+            self.text1.insertHtml(
+                html_text_color(
+                    'animal list edit : integrity, header and history results '+ \
+                    'are stale and were dropped - run the audit again to '+ \
+                    'refresh them (edits are not recorded in the audit history)',
+                    'orange'
+                    )
+                )
+        self.start_worker(
+            Worker(
+                near_miss_task,
+                set(self.report['missing_files']),
+                set(self.report['unexpected_files'])
+                ),
+            self.apply_near_misses
+            )
+
+
+
+    def apply_near_misses(self,near_misses):
+        self.report[NEAR_MISS_CATEGORIES[0]] = near_misses
+        self.set_report_categories(
+            [
+                c for c in REPORT_CATEGORIES+NEAR_MISS_CATEGORIES+ \
+                    DUPLICATE_CATEGORIES+INTEGRITY_CATEGORIES+ \
+                    HEADER_CATEGORIES+HISTORY_CATEGORIES
+                if c in self.report
+                ]
+            )
+        self.text1.insertHtml(
+            html_text_color(
+                f'animal list edit : {len(near_misses)} near misses',
+                'orange' if len(near_misses) else 'black'
+                )
+            )
+
+
+
+    @pyqtSlot()
+    def clear_animal_list_action(self):
+        self.reset_report()
+        self.text1.insertHtml(
+            html_text_color('clearing animal list','blue')
+            )
+        self.mouse_list = pandas.DataFrame({'mouse_list':['']})
+        self.show_animal_list()
+
+
+        
+    @pyqtSlot()
+    def select_file_directory_action(self):
+        self.reset_report()
+        self.text1.insertHtml(
+            html_text_color('selecting file directory for audit','blue')
+            )
+        self.selected_directory = QFileDialog.getExistingDirectory()
+        self.file_label.setText(f'Directory: "{self.selected_directory}"')
+        if self.selected_directory == '' or self.selected_directory is None:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>No file directory selected!</strong',
+                    'red'
+                    )
+                )
+        else:
+            self.text1.insertHtml(
+                html_text_color(
+                    f'directory selected, checking files : {self.selected_directory}',
+                    'black'
+                    )
+                )
+            self.populate_file_list()
+            
+
+
+
+    @pyqtSlot()
+    def select_archive_action(self):
+        self.reset_report()
+        self.text1.insertHtml(
+            html_text_color('selecting archive for audit','blue')
+            )
+        archive, selected_filter = QFileDialog.getOpenFileName(
+            caption = 'Select Archive for Audit',
+            filter = 'Archives ({})'.format(
+                ' '.join('*'+e for e in ARCHIVE_EXTENSIONS)
+                )
+            )
+        if archive == '':
+            self.text1.insertHtml(
+                html_text_color('<strong>No archive selected!</strong>','red')
+                )
+            return
+
+        self.selected_directory = archive
+        self.file_label.setText(f'Directory: "{self.selected_directory}"')
+        self.text1.insertHtml(
+            html_text_color(
+                f'archive selected, checking files : {self.selected_directory}',
+                'black'
+                )
+            )
+        self.populate_file_list()
+
+
+
+    @pyqtSlot()
+    def run_audit_action(self):
+        self.text1.insertHtml(
+            html_text_color(
+                f'attempting to run audit - {self.KOMP_test.currentText()}',
+                'blue'
+                )
+            )
+        
+        if 'parsed_mouse_list' in self.mouse_list.columns and \
+                'filename' in self.file_list.columns:
+            self.KOMP_test_settings[self.KOMP_test.currentText()](
+                self.KOMP_test.currentText()
+                )
+
+        else:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Missing Inputs - Audit Aborted!</strong',
+                    'red'
+                    )
+                )
+
+        
+
+    @pyqtSlot()
+    def watch_directory_action(self):
+        test = self.KOMP_test.currentText()
+        self.text1.insertHtml(
+            html_text_color(f'attempting to watch directory - {test}','blue')
+            )
+        
+        if test not in KOMP_PROTOCOLS:
+            self.text1.insertHtml(
+                html_text_color(
+                    f'<strong>Watch not available for {test}!</strong>',
+                    'red'
+                    )
+                )
+        elif 'filename' in self.file_list.columns and \
+                is_archive(self.selected_directory):
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Watch not available for archives!</strong>',
+                    'red'
+                    )
+                )
+        elif 'parsed_mouse_list' in self.mouse_list.columns and \
+                'filename' in self.file_list.columns:
+            self.start_worker(
+                Worker(
+                    watch_task,
+                    self.selected_directory,
+                    self.mouse_list.copy(),
+                    self.file_list,
+                    KOMP_PROTOCOLS[test]
+                    ),
+                self.apply_watch_results,
+                on_partial=self.show_watch_counts
+                )
+        else:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Missing Inputs - Watch Aborted!</strong',
+                    'red'
+                    )
+                )
+
+
+
+    def show_watch_counts(self,update):
+        passing_files, missing_files, unexpected_files, \
+            passing_mice, missing_mice, unexpected_mice = update['counts']
+        self.text1.insertHtml(
+            html_text_color(
+                f'watch : +{update["created"]} / -{update["deleted"]} files - '+ \
+                f'files {passing_files} passing, {missing_files} missing, '+ \
+                f'{unexpected_files} unexpected - '+ \
+                f'mice {passing_mice} passing, {missing_mice} missing, '+ \
+                f'{unexpected_mice} unexpected',
+                'black'
+                )
+            )
+
+
+
+    def apply_watch_results(self,results):
+        audit, file_index = results
+        self.text1.insertHtml(
+            html_text_color('<strong>Watch stopped</strong>','blue')
+            )
+        self.show_file_list(file_list_frame(file_index.values()))
+        self.build_report(*audit.results())
+        self.audit_settings = {
+            'file_suffixes':audit.file_suffixes,
+            'basename_length':audit.basename_length,
+            'assignment':audit.assignment
+            }
+        self.incremental_audit = audit
+
+
+
+    @pyqtSlot()
+    def save_report_action(self):
+        output_path, selected_filter = QFileDialog.getSaveFileName(
+            caption = 'Save Report',
+            filter = ('Excel (*.xlsx);;CSV (*.csv);;Parquet (*.parquet)')
+            )
+        
+        if output_path != '' and self.report!={}:
+            # add the extension of the chosen format if it was not typed
+            if os.path.splitext(output_path)[1].lower() not in REPORT_FORMATS:
+                output_path += selected_filter.split('*')[-1].rstrip(')')
+            
+            run_log = RunLog(report=output_path)
+            
+            def report_saved(output_path):
+                self.text1.insertHtml(
+                    html_text_color(
+                        f'<strong>Report Saved : {output_path}</strong>',
+                        'black'
+                        )
+                    )
+                self.finish_run(run_log)
+            
+            self.start_worker(
+                Worker(save_task,self.report,output_path,run_log),
+                report_saved
+                )
+        else:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Unable to save report!</strong>',
+                    'red'
+                    )
+                )
+            
+
+    @pyqtSlot()
+    def view_report_action(self):
+        category = self.report_category.currentText()
+        if category not in self.report:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>No report to view - run an audit first!</strong>',
+                    'red'
+                    )
+                )
+            return
+
+        report_view = ReportView(
+            f'{category} - {self.KOMP_test.currentText()}',
+            self.report[category],
+            parent=self
+            )
+        self.report_views.append(report_view)
+        report_view.show()
+
+
+
+    @pyqtSlot()
+    def mouse_history_action(self):
+        animal_id, ok = QInputDialog.getText(
+            self,
+            'Mouse History',
+            'Animal id or barcode:'
+            )
+        if not ok or animal_id.strip() == '':
+            return
+        barcode = parse_barcode(animal_id.strip())
+        if barcode is None:
+            self.text1.insertHtml(
+                html_text_color(
+                    f'<strong>Unable to parse animal id : {animal_id}</strong>',
+                    'red'
+                    )
+                )
+            return
+
+        latest = self.history.latest_status(barcode)
+        if len(latest) == 0:
+            self.text1.insertHtml(
+                html_text_color(
+                    f'<strong>No recorded audits of mouse {barcode}</strong>',
+                    'red'
+                    )
+                )
+            return
+
+        missing = self.history.missing_tests(barcode)
+        self.text1.insertHtml(
+            html_text_color(
+                f'<strong>mouse {barcode} : {len(missing)} tests still missing'+ \
+                (f' - {", ".join(missing)}' if missing else '')+'</strong>',
+                'red' if missing else 'green'
+                )
+            )
+        report_view = ReportView(
+            f'mouse {barcode} - latest audit of each test',
+            latest,
+            parent=self
+            )
+        self.report_views.append(report_view)
+        report_view.show()
+
+
+
+    @pyqtSlot()
+    def cancel_action(self):
+        if self.worker is not None:
+            self.text1.insertHtml(
+                html_text_color('cancelling...','blue')
+                )
+            self.worker.cancel()
+
+
+
+    def set_busy(self,busy):
+        for b in [
+                self.parse_animal_list,
+                self.import_animal_list,
+                self.clear_animal_list,
+                self.add_animals,
+                self.remove_animals,
+                self.select_file_directory,
+                self.select_archive,
+                self.service_url,
+                self.run_audit,
+                self.watch_directory,
+                self.save_report,
+                self.view_report,
+                self.mouse_history
+                ]:
+            b.setEnabled(not busy)
+        self.cancel.setEnabled(busy)
+        # workers audit a copy of the animal list, so it is read-only until
+        # they are done
+        self.animal_view.setEditTriggers(
+            QTableView.NoEditTriggers if busy else self.animal_edit_triggers
+            )
+
+
+
+    def start_worker(self,worker,on_finished,on_partial=None,on_stopped=None):
+        """
+        Start a Worker on the thread pool, locking the controls until done
+
+        on_finished receives the task result in the GUI thread, so results
+        are applied to the window in one step. on_stopped is called if the
+        task is cancelled or fails.
+        """
+        self.worker = worker
+        self.set_busy(True)
+
+        def worker_done():
+            self.worker = None
+            self.set_busy(False)
+
+        def worker_finished(result):
+            worker_done()
+            on_finished(result)
+
+        def worker_cancelled():
+            worker_done()
+            if on_stopped is not None:
+                on_stopped()
+            self.text1.insertHtml(
+                html_text_color('<strong>Cancelled!</strong>','red')
+                )
+
+        def worker_error(message):
+            worker_done()
+            if on_stopped is not None:
+                on_stopped()
+            self.text1.insertHtml(
+                html_text_color(f'<strong>Error - {message}</strong>','red')
+                )
+
+        worker.signals.progress.connect(
+            lambda message: self.text1.insertHtml(
+                html_text_color(message,'blue')
+                )
+            )
+        if on_partial is not None:
+            worker.signals.partial.connect(on_partial)
+        worker.signals.finished.connect(worker_finished)
+        worker.signals.cancelled.connect(worker_cancelled)
+        worker.signals.error.connect(worker_error)
+        QThreadPool.globalInstance().start(worker)
+
+
+
+    def reset_report(self):
         self.report = {}
+        self.audit_settings = None
+        self.incremental_audit = None
         self.report_label.setText('Report:')
+        for report_view in self.report_views:
+            report_view.close()
+        self.report_views = []
+        self.set_report_categories(
+            REPORT_CATEGORIES+NEAR_MISS_CATEGORIES+DUPLICATE_CATEGORIES+ \
+                INTEGRITY_CATEGORIES+HEADER_CATEGORIES+HISTORY_CATEGORIES
+            )
+
+
+
+    def set_report_categories(self,categories):
+        if [self.report_category.itemText(i) for i in range(
+                self.report_category.count()
+                )] != categories:
+            self.report_category.clear()
+            self.report_category.addItems(categories)
     
     def build_report(
             self,
@@ -440,17 +1487,26 @@ class MainWindow(QMainWindow):
             unexpected_files,
             passing_mice,
             missing_mice,
-            unexpected_mice
+            unexpected_mice,
+            **extra_categories
             ):
         
-        self.report = {
-            'passing_files':passing_files,
-            'missing_files':missing_files,
-            'unexpected_files':unexpected_files,
-            'passing_mice':passing_mice,
-            'missing_mice':missing_mice,
-            'unexpected_mice':unexpected_mice
-            }
+        self.report = dict(
+            zip(
+                REPORT_CATEGORIES,
+                [
+                    passing_files,
+                    missing_files,
+                    unexpected_files,
+                    passing_mice,
+                    missing_mice,
+                    unexpected_mice
+                    ]
+                )
+            )
+        
+        self.report.update(extra_categories)
+        self.set_report_categories(list(self.report.keys()))
         
         self.report_label.setText(f'REPORT: {self.KOMP_test.currentText()}\n{self.selected_directory}')
         
@@ -462,6 +1518,7 @@ class MainWindow(QMainWindow):
             len(missing_mice) + \
             len(unexpected_mice)
         
+        # counts only - the full lists open in a ReportView on request
         self.text1.insertHtml(
             html_text_color(
                 f'<strong>Audit Results : {file_total} files checked</strong>',
@@ -470,22 +1527,19 @@ class MainWindow(QMainWindow):
             )
         self.text1.insertHtml(
             html_text_color(
-                f'<strong>Passing : {len(passing_files)} files</strong><br/>'+ \
-                f'{"    ".join(sorted(passing_files))}',
+                f'<strong>Passing : {len(passing_files)} files</strong>',
                 'green'
                 )
             )
         self.text1.insertHtml(
             html_text_color(
-                f'<strong>Missing : {len(missing_files)} files</strong><br/>'+ \
-                f'{"    ".join(sorted(missing_files))}',
+                f'<strong>Missing : {len(missing_files)} files</strong>',
                 'red'
                 )
             )
         self.text1.insertHtml(
             html_text_color(
-                f'<strong>Unexpected : {len(unexpected_files)} files</strong><br/>'+ \
-                f'{"    ".join(sorted(unexpected_files))}',
+                f'<strong>Unexpected : {len(unexpected_files)} files</strong>',
                 'orange'
                 )
             )
@@ -497,120 +1551,289 @@ class MainWindow(QMainWindow):
             )
         self.text1.insertHtml(
             html_text_color(
-                f'<strong>Passing : {len(passing_mice)} mice</strong><br/>'+ \
-                f'{"    ".join(sorted(passing_mice))}',
+                f'<strong>Passing : {len(passing_mice)} mice</strong>',
                 'green'
                 )
             )
         self.text1.insertHtml(
             html_text_color(
-                f'<strong>Missing : {len(missing_mice)} mice</strong><br/>'+ \
-                f'{"    ".join(sorted(missing_mice))}',
+                f'<strong>Missing : {len(missing_mice)} mice</strong>',
                 'red'
                 )
             )
         self.text1.insertHtml(
             html_text_color(
-                f'<strong>Unexpected : {len(unexpected_mice)} mice</strong><br/>'+ \
-                f'{"    ".join(sorted(unexpected_mice))}',
+                f'<strong>Unexpected : {len(unexpected_mice)} mice</strong>',
                 'orange'
                 )
             )
+        self.show_check_counts(extra_categories)
+        self.text1.insertHtml(
+            html_text_color(
+                'select a category and press View Report to list it',
+                'black'
+                )
+            )
         
     
     
     
+    def show_check_counts(self,extra_categories):
+        if NEAR_MISS_CATEGORIES[0] in extra_categories:
+            near_misses = extra_categories[NEAR_MISS_CATEGORIES[0]]
+            self.text1.insertHtml(
+                html_text_color(
+                    f'<strong>Near misses : {len(near_misses)} unexpected '+ \
+                    'files look like a missing file</strong>',
+                    'orange' if len(near_misses) else 'black'
+                    )
+                )
+        if DUPLICATE_CATEGORIES[0] in extra_categories:
+            duplicates = extra_categories[DUPLICATE_CATEGORIES[0]]
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Duplicates : '+ \
+                    f'{duplicates["filename"].nunique()} filenames found in '+ \
+                    f'more than one folder ({len(duplicates)} paths)</strong>',
+                    'orange' if len(duplicates) else 'black'
+                    )
+                )
+        if 'empty_files' in extra_categories:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Integrity : '+ \
+                    f'{len(extra_categories["empty_files"])} empty files, '+ \
+                    f'{len(extra_categories["small_files"])} small files, '+ \
+                    f'{len(extra_categories["duplicate_files"])} duplicate groups</strong>',
+                    'orange'
+                    )
+                )
+        if 'header_id_mismatch' in extra_categories:
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>Headers : '+ \
+                    f'{len(extra_categories["header_id_mismatch"])} id mismatches, '+ \
+                    f'{len(extra_categories["header_date_mismatch"])} date mismatches, '+ \
+                    f'{len(extra_categories["header_study_mismatch"])} study mismatches, '+ \
+                    f'{len(extra_categories["header_unreadable"])} unreadable</strong>',
+                    'orange'
+                    )
+                )
+        if HISTORY_CATEGORIES[0] in extra_categories:
+            changes = extra_categories[HISTORY_CATEGORIES[0]]
+            self.text1.insertHtml(
+                html_text_color(
+                    '<strong>History : '+ \
+                    f'{(changes["type"] == "file").sum()} files and '+ \
+                    f'{(changes["type"] == "mouse").sum()} mice changed '+ \
+                    'since the last audit of this directory</strong>',
+                    'black'
+                    )
+                )
+
+
+
+    def build_multi_report(self,report,reports):
+        matrix = report['mouse_test_matrix']
+
+        self.report = report
+        self.set_report_categories(list(self.report.keys()))
+
+        self.report_label.setText(f'REPORT: {ALL_PROTOCOLS}\n{self.selected_directory}')
+
+        self.text1.insertHtml(
+            html_text_color(
+                f'<strong>Audit Results : {len(reports)} protocols, '+ \
+                f'{len(matrix)} animals checked</strong>',
+                'black'
+                )
+            )
+        for test, test_report in reports.items():
+            self.text1.insertHtml(
+                html_text_color(
+                    f'<strong>{test}</strong> : files '+ \
+                    f'{len(test_report["passing_files"])} passing, '+ \
+                    f'{len(test_report["missing_files"])} missing, '+ \
+                    f'{len(test_report["unexpected_files"])} unexpected - mice '+ \
+                    f'{len(test_report["passing_mice"])} passing, '+ \
+                    f'{len(test_report["missing_mice"])} missing, '+ \
+                    f'{len(test_report["unexpected_mice"])} unexpected - '+ \
+                    f'{len(test_report["near_miss_files"])} near misses',
+                    'black'
+                    )
+                )
+        self.show_check_counts(report)
+        self.text1.insertHtml(
+            html_text_color(
+                'select a category (or mouse_test_matrix) and press View Report to list it',
+                'black'
+                )
+            )
+
+
+
     def populate_file_list(self):
-        file_dict = {}
-        found_files = os.walk(self.selected_directory)
-        for d,p,f in found_files:
-            for filename in f:
-                file_dict[filename] = os.path.join(d,filename)
-                
-        if len(file_dict) == 0:
+        self.scan_log = RunLog()
+        self.scan_stages = []
+        service_url = self.service_url.text().strip()
+        if service_url != '' and not is_archive(self.selected_directory):
+            self.start_worker(
+                Worker(
+                    service_scan_task,
+                    service_url,
+                    self.selected_directory,
+                    self.scan_log
+                    ),
+                lambda file_list: self.apply_file_list(file_list,service_url),
+                on_stopped=lambda: self.file_view.setModel(self.file_df)
+                )
+            return
+
+        self.start_worker(
+            Worker(
+                scan_task,
+                self.directory_index,
+                self.selected_directory,
+                self.scan_log
+                ),
+            self.apply_file_list,
+            on_partial=self.preview_file_list,
+            on_stopped=lambda: self.file_view.setModel(self.file_df)
+            )
+
+
+
+    def apply_file_list(self,file_list,service_url=None):
+        if len(file_list) == 0:
             self.text1.insertHtml(
                 html_text_color('<strong>No files found!</strong>','red')
                 )
         else:
             self.text1.insertHtml(
                 html_text_color(
-                    f'<strong>{len(file_dict)}</strong> files found',
+                    f'<strong>{len(file_list)}</strong> files found',
                     'black'
                     )
                 )
-            self.file_list = pandas.DataFrame(
-                {
-                    'filename':file_dict.keys(),
-                    'path':file_dict.values()}
+            with self.scan_log.stage('list'):
+                self.show_file_list(file_list)
+        self.scan_stages = self.scan_log.stages
+        if service_url is not None:
+            self.text1.insertHtml(
+                html_text_color(f'file list served by {service_url}','black')
                 )
-            self.file_df = PandasModel(self.file_list)
-            self.file_view.setModel(self.file_df)
-            self.file_view.resizeColumnToContents(0)
-           
+            return
+        self.text1.insertHtml(
+            html_text_color(
+                f'{self.directory_index.reused_directories} directories '+ \
+                f'reused from index, {self.directory_index.rescanned_directories} '+ \
+                'rescanned',
+                'black'
+                )
+            )
 
 
 
+    def show_file_list(self,file_list):
+        self.file_list = file_list
+        self.file_df = PandasModel(self.file_list,editable=False)
+        self.file_view.setModel(self.file_df)
+        self.file_view.resizeColumnToContents(0)
 
-    def check_std(self,protocol_version):
-    
-        file_suffixes = [
-            '.csv',
-            ]
-                        
-        
-        self.build_report(
-            *filename_audit(
-                self.mouse_list,
-                self.file_list,
-                file_suffixes,
-                8,
-                )
+
+
+    def preview_file_list(self,entries):
+        # show a partial scan without replacing self.file_list
+        self.file_view.setModel(
+            PandasModel(file_list_frame(entries,parse=False),editable=False)
             )
 
 
 
-    def check_xray(self,protocol_version):
-        if protocol_version == 'xray-bruker':
-            
-            file_suffixes = [
-                '.bip',
-                '-2.bip',
-                '-h.bip',
-                '-l.bip',
-                '-v.bip'
-                ]
-                            
-            
-            self.build_report(
-                *filename_audit(
-                    self.mouse_list,
-                    self.file_list,
-                    file_suffixes,
-                    8,
-                    assignment = ['T','t','D','d']
-                    )
+    def new_run_log(self):
+        """
+        Start the RunLog of an audit, taking up the stages of the scan it
+        audits the first time that scan is audited
+        """
+        run_log = RunLog(
+            directory=self.selected_directory,
+            test=self.KOMP_test.currentText(),
+            files=len(self.file_list),
+            animals=len(self.mouse_list)
+            )
+        run_log.stages = self.scan_stages
+        self.scan_stages = []
+
+        return run_log
+
+
+
+    def finish_run(self,run_log):
+        if self.show_timings.isChecked():
+            self.text1.insertHtml(
+                html_text_color(f'timings : {run_log.summary()}','black')
                 )
-            
-        elif protocol_version == 'xray-faxitron':
-            file_suffixes = [
-                '.dcm',
-                '-2.dcm',
-                '-h.dcm',
-                '-l.dcm',
-                '-v.dcm'
-                ]
-                            
-            
-            self.build_report(
-                *filename_audit(
-                    self.mouse_list,
-                    self.file_list,
-                    file_suffixes,
-                    8,
-                    assignment = ['T','t','D','d']
+        try:
+            run_log.save()
+        except OSError as e:
+            self.text1.insertHtml(
+                html_text_color(
+                    f'<strong>Unable to write run log : {e}</strong>',
+                    'red'
                     )
                 )
-            
+
+
+
+    def start_audit(self,protocol_version):
+        run_log = self.new_run_log()
+
+        def audit_finished(results):
+            report, reports = results
+            with run_log.stage('render'):
+                if protocol_version == ALL_PROTOCOLS:
+                    self.build_multi_report(report,reports)
+                else:
+                    self.build_report(
+                        *[report[k] for k in REPORT_CATEGORIES],
+                        **{
+                            k:v for k,v in report.items()
+                            if k not in REPORT_CATEGORIES
+                            }
+                        )
+            self.audit_settings = KOMP_PROTOCOLS.get(protocol_version)
+            self.incremental_audit = None
+            self.finish_run(run_log)
+
+        self.start_worker(
+            Worker(
+                audit_task,
+                # the animal table stays editable while the audit runs
+                self.mouse_list.copy(),
+                self.file_list,
+                protocol_version,
+                self.hash_cache if self.check_integrity.isChecked() else None,
+                self.check_headers.isChecked(),
+                self.history,
+                self.selected_directory,
+                run_log
+                ),
+            audit_finished,
+            on_stopped=lambda: self.finish_run(run_log)
+            )
+           
+
+
+
+
+    def check_std(self,protocol_version):
+        self.start_audit(protocol_version)
+
+
+
+    def check_xray(self,protocol_version):
+        if protocol_version in ['xray-bruker','xray-faxitron']:
+            self.start_audit(protocol_version)
             
         else:
             self.text1.insertHtml(
@@ -623,52 +1846,26 @@ class MainWindow(QMainWindow):
 
 
     def check_body_comp(self,protocol_version):
-        file_suffixes = [
-            '.txt',
-            '.jpg',
-            ]
-                        
-        
-        self.build_report(
-            *filename_audit(
-                self.mouse_list,
-                self.file_list,
-                file_suffixes,
-                8
-                )
-            )
+        self.start_audit(protocol_version)
 
 
     
     def check_echo(self,protocol_version):
-        self.text1.insertHtml(
-            html_text_color(
-                '<strong>module not yet built - coming soon...</strong>',
-                'red'
-                )
-            )
+        self.start_audit(protocol_version)
 
 
     
     def check_ecg(self,protocol_version):
-        file_suffixes = [
-            '.txt',
-            '.adicht'
-            ]
-                        
-        
-        self.build_report(
-            *filename_audit(
-                self.mouse_list,
-                self.file_list,
-                file_suffixes,
-                8,
-                assignment = ['E','e']
-                )
-            )
+        self.start_audit(protocol_version)
+
+
+
+    def check_all(self,protocol_version):
+        self.start_audit(protocol_version)
         
 
 
+
     
 
 #%% define main
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of scanning and reading zip and tar archives in place
+"""
+
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import KOMP_Audit_Core
+from KOMP_Audit_Core import list_archive, open_file, read_files
+from KOMP_Audit_Core import file_list_frame, file_paths, hash_files
+from KOMP_Audit_Core import integrity_check, scan_file_list
+
+MEMBERS = {
+    'cohort/day1/M00000001.csv':b'first',
+    'cohort/day1/M00000002.csv':b'second file',
+    'cohort/day2/M00000003.csv':b'first',
+    'cohort/M00000004.txt':b''
+    }
+
+
+
+def write_archive(path,members=MEMBERS):
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path,'w') as z:
+            for name, data in members.items():
+                z.writestr(name,data)
+    else:
+        with tarfile.open(path,'w:gz') as t:
+            for name, data in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = 1700000000
+                t.addfile(info,io.BytesIO(data))
+
+    return path
+
+
+
+@pytest.fixture(params=['cohort.zip','cohort.tar.gz'])
+def archive(request,tmp_path):
+    return write_archive(str(tmp_path/request.param))
+
+
+
+def test_list_archive_and_open_members(archive):
+    entries = list_archive(archive)
+
+    assert sorted(e.filename for e in entries) == [
+        'M00000001.csv','M00000002.csv','M00000003.csv','M00000004.txt'
+        ]
+    for entry in entries:
+        member = os.path.relpath(entry.path,archive).replace(os.sep,'/')
+        assert entry.size == len(MEMBERS[member])
+        with open_file(entry.path) as f:
+            assert f.read() == MEMBERS[member]
+    assert {e.directory for e in entries} == {
+        os.path.join(archive,'cohort','day1'),
+        os.path.join(archive,'cohort','day2'),
+        os.path.join(archive,'cohort')
+        }
+    with pytest.raises((OSError, KeyError)):
+        with open_file(os.path.join(archive,'cohort','M00009999.csv')) as f:
+            f.read()
+
+
+
+def test_unreadable_archive_is_skipped(tmp_path):
+    for name in ['broken.zip','broken.tar.gz']:
+        path = tmp_path/name
+        path.write_bytes(b'not an archive')
+        assert list_archive(str(path)) == []
+
+
+
+def test_archive_nested_in_scanned_directory(tmp_path):
+    root = tmp_path/'data'
+    os.makedirs(str(root/'site'))
+    (root/'M00000005.csv').write_bytes(b'plain')
+    write_archive(str(root/'site'/'cohort.tar.gz'))
+    write_archive(
+        str(root/'site'/'extra.zip'),
+        {'M00000006.csv':b'zipped'}
+        )
+
+    file_list = scan_file_list(str(root))
+    paths = dict(zip(file_list['filename'],file_paths(file_list)))
+
+    assert set(paths) == {
+        'M00000001.csv','M00000002.csv','M00000003.csv','M00000004.txt',
+        'M00000005.csv','M00000006.csv'
+        }
+    assert paths['M00000002.csv'] == os.path.join(
+        str(root),'site','cohort.tar.gz','cohort','day1','M00000002.csv'
+        )
+    with open_file(paths['M00000006.csv']) as f:
+        assert f.read() == b'zipped'
+
+    report = integrity_check(set(paths),file_list)
+    assert report['empty_files'] == {'M00000004.txt'}
+    assert report['duplicate_files'] == {'M00000001.csv = M00000003.csv'}
+
+
+
+def test_read_files_reads_each_archive_once(tmp_path,monkeypatch):
+    tar_path = write_archive(str(tmp_path/'cohort.tar.gz'))
+    zip_path = write_archive(str(tmp_path/'cohort.zip'))
+    plain_path = str(tmp_path/'M00000007.csv')
+    with open(plain_path,'wb') as f:
+        f.write(b'plain')
+    paths = [
+        os.path.join(archive,*member.split('/'))
+        for archive in [tar_path,zip_path] for member in MEMBERS
+        ]
+    paths += [plain_path,os.path.join(tar_path,'cohort','missing.csv')]
+
+    opened = []
+    tar_open = tarfile.open
+    def counting_open(*args,**kwargs):
+        opened.append(args[0])
+        return tar_open(*args,**kwargs)
+    monkeypatch.setattr(KOMP_Audit_Core.tarfile,'open',counting_open)
+
+    results = read_files(lambda path, f: (path,f.read()),paths)
+
+    assert opened == [tar_path]
+    assert results == [(p,MEMBERS[m]) for p,m in zip(paths,2*list(MEMBERS))]+[
+        (plain_path,b'plain'),None
+        ]
+
+
+
+def test_hash_files_reads_archive_members(archive):
+    file_list = file_list_frame(list_archive(archive))
+
+    digests = hash_files(file_list)
+
+    assert digests == {
+        os.path.join(archive,*member.split('/')):hashlib.sha256(data).hexdigest()
+        for member, data in MEMBERS.items()
+        }
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the filename audit, barcode parsing and the all protocols audit
+of KOMP_Audit_Core
+"""
+
+import random
+import re
+
+import pandas
+import pytest
+
+from KOMP_Audit_Core import KOMP_PROTOCOLS, REPORT_CATEGORIES
+from KOMP_Audit_Core import BARCODE_PATTERN, SIMPLE_BARCODE_PATTERN
+from KOMP_Audit_Core import filename_audit, multi_protocol_audit
+from KOMP_Audit_Core import parse_filenames
+
+
+
+def baseline_audit(mouse_list,file_list,file_suffixes,basename_length,assignment=None):
+    """
+    The original set based filename_audit of KOMP_File_Audit.py
+    """
+    barcode_finder = re.compile(
+        r'^(?P<prefix>M?0*)(?P<barcode>.+?)(-wt)?(\s)?(?P<assignment>\(.*?\))?(?P<suffix>[\.|-].*)?$'
+        )
+
+    anticipated_files = []
+    for a in list(mouse_list['parsed_mouse_list']):
+        parsed_mouse = re.search(barcode_finder,a)
+        if assignment is not None and not any(
+                [i in parsed_mouse['assignment'] for i in assignment]
+                ):
+            continue
+
+        if parsed_mouse['prefix'] == '':
+            prefix = 'M'+'0'*(basename_length-len(parsed_mouse['barcode']))
+        else:
+            prefix = parsed_mouse['prefix']
+        for s in file_suffixes:
+            anticipated_files.append(prefix+parsed_mouse['barcode']+s)
+
+    anticipated_set = set(anticipated_files)
+    actual_set = set(list(file_list['filename']))
+
+    missing_files = anticipated_set.difference(actual_set)
+    passing_files = anticipated_set.intersection(actual_set)
+    unexpected_files = actual_set.difference(anticipated_set)
+
+    missing_mice = {re.search(barcode_finder,a)['barcode'] for a in missing_files}
+    passing_mice = {re.search(barcode_finder,a)['barcode'] for a in passing_files}
+    unexpected_mice = {re.search(barcode_finder,a)['barcode'] for a in unexpected_files}
+
+    passing_mice = passing_mice.difference(missing_mice).difference(unexpected_mice)
+
+    return passing_files, missing_files, unexpected_files, \
+        passing_mice, missing_mice, unexpected_mice
+
+
+
+def random_cohort(rng,suffixes):
+    mice = []
+    for i in range(rng.randint(0,30)):
+        barcode = str(rng.randint(1,99999))
+        form = rng.choice(
+            [
+                '{b}','M000{b}','M{z}{b}','{b}-wt','{b} (T)','M000{b} (E)',
+                '{b}-wt (t)','{b}(D)'
+                ]
+            )
+        mice.append(form.format(b=barcode,z='0'*(8-len(barcode))))
+
+    files = {'notes.docx','.hidden','a-b-c.txt','M00001234'}
+    for mouse in mice:
+        barcode = BARCODE_PATTERN.search(mouse)['barcode']
+        for suffix in suffixes:
+            if rng.random() < 0.5:
+                files.add(
+                    rng.choice(
+                        [
+                            'M'+barcode.rjust(8,'0'),
+                            'M000'+barcode,
+                            barcode,
+                            'M'+barcode.rjust(8,'0')+' (T)'
+                            ]
+                        )+suffix
+                    )
+
+    return (
+        pandas.DataFrame({'parsed_mouse_list':sorted(mice)}),
+        pandas.DataFrame({'filename':sorted(files)})
+        )
+
+
+
+@pytest.mark.parametrize('test',['std','xray-faxitron','ecg'])
+def test_filename_audit_matches_baseline(test):
+    settings = KOMP_PROTOCOLS[test]
+    rng = random.Random(test)
+    for trial in range(25):
+        mouse_list, file_list = random_cohort(
+            rng,
+            settings['file_suffixes']+['.csv','-h.dcm','.txt']
+            )
+        if settings['assignment'] is not None:
+            # the baseline fails on mice without an assignment tag
+            baseline_mice = mouse_list[
+                mouse_list['parsed_mouse_list'].astype(str).str.contains(r'\(')
+                ]
+        else:
+            baseline_mice = mouse_list
+
+        assert filename_audit(mouse_list,file_list,**settings) == \
+            baseline_audit(baseline_mice,file_list,**settings)
+
+
+
+def test_simple_pattern_agrees_with_barcode_pattern():
+    rng = random.Random(0)
+    alphabet = 'M0123-.wt (T)|csvdh'
+    names = [
+        'M0000','M.csv','M00001234.csv','M00001234-h.dcm','0001234.csv',
+        'MM1.csv','M0','1234','M00001234-wt.csv','M00001234 (T).csv'
+        ]
+    names += [
+        ''.join(rng.choice(alphabet) for i in range(rng.randint(1,12)))
+        for n in range(5000)
+        ]
+
+    for name in names:
+        simple = SIMPLE_BARCODE_PATTERN.search(name)
+        if simple is not None:
+            full = BARCODE_PATTERN.search(name)
+            assert (simple['prefix'],simple['barcode'],simple['suffix']) == \
+                (full['prefix'],full['barcode'],full['suffix']), name
+
+    parsed = parse_filenames(pandas.Series(names))
+    for name, barcode in zip(names,parsed['barcode']):
+        full = BARCODE_PATTERN.search(name)
+        assert (None if pandas.isna(barcode) else barcode) == \
+            (None if full is None else full['barcode']), name
+
+
+
+def test_filename_audit_reads_parsed_columns():
+    mouse_list = pandas.DataFrame({'parsed_mouse_list':['1001','M00001002']})
+    file_list = pandas.DataFrame(
+        {'filename':['M00001001.csv','M00001003.csv','notes.docx']}
+        )
+    parsed = parse_filenames(file_list['filename'])
+    parsed_list = file_list.assign(
+        barcode=parsed['barcode'],
+        suffix=parsed['suffix'].astype('category')
+        )
+
+    assert filename_audit(mouse_list,parsed_list,['.csv'],8) == \
+        filename_audit(mouse_list,file_list,['.csv'],8) == (
+            {'M00001001.csv'},
+            {'M00001002.csv'},
+            {'M00001003.csv','notes.docx'},
+            {'1001'},
+            {'1002'},
+            {'1003','notes'}
+            )
+
+
+
+def test_multi_protocol_audit_matches_single_audits():
+    mouse_list = pandas.DataFrame(
+        {'parsed_mouse_list':['1001 (T)','1002 (E)','1003','1004']}
+        )
+    file_list = pandas.DataFrame(
+        {
+            'filename':[
+                'M00001001.csv',
+                'M00001001.dcm',
+                'M00001002.txt',
+                'M00001003.csv',
+                'M00001003.txt',
+                'M00009999.csv',
+                'M00001004.CSV'
+                ]
+            }
+        )
+
+    reports, matrix = multi_protocol_audit(mouse_list,file_list)
+
+    for test, settings in KOMP_PROTOCOLS.items():
+        audit = dict(
+            zip(
+                REPORT_CATEGORIES,
+                filename_audit(mouse_list,file_list,**settings)
+                )
+            )
+        assert reports[test]['passing_files'] == audit['passing_files']
+        assert reports[test]['missing_files'] == audit['missing_files']
+    # a .txt export is not unexpected in the std audit, a file of no
+    # protocol is unexpected in every one
+    assert 'M00001003.txt' not in reports['std']['unexpected_files']
+    assert 'M00001003.txt' in reports['ecg']['unexpected_files']
+    assert 'M00009999.csv' in reports['std']['unexpected_files']
+    assert 'M00009999.csv' not in reports['echo']['unexpected_files']
+    assert 'M00001004.CSV' in reports['echo']['unexpected_files']
+    assert '1004' not in reports['std']['unexpected_mice']
+
+    matrix = matrix.set_index('barcode')
+    assert matrix.loc['1003','std'] == 'passing'
+    assert matrix.loc['1004','std'] == 'missing'
+    assert matrix.loc['1001','ecg'] == ''
+    assert matrix.loc['1003','ecg'] == 'unexpected'
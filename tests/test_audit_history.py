@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the sqlite audit history and its per-run diffs
+"""
+
+import pandas
+
+from KOMP_Audit_Core import KOMP_PROTOCOLS, REPORT_CATEGORIES
+from KOMP_Audit_Core import AuditHistory, filename_audit
+
+
+
+def audit(mice,filenames,test='std'):
+    return dict(
+        zip(
+            REPORT_CATEGORIES,
+            filename_audit(
+                pandas.DataFrame({'parsed_mouse_list':mice}),
+                pandas.DataFrame({'filename':filenames}),
+                **KOMP_PROTOCOLS[test]
+                )
+            )
+        )
+
+
+
+def test_record_and_diff_runs(tmp_path):
+    history = AuditHistory(str(tmp_path/'history'/'history.sqlite'))
+    directory = str(tmp_path/'data')
+
+    first = history.record(
+        audit(['1001','1002'],['M00001001.csv','M00009999.csv']),
+        'std',
+        directory,
+        animals=2
+        )
+    second = history.record(
+        audit(['1001','1002'],['M00001001.csv','M00001002.csv']),
+        'std',
+        directory,
+        animals=2
+        )
+    # another directory and protocol are not the previous audit
+    other = history.record(audit(['1001'],[]),'std',str(tmp_path/'other'))
+    history.record(audit(['1001 (E)'],[],'ecg'),'ecg',directory)
+
+    assert history.previous_run(first) is None
+    assert history.diff(first) is None
+    assert history.previous_run(second) == first
+    assert history.previous_run(other) is None
+    assert history.diff(second).to_dict('records') == [
+        {
+            'name':'M00001002.csv','type':'file',
+            'previous':'missing','current':'passing'
+            },
+        {
+            'name':'M00009999.csv','type':'file',
+            'previous':'unexpected','current':''
+            },
+        {'name':'1002','type':'mouse','previous':'missing','current':'passing'},
+        {'name':'9999','type':'mouse','previous':'unexpected','current':''}
+        ]
+
+    runs = history.runs(directory=directory)
+    assert runs['protocol'].tolist() == ['std','std','ecg']
+    assert runs['files'].tolist() == [3,2,2]
+    assert history.runs(protocol='ecg')['run_id'].tolist() == [4]
+
+
+
+def test_mouse_history_and_missing_tests(tmp_path):
+    history = AuditHistory(str(tmp_path/'history.sqlite'))
+    directory = str(tmp_path/'data')
+
+    history.record_audit(
+        {
+            'std':audit(['1001'],[]),
+            'ecg':audit(['1001 (E)'],[],'ecg')
+            },
+        directory
+        )
+    run_ids, changes = history.record_audit(
+        {'std':audit(['1001'],['M00001001.csv'])},
+        directory
+        )
+
+    assert changes[['name','previous','current','test']].to_dict('records') == [
+        {
+            'name':'M00001001.csv','previous':'missing',
+            'current':'passing','test':'std'
+            },
+        {'name':'1001','previous':'missing','current':'passing','test':'std'}
+        ]
+    assert history.mouse_history('1001')[['protocol','status']].to_dict(
+        'records'
+        ) == [
+            {'protocol':'std','status':'missing'},
+            {'protocol':'ecg','status':'missing'},
+            {'protocol':'std','status':'passing'}
+            ]
+    assert history.latest_status('1001')['run_id'].tolist() == [2,run_ids[0]]
+    assert history.missing_tests('1001') == ['ecg']
+    assert history.missing_tests('1002') == []
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the audit service requests, their validation and the on request
+refresh of its file lists
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+import urllib.error
+
+import pytest
+
+import KOMP_Audit_Service
+from KOMP_Audit_Core import DirectoryIndex
+from KOMP_Audit_Service import ScanCache, WatchedDirectory, make_server
+from KOMP_Audit_Service import audit_request, request_audit, request_file_list
+
+
+
+@pytest.fixture
+def service(tmp_path):
+    root = tmp_path/'data'
+    os.makedirs(str(root/'a'))
+    for filename in ['M00001001.csv','M00001003.csv']:
+        with open(str(root/'a'/filename),'w') as f:
+            f.write('x')
+    server = make_server(
+        '127.0.0.1',
+        0,
+        ScanCache(
+            [str(root)],
+            refresh_age=0.1,
+            directory_index=DirectoryIndex(str(tmp_path/'index.sqlite'))
+            )
+        )
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', str(root)
+    server.shutdown()
+    server.scan_cache.close()
+
+
+
+def post(url,body):
+    request = urllib.request.Request(url+'/audit',data=body,method='POST')
+    try:
+        with urllib.request.urlopen(request,timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+
+def test_audit_request_is_validated():
+    assert audit_request({'directory':'d','test':'std','animals':['1001']}) == \
+        ('d','std',['1001'])
+    assert audit_request(
+        {'directory':'d','test':'all protocols','animals':[]}
+        ) == ('d','all protocols',[])
+    for payload in [
+            ['d','std',['1001']],
+            {'test':'std','animals':['1001']},
+            {'directory':'d','test':'bogus','animals':['1001']},
+            {'directory':'d','test':['std'],'animals':['1001']},
+            {'directory':'d','test':'std','animals':'1001'},
+            {'directory':'d','test':'std','animals':[1001]}
+            ]:
+        with pytest.raises(ValueError):
+            audit_request(payload)
+
+
+
+def test_files_and_audit(service):
+    url, root = service
+
+    file_list = request_file_list(url,root)
+    report = request_audit(url,root,'std',['1001','1002'])
+
+    assert sorted(file_list['filename']) == ['M00001001.csv','M00001003.csv']
+    assert report['passing_files'] == ['M00001001.csv']
+    assert report['missing_files'] == ['M00001002.csv']
+    assert report['unexpected_files'] == ['M00001003.csv']
+
+
+
+@pytest.mark.parametrize(
+    'body',
+    [
+        b'not json',
+        b'[1,2]',
+        json.dumps({'directory':'.','test':'bogus','animals':[]}).encode(),
+        json.dumps({'directory':'.','test':'std','animals':'1001'}).encode(),
+        json.dumps({'directory':'.','test':'std','animals':[1001]}).encode()
+        ]
+    )
+def test_bad_audit_request(service,body):
+    url, root = service
+
+    status, reply = post(url,body)
+
+    assert status == 400
+    assert 'error' in reply
+
+
+
+def test_directory_not_served(service,tmp_path):
+    url, root = service
+
+    status, reply = post(
+        url,
+        json.dumps(
+            {'directory':str(tmp_path),'test':'std','animals':[]}
+            ).encode()
+        )
+
+    assert status == 403
+    assert 'error' in reply
+
+
+
+def test_failed_audit_is_answered(service,monkeypatch):
+    url, root = service
+
+    def fail(*args):
+        raise RuntimeError('audit failed')
+    monkeypatch.setattr(KOMP_Audit_Service,'audit_report',fail)
+    status, reply = post(
+        url,
+        json.dumps({'directory':root,'test':'std','animals':['1001']}).encode()
+        )
+
+    assert status == 500
+    assert reply == {'error':'RuntimeError : audit failed'}
+
+
+
+def test_file_list_is_refreshed_on_request(tmp_path,monkeypatch):
+    root = tmp_path/'data'
+    os.makedirs(str(root/'a'))
+    (root/'a'/'M00001001.csv').write_bytes(b'x')
+    directory = WatchedDirectory(
+        str(root),
+        refresh_age=60,
+        directory_index=DirectoryIndex(str(tmp_path/'index.sqlite'))
+        )
+    scans = []
+    scan = directory.scan
+    monkeypatch.setattr(directory,'scan',lambda: scans.append(1) or scan())
+
+    file_list, version = directory.current()
+    # a new folder changes the root's mtime
+    os.makedirs(str(root/'b'))
+    (root/'b'/'M00001002.csv').write_bytes(b'x')
+
+    # the file list is served as it is until it is refresh_age old
+    assert directory.current() == (file_list,version)
+    assert len(scans) == 1
+    assert directory.status()['mode'] == 'on request'
+
+    directory.refresh_age = 0
+    file_list, version = directory.current()
+    assert sorted(file_list['filename']) == ['M00001001.csv','M00001002.csv']
+    assert version == 2
+    # an unchanged tree keeps its file list and cached reports
+    assert directory.current() == (file_list,2)
+    assert len(scans) == 3
+
+
+
+def test_files_change_between_requests(service):
+    url, root = service
+
+    request_audit(url,root,'std',['1001','1002'])
+    with open(os.path.join(root,'a','M00001002.csv'),'w') as f:
+        f.write('x')
+    stat = os.stat(os.path.join(root,'a'))
+    os.utime(os.path.join(root,'a'),(stat.st_atime,stat.st_mtime+10))
+    time.sleep(0.2)
+
+    report = request_audit(url,root,'std',['1001','1002'])
+
+    assert report['passing_files'] == ['M00001001.csv','M00001002.csv']
+    assert report['missing_files'] == []
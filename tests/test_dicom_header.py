@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the DICOM header reader and the header check of DICOM files,
+including the echo cine loops
+"""
+
+import os
+import struct
+
+import pandas
+import pytest
+
+import KOMP_Audit_Core
+from KOMP_Audit_Core import HEADER_CATEGORIES, KOMP_PROTOCOLS
+from KOMP_Audit_Core import filename_audit, header_check, parse_dicom_header
+from KOMP_Audit_Core import read_dicom_header, read_dicom_ids, scan_file_list
+
+EXPLICIT = '1.2.840.10008.1.2.1'
+IMPLICIT = '1.2.840.10008.1.2'
+
+
+
+def element(group,element,vr,value,explicit=True):
+    value = value if isinstance(value,bytes) else value.encode('latin-1')
+    if len(value) % 2:
+        value += b' '
+    tag = struct.pack('<HH',group,element)
+    if not explicit:
+        return tag+struct.pack('<I',len(value))+value
+    if vr in (b'OB',b'SQ',b'UN'):
+        return tag+vr+b'\0\0'+struct.pack('<I',len(value))+value
+    return tag+vr+struct.pack('<H',len(value))+value
+
+
+
+def dicom_file(
+        patient_id='M00001234',
+        date='20240305',
+        study='1.2.3.4',
+        transfer_syntax=EXPLICIT,
+        pixels=b'\0'*1000,
+        sequence=False
+        ):
+    explicit = transfer_syntax != IMPLICIT
+    data = b'\0'*128+b'DICM'+element(0x0002,0x0010,b'UI',transfer_syntax+'\0')
+    if sequence:
+        # an undefined length sequence ahead of the wanted tags
+        item = element(0x0008,0x0100,b'SH','code',explicit)
+        data += struct.pack('<HH',0x0008,0x1140)+(b'SQ\0\0' if explicit else b'')+ \
+            struct.pack('<I',0xFFFFFFFF)+ \
+            struct.pack('<HHI',0xFFFE,0xE000,0xFFFFFFFF)+item+ \
+            struct.pack('<HHI',0xFFFE,0xE00D,0)+ \
+            struct.pack('<HHI',0xFFFE,0xE0DD,0)
+    if date is not None:
+        data += element(0x0008,0x0022,b'DA',date,explicit)
+    if patient_id is not None:
+        data += element(0x0010,0x0020,b'LO',patient_id,explicit)
+    if study is not None:
+        data += element(0x0020,0x000D,b'UI',study,explicit)
+    return data+element(0x7FE0,0x0010,b'OB',pixels,explicit)
+
+
+
+@pytest.mark.parametrize('transfer_syntax',[EXPLICIT,IMPLICIT])
+@pytest.mark.parametrize('sequence',[False,True])
+def test_parse_dicom_header(transfer_syntax,sequence):
+    data = dicom_file(transfer_syntax=transfer_syntax,sequence=sequence)
+
+    assert parse_dicom_header(data) == {
+        'AcquisitionDate':'20240305',
+        'PatientID':'M00001234',
+        'StudyInstanceUID':'1.2.3.4'
+        }
+
+
+
+def test_parse_dicom_header_errors():
+    with pytest.raises(ValueError):
+        parse_dicom_header(b'\0'*128+b'JPEG'+b'\0'*100)
+    with pytest.raises(ValueError):
+        parse_dicom_header(dicom_file(transfer_syntax='1.2.840.10008.1.2.2'))
+    # a header cut short asks for more of the file
+    with pytest.raises(IndexError):
+        parse_dicom_header(dicom_file()[:170])
+
+
+
+def test_read_dicom_header_stops_before_pixel_data(tmp_path,monkeypatch):
+    monkeypatch.setattr(KOMP_Audit_Core,'DICOM_READ_SIZE',64)
+    path = str(tmp_path/'M00001234.dcm')
+    with open(path,'wb') as f:
+        f.write(dicom_file(patient_id='M00001234 ',pixels=b'\0'*100000))
+
+    assert read_dicom_ids(path) == {
+        'id':'M00001234','date':'20240305','study':'1.2.3.4'
+        }
+    # the pixel data is never reached
+    with open(path,'rb') as f:
+        reads = []
+        read = f.read
+        f.read = lambda n: reads.append(n) or read(n)
+        read_dicom_header(f)
+    assert sum(reads) < 1024
+
+    with open(path,'wb') as f:
+        f.write(dicom_file(pixels=b'')[:-12])
+    with pytest.raises(ValueError):
+        read_dicom_header(path)
+
+
+
+def test_header_check_of_dicom_files(tmp_path):
+    root = tmp_path/'data'
+    os.makedirs(str(root))
+    files = {
+        'M00001001.dcm':dicom_file('M00001001'),
+        'M00001001-2.dcm':dicom_file('1001'),
+        'M00001001-3.dcm':dicom_file('M00001001',date='20240306'),
+        'M00001002.dcm':dicom_file('M00001003'),
+        'M00001004.dcm':b'not a dicom file',
+        'M00001005.csv':b'not read'
+        }
+    for name, data in files.items():
+        with open(str(root/name),'wb') as f:
+            f.write(data)
+    file_list = scan_file_list(str(root))
+
+    report = header_check(set(files),file_list)
+
+    assert list(report) == HEADER_CATEGORIES
+    assert report['header_id_mismatch'] == {
+        'M00001002.dcm : header id M00001003'
+        }
+    assert report['header_date_mismatch'] == {
+        'M00001001-3.dcm : date 20240306, other files 20240305'
+        }
+    assert report['header_study_mismatch'] == set()
+    assert report['header_unreadable'] == {'M00001004.dcm'}
+
+
+
+def test_header_check_of_echo_study(tmp_path):
+    root = tmp_path/'data'
+    os.makedirs(str(root))
+    settings = KOMP_PROTOCOLS['echo']
+    files = {
+        'M00001001'+suffix:dicom_file('M00001001',study='1.2.3.4')
+        for suffix in settings['file_suffixes']
+        }
+    files['M00001001-sax-m.dcm'] = dicom_file('M00001001',study='1.2.3.9')
+    # a cine loop is checked from its header alone
+    files['M00001001-mv-pw.dcm'] = dicom_file(
+        'M00001001',
+        study='1.2.3.4',
+        pixels=b'\0'*3000000
+        )
+    for name, data in files.items():
+        with open(str(root/name),'wb') as f:
+            f.write(data)
+    file_list = scan_file_list(str(root))
+    mouse_list = pandas.DataFrame({'parsed_mouse_list':['1001']})
+    passing_files = filename_audit(mouse_list,file_list,**settings)[0]
+
+    report = header_check(passing_files,file_list)
+
+    assert passing_files == set(files)
+    assert report['header_study_mismatch'] == {
+        'M00001001-sax-m.dcm : study 1.2.3.9, other files 1.2.3.4'
+        }
+    assert report['header_id_mismatch'] == set()
+    assert report['header_date_mismatch'] == set()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the DirectoryIndex rescans
+"""
+
+import os
+
+from KOMP_Audit_Core import DirectoryIndex, file_list_frame
+
+
+
+def write_file(path,data):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,'wb') as f:
+        f.write(data)
+
+
+
+def touch_directory(path):
+    # make sure the folder mtime differs on coarse clocks
+    stat = os.stat(path)
+    os.utime(path,(stat.st_atime,stat.st_mtime+10))
+
+
+
+def indexed_file_list(index,root):
+    return file_list_frame(
+        entry for batch in index.scan(str(root)) for entry in batch
+        )
+
+
+
+def test_unchanged_directories_are_reused(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'a'/'M00000001.csv'),b'one')
+    write_file(str(root/'b'/'M00000002.csv'),b'two')
+    index = DirectoryIndex(str(tmp_path/'index.sqlite'))
+
+    first = indexed_file_list(index,root)
+    assert index.rescanned_directories == 3
+
+    second = indexed_file_list(index,root)
+    assert index.reused_directories == 3
+    assert index.rescanned_directories == 0
+    assert sorted(second['filename']) == sorted(first['filename'])
+
+
+
+def test_changed_directory_is_rescanned(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'a'/'M00000001.csv'),b'one')
+    write_file(str(root/'b'/'M00000002.csv'),b'two')
+    index = DirectoryIndex(str(tmp_path/'index.sqlite'))
+    indexed_file_list(index,root)
+
+    write_file(str(root/'b'/'M00000003.csv'),b'three')
+    touch_directory(str(root/'b'))
+    os.remove(str(root/'a'/'M00000001.csv'))
+    touch_directory(str(root/'a'))
+
+    file_list = indexed_file_list(index,root)
+
+    assert index.rescanned_directories == 2
+    assert index.reused_directories == 1
+    assert sorted(file_list['filename']) == ['M00000002.csv','M00000003.csv']
+
+
+
+def test_removed_directory_is_dropped(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'a'/'M00000001.csv'),b'one')
+    write_file(str(root/'b'/'M00000002.csv'),b'two')
+    index = DirectoryIndex(str(tmp_path/'index.sqlite'))
+    indexed_file_list(index,root)
+
+    os.remove(str(root/'b'/'M00000002.csv'))
+    os.rmdir(str(root/'b'))
+    touch_directory(str(root))
+
+    file_list = indexed_file_list(index,root)
+
+    assert file_list['filename'].tolist() == ['M00000001.csv']
+    assert indexed_file_list(index,root)['filename'].tolist() == ['M00000001.csv']
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the scanned file list and its file index
+"""
+
+import os
+
+import pandas
+
+from KOMP_Audit_Core import FileIndex, ScanEntry, file_list_frame, file_paths
+from KOMP_Audit_Core import duplicate_filenames, scan_file_list
+
+
+
+def test_file_list_frame_stores_directories_once():
+    entries = [
+        ScanEntry('M00001001.csv',os.path.join('data','day1'),10,1.5),
+        ScanEntry('M00001002 (T).csv',os.path.join('data','day1'),0,2.0),
+        ScanEntry('notes.docx',os.path.join('data','day2'),7,3.0),
+        ScanEntry('M00001001-h.dcm',os.path.join('data','day2'),20,4.0)
+        ]
+
+    file_list = file_list_frame(iter(entries))
+
+    assert file_list['directory'].dtype == 'category'
+    assert file_list['directory'].cat.categories.tolist() == [
+        os.path.join('data','day1'),os.path.join('data','day2')
+        ]
+    assert file_list['size'].dtype == 'int64'
+    assert file_list['mtime'].dtype == 'float64'
+    assert file_paths(file_list) == [e.path for e in entries]
+    assert file_list['barcode'].tolist() == ['1001','1002','notes','1001']
+    assert file_list['suffix'].dtype == 'category'
+    assert file_list['suffix'].tolist() == ['.csv','.csv','.docx','-h.dcm']
+    # the rows of a filtered list keep their paths
+    assert file_paths(file_list[file_list['size'] > 8]) == [
+        entries[0].path,entries[3].path
+        ]
+
+
+
+def test_unparsed_file_list_frame():
+    file_list = file_list_frame([],parse=False)
+
+    assert file_list.columns.tolist() == ['filename','directory','size','mtime']
+    assert len(file_list) == 0
+    assert file_paths(file_list) == []
+    assert file_paths(
+        pandas.DataFrame({'filename':['a.csv'],'directory':['data']})
+        ) == [os.path.join('data','a.csv')]
+
+
+
+def test_file_index_keeps_every_location():
+    entries = [
+        ScanEntry('M00001001.csv','day1',1,1.0),
+        ScanEntry('M00001002.csv','day1',1,1.0),
+        ScanEntry('M00001001.csv','day2',2,2.0),
+        ScanEntry('M00001001.csv','day3',3,3.0)
+        ]
+    index = FileIndex(entries[:2])
+    index.add(entries[2:])
+
+    assert len(index) == 4
+    assert index.locations('M00001001.csv') == [
+        entries[0],entries[2],entries[3]
+        ]
+    assert index.locations('M00001002.csv') == [entries[1]]
+    assert index.locations('M00009999.csv') == []
+    assert sorted(index.values()) == sorted(entries)
+    # unique names are not held in lists
+    assert list(index.duplicates) == ['M00001001.csv']
+
+
+
+def test_duplicate_filenames_lists_every_path(tmp_path):
+    for folder, name in [
+            ('day1','M00001001.csv'),
+            ('day2','M00001001.csv'),
+            ('day2','M00001002.csv'),
+            ('day1','notes.docx'),
+            ('day3','notes.docx')
+            ]:
+        os.makedirs(str(tmp_path/folder),exist_ok=True)
+        (tmp_path/folder/name).write_bytes(b'x')
+    file_list = scan_file_list(str(tmp_path))
+
+    duplicates = duplicate_filenames(file_list)
+
+    assert len(file_list) == 5
+    assert duplicates.to_dict('list') == {
+        'filename':['M00001001.csv']*2+['notes.docx']*2,
+        'path':[
+            str(tmp_path/'day1'/'M00001001.csv'),
+            str(tmp_path/'day2'/'M00001001.csv'),
+            str(tmp_path/'day1'/'notes.docx'),
+            str(tmp_path/'day3'/'notes.docx')
+            ]
+        }
+    assert duplicate_filenames(file_list.drop_duplicates('filename')).empty
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the animal list import from colony exports
+"""
+
+import pytest
+
+from KOMP_Audit_Core import animal_list_columns, guess_animal_column
+from KOMP_Audit_Core import import_animal_list
+
+
+
+def write_export(path,text):
+    with open(path,'w',newline='') as f:
+        f.write(text)
+    return path
+
+
+
+def test_ids_are_deduplicated_on_barcode(tmp_path):
+    path = write_export(
+        str(tmp_path/'colony.csv'),
+        'Animal ID,Sex\n'
+        '1001,F\n'
+        'M00001001 (T),F\n'
+        '1002 (T),M\n'
+        '1002,M\n'
+        '1003 (T),M\n'
+        'M00001003 (E),M\n'
+        '\n'
+        ',F\n'
+        '(T),M\n'
+        '  1004  ,F\n'
+        )
+
+    mouse_list, counts = import_animal_list(path,chunk_size=3)
+
+    # the tagged id of a barcode is kept wherever it comes in the list
+    assert mouse_list['parsed_mouse_list'].tolist() == [
+        '1002 (T)','1003 (T)','1004','M00001001 (T)'
+        ]
+    assert counts == {
+        'rows':9,
+        'blank':1,
+        'unparsed':1,
+        'duplicate':3,
+        'conflict':1
+        }
+
+
+
+def test_tab_separated_export_and_column_guess(tmp_path):
+    path = write_export(
+        str(tmp_path/'colony.tsv'),
+        'Cage\tMouse Barcode\n'
+        'C1\tM00002001\n'
+        'C1\t2002 (E)\n'
+        )
+
+    assert animal_list_columns(path) == ['Cage','Mouse Barcode']
+    assert guess_animal_column(animal_list_columns(path)) == 'Mouse Barcode'
+    mouse_list, counts = import_animal_list(path)
+    assert mouse_list['parsed_mouse_list'].tolist() == ['2002 (E)','M00002001']
+
+
+
+def test_xlsx_export(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = str(tmp_path/'colony.xlsx')
+    workbook = openpyxl.Workbook()
+    for row in [['barcode','sex'],[1001,'F'],['1001 (T)','F'],[None,'M']]:
+        workbook.active.append(row)
+    workbook.save(path)
+
+    mouse_list, counts = import_animal_list(path)
+
+    assert mouse_list['parsed_mouse_list'].tolist() == ['1001 (T)']
+    assert counts['duplicate'] == 1
+    assert counts['blank'] == 1
+
+
+
+def test_unknown_column(tmp_path):
+    path = write_export(str(tmp_path/'colony.csv'),'barcode\n1001\n')
+
+    with pytest.raises(ValueError):
+        import_animal_list(path,column='animal')
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of animal list edits applied to an IncrementalAudit against a full
+re-audit
+"""
+
+import random
+
+import pandas
+import pytest
+
+from KOMP_Audit_Core import KOMP_PROTOCOLS, IncrementalAudit, filename_audit
+
+
+
+def random_mouse(rng):
+    barcode = str(rng.randint(1000,1030))
+    return rng.choice(['{b}','M0000{b}','{b} (T)','{b} (E)','{b}-wt']).format(
+        b=barcode
+        )
+
+
+
+def mouse_frame(mice):
+    return pandas.DataFrame({'parsed_mouse_list':mice},dtype=object)
+
+
+
+@pytest.mark.parametrize('test',['std','xray-faxitron','ecg'])
+def test_animal_edits_match_full_audit(test):
+    settings = KOMP_PROTOCOLS[test]
+    rng = random.Random(test)
+    filenames = [
+        'M0000'+str(rng.randint(1000,1030))+rng.choice(settings['file_suffixes'])
+        for i in range(40)
+        ]+['notes.docx']
+    # a filename found in two folders is one file of the audit
+    file_list = pandas.DataFrame({'filename':filenames+filenames[:3]})
+    mice = [random_mouse(rng) for i in range(15)]
+    audit = IncrementalAudit(mouse_frame(mice),file_list,**settings)
+
+    for edit in range(30):
+        action = rng.choice(['add','remove','update'])
+        if action == 'add':
+            added = [random_mouse(rng) for i in range(rng.randint(1,3))]
+            mice += added
+            affected = audit.add_mice(added)
+        elif action == 'remove':
+            removed = rng.sample(mice,min(len(mice),rng.randint(1,3)))
+            for m in removed:
+                mice.remove(m)
+            # ids that are not listed are ignored
+            affected = audit.remove_mice(removed+['9999'])
+        else:
+            i = rng.randrange(len(mice)) if mice else None
+            if i is not None:
+                mice[i] = random_mouse(rng)
+            affected = audit.update_mouse_list(mouse_frame(mice))
+
+        expected = filename_audit(mouse_frame(mice),file_list,**settings)
+        assert audit.results() == expected, (edit, action)
+        assert all(isinstance(b,str) for b in affected)
+
+
+
+def test_update_mouse_list_returns_changed_barcodes():
+    settings = KOMP_PROTOCOLS['std']
+    file_list = pandas.DataFrame(
+        {'filename':['M00001001.csv','M00001002.csv','M00001003.csv']}
+        )
+    audit = IncrementalAudit(mouse_frame(['1001','1002']),file_list,**settings)
+
+    assert audit.update_mouse_list(mouse_frame(['1001','1002'])) == set()
+    assert audit.update_mouse_list(mouse_frame(['1001','1003','1004'])) == \
+        {'1002','1003','1004'}
+    assert audit.results() == (
+        {'M00001001.csv','M00001003.csv'},
+        {'M00001004.csv'},
+        {'M00001002.csv'},
+        {'1001','1003'},
+        {'1004'},
+        {'1002'}
+        )
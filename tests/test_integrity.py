@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the integrity check of passing files and its hash cache
+"""
+
+import os
+import sqlite3
+
+from KOMP_Audit_Core import DirectoryIndex, HashCache, file_list_frame
+from KOMP_Audit_Core import hash_files, integrity_check, scan_file_list
+
+
+
+def write_file(path,data):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,'wb') as f:
+        f.write(data)
+
+
+
+def test_empty_small_and_duplicate_files(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'M00000001.csv'),b'x'*100)
+    write_file(str(root/'M00000002.csv'),b'x'*100)
+    write_file(str(root/'M00000003.csv'),b'y'*100)
+    write_file(str(root/'M00000004.csv'),b'z'*5)
+    write_file(str(root/'M00000005.csv'),b'')
+    write_file(str(root/'M00000006.csv'),b'w'*100)
+    file_list = scan_file_list(str(root))
+
+    report = integrity_check(
+        set(file_list['filename'])-{'M00000006.csv'},
+        file_list
+        )
+
+    assert report == {
+        'empty_files':{'M00000005.csv'},
+        'small_files':{'M00000004.csv'},
+        'duplicate_files':{'M00000001.csv = M00000002.csv'}
+        }
+
+
+
+def test_integrity_check_restats_stale_files(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'M00000001.csv'),b'same')
+    write_file(str(root/'M00000002.csv'),b'same')
+    write_file(str(root/'M00000003.csv'),b'other data')
+    index = DirectoryIndex(str(tmp_path/'index.sqlite'))
+    list(index.scan(str(root)))
+
+    # rewriting files in place leaves the folder mtime, and the index,
+    # unchanged
+    stat = os.stat(str(root))
+    write_file(str(root/'M00000001.csv'),b'')
+    write_file(str(root/'M00000003.csv'),b'same')
+    os.utime(str(root),(stat.st_atime,stat.st_mtime))
+
+    file_list = file_list_frame(
+        entry for batch in index.scan(str(root)) for entry in batch
+        )
+    assert index.reused_directories == 1
+    assert file_list.set_index('filename').loc['M00000001.csv','size'] == 4
+
+    report = integrity_check(set(file_list['filename']),file_list)
+
+    assert report['empty_files'] == {'M00000001.csv'}
+    assert report['duplicate_files'] == {'M00000002.csv = M00000003.csv'}
+
+
+
+def test_hash_cache_reuses_unchanged_digests(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'M00000001.csv'),b'one')
+    write_file(str(root/'M00000002.csv'),b'two')
+    file_list = scan_file_list(str(root))
+    hash_cache = HashCache(str(tmp_path/'index.sqlite'))
+
+    digests = hash_files(file_list,hash_cache)
+    assert len(digests) == 2
+
+    # a cached digest is returned while the path, size and mtime match
+    path = str(root/'M00000001.csv')
+    connection = sqlite3.connect(hash_cache.index_path)
+    with connection:
+        connection.execute(
+            'UPDATE file_hashes SET digest = ? WHERE path = ?',
+            ('cached',path)
+            )
+    connection.close()
+    assert hash_files(file_list,hash_cache)[path] == 'cached'
+    assert hash_files(file_list.assign(size=file_list['size']+1),hash_cache)[path] == \
+        digests[path]
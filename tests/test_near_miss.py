@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the near-miss suggestions for unexpected files
+"""
+
+import random
+
+from KOMP_Audit_Core import BarcodeIndex, edit_distance, near_miss_files
+
+
+
+def test_near_miss_reasons():
+    missing_files = {
+        'M00001234.csv',
+        'M00009100.csv',
+        'M00002222-h.dcm',
+        'M00005678.csv',
+        'M00003330.csv',
+        'M00003332.csv'
+        }
+    unexpected_files = {
+        '1234.csv',
+        'M00005678.cvs',
+        'M00001900.csv',
+        'M00002223-h.dcm',
+        # one digit from two missing barcodes
+        'M00003331.csv',
+        # no missing file with this suffix
+        'M00002223.txt',
+        'notes.docx'
+        }
+
+    near_misses = near_miss_files(missing_files,unexpected_files)
+
+    assert list(near_misses.columns) == ['unexpected_file','suggested_file','reason']
+    assert set(near_misses.itertuples(index=False,name=None)) == {
+        ('1234.csv','M00001234.csv','zero padding'),
+        ('M00005678.cvs','M00005678.csv','wrong suffix'),
+        ('M00001900.csv','M00009100.csv','transposed digits'),
+        ('M00002223-h.dcm','M00002222-h.dcm','mistyped barcode')
+        }
+
+
+
+def test_near_miss_files_empty():
+    near_misses = near_miss_files(set(),{'M00001234.csv'})
+
+    assert len(near_misses) == 0
+
+
+
+
+def test_barcode_index_matches_brute_force():
+    rng = random.Random(0)
+    barcodes = {
+        ''.join(rng.choice('0123') for i in range(rng.randint(3,6)))
+        for n in range(300)
+        }
+    index = BarcodeIndex(barcodes,max_distance=1)
+
+    for n in range(200):
+        query = ''.join(rng.choice('01234') for i in range(rng.randint(2,7)))
+        assert index.search(query) == sorted(
+            (edit_distance(query,b),b) for b in barcodes
+            if edit_distance(query,b) <= 1
+            ), query
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the lazily rendered PandasModel of the GUI
+"""
+
+import os
+
+import pandas
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+pytest.importorskip('PyQt5')
+
+from PyQt5.QtCore import Qt
+
+from KOMP_File_Audit import PandasModel
+
+
+
+def test_rows_are_fetched_in_blocks():
+    frame = pandas.DataFrame({'filename':[f'M{i:08d}.csv' for i in range(25)]})
+    model = PandasModel(frame,fetch_size=10)
+
+    assert model.rowCount() == 10
+    assert model.canFetchMore()
+    model.fetchMore()
+    assert model.rowCount() == 20
+    model.fetchMore()
+    assert model.rowCount() == 25
+    assert not model.canFetchMore()
+    model.fetchMore()
+    assert model.rowCount() == 25
+    assert model.data(model.index(24,0),Qt.DisplayRole) == 'M00000024.csv'
+
+
+
+def test_small_frame_is_rendered_at_once():
+    model = PandasModel(pandas.DataFrame({'a':[1,2],'b':['x','y']}),fetch_size=10)
+
+    assert model.rowCount() == 2
+    assert model.columnCount() == 2
+    assert not model.canFetchMore()
+    assert model.data(model.index(1,0),Qt.DisplayRole) == '2'
+
+
+
+def test_edits_write_through_to_the_frame():
+    frame = pandas.DataFrame({'parsed_mouse_list':['1001','1002']})
+    model = PandasModel(frame)
+
+    assert model.setData(model.index(1,0),'1003',Qt.EditRole)
+    assert frame['parsed_mouse_list'].tolist() == ['1001','1003']
+    assert model.data(model.index(1,0),Qt.DisplayRole) == '1003'
+
+
+
+def test_read_only_model_refuses_edits():
+    frame = pandas.DataFrame({'filename':['M00001001.csv']})
+    model = PandasModel(frame,editable=False)
+
+    assert not model.flags(model.index(0,0)) & Qt.ItemIsEditable
+    assert not model.setData(model.index(0,0),'x',Qt.EditRole)
+    assert frame['filename'].tolist() == ['M00001001.csv']
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of run_audit, the audit pipeline shared by the GUI, the batch mode
+and the audit service
+"""
+
+import pandas
+import pytest
+
+from KOMP_Audit_Core import KOMP_PROTOCOLS, ALL_PROTOCOLS, RunLog, run_audit
+
+
+
+def test_run_audit_single_test():
+    mouse_list = pandas.DataFrame({'parsed_mouse_list':['1001','1002']})
+    file_list = pandas.DataFrame(
+        {
+            'filename':['M00001001.csv','M00001001.csv','M0001002.csv'],
+            'directory':['a','b','a'],
+            'size':[1,1,1],
+            'mtime':[0.0,0.0,0.0]
+            }
+        )
+    run_log = RunLog(path=None)
+    messages = []
+
+    report, reports = run_audit(
+        mouse_list,
+        file_list,
+        'std',
+        run_log=run_log,
+        progress=messages.append
+        )
+
+    assert report['passing_files'] == {'M00001001.csv'}
+    assert report['missing_files'] == {'M00001002.csv'}
+    assert report['near_miss_files']['reason'].tolist() == ['zero padding']
+    assert report['duplicate_filenames']['filename'].tolist() == \
+        ['M00001001.csv','M00001001.csv']
+    assert list(reports) == ['std']
+    assert 'empty_files' not in report
+    assert [s['stage'] for s in run_log.stages] == ['audit','near_miss']
+    assert len(messages) == 2
+
+
+
+def test_run_audit_all_protocols():
+    mouse_list = pandas.DataFrame({'parsed_mouse_list':['1001']})
+    file_list = pandas.DataFrame(
+        {
+            'filename':['M00001001.csv','M1001.txt'],
+            'directory':['a','a'],
+            'size':[1,1],
+            'mtime':[0.0,0.0]
+            }
+        )
+
+    report, reports = run_audit(mouse_list,file_list,ALL_PROTOCOLS)
+
+    assert set(reports) == set(KOMP_PROTOCOLS)
+    assert report['std passing_files'] == {'M00001001.csv'}
+    assert report['body comp near_miss_files']['reason'].tolist() == \
+        ['zero padding']
+    assert report['mouse_test_matrix']['std'].tolist() == ['passing']
+
+
+
+def test_run_audit_stops_when_cancelled():
+    class Cancelled(Exception):
+        pass
+
+    def check_cancelled():
+        raise Cancelled()
+
+    with pytest.raises(Cancelled):
+        run_audit(
+            pandas.DataFrame({'parsed_mouse_list':['1001']}),
+            pandas.DataFrame(
+                {'filename':['M00001001.csv'],'directory':['a']}
+                ),
+            'std',
+            check_cancelled=check_cancelled
+            )
+
+
+
+def test_run_audit_unknown_test():
+    with pytest.raises(ValueError):
+        run_audit(
+            pandas.DataFrame({'parsed_mouse_list':['1001']}),
+            pandas.DataFrame({'filename':['M00001001.csv']}),
+            'bogus'
+            )
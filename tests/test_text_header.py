@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the text export header reader and the header check of body comp
+and ECG exports
+"""
+
+import io
+import os
+import tarfile
+
+import pytest
+
+import KOMP_Audit_Core
+from KOMP_Audit_Core import header_check, read_text_ids, scan_file_list
+
+BODY_COMP = (
+    b'Body Composition Export\r\n'
+    b'Animal ID: M00001001\r\n'
+    b'Acquisition Date: 2024-03-05 10:15\r\n'
+    b'Operator = jdoe\r\n'
+    b'\r\n'
+    b'ID\tFat\tLean\r\n'
+    b'1\t3.1\t20.4\r\n'
+    )
+
+
+
+def test_read_text_ids():
+    assert read_text_ids(io.BytesIO(BODY_COMP)) == {
+        'id':'M00001001','date':'2024-03-05'
+        }
+    # the more specific key wins, and the column titles below do not count
+    assert read_text_ids(
+        io.BytesIO(b'ID\tM00009999\nSubject: 1002\nDate\t2024-03-06\n')
+        ) == {'id':'1002','date':'2024-03-06'}
+    assert read_text_ids(io.BytesIO(b'Lead II\n1.0\t2.0\n')) == {
+        'id':'','date':''
+        }
+    with pytest.raises(ValueError):
+        read_text_ids(io.BytesIO(b'\0\1\2binary'))
+
+
+
+def test_read_text_ids_reads_only_the_start(monkeypatch):
+    monkeypatch.setattr(KOMP_Audit_Core,'TEXT_READ_SIZE',24)
+
+    # the date line is cut short by the read and is not used
+    assert read_text_ids(
+        io.BytesIO(b'Animal ID: 1001\nDate: 2024-03-05\n'+b'1\t2\n'*100)
+        ) == {'id':'1001','date':''}
+
+
+
+def write_tar(path,members):
+    with tarfile.open(path,'w:gz') as t:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            t.addfile(info,io.BytesIO(data))
+
+
+
+def test_header_check_of_text_exports(tmp_path):
+    root = tmp_path/'data'
+    os.makedirs(str(root))
+    files = {
+        'M00001001.txt':BODY_COMP,
+        'M00001002.txt':BODY_COMP,
+        'M00001003.txt':b'Lead II\n1.0\t2.0\n',
+        'M00001004.txt':b'Animal: 1004\nDate: 2024-03-05\n'
+        }
+    for name, data in files.items():
+        with open(str(root/name),'wb') as f:
+            f.write(data)
+    # an ECG export format without a date line, scanned inside an archive
+    write_tar(
+        str(root/'ecg.tar.gz'),
+        {
+            'ecg/M00001005.txt':b'Animal ID: M00001005\nLead II\n',
+            'ecg/M00001006.txt':b'Animal ID: M00001006\nLead II\n'
+            }
+        )
+    file_list = scan_file_list(str(root))
+
+    report = header_check(set(file_list['filename']),file_list)
+
+    assert report == {
+        'header_id_mismatch':{'M00001002.txt : header id M00001001'},
+        'header_date_mismatch':set(),
+        'header_study_mismatch':set(),
+        'header_unreadable':{'M00001003.txt'}
+        }
+
+
+
+def test_header_check_compares_dates_within_a_session(tmp_path):
+    files = {
+        'M00001001-1.txt':b'Animal ID: 1001\nDate: 2024-03-05\n',
+        'M00001001-2.txt':b'Animal ID: 1001\nDate: 2024-03-05 11:00\n',
+        'M00001001-3.txt':b'Animal ID: 1001\nDate: 2024-04-01\n',
+        # no date line - not compared
+        'M00001001-4.txt':b'Animal ID: 1001\n',
+        # the only dated file of its mouse
+        'M00001002.txt':b'Animal ID: 1002\nDate: 2024-05-01\n'
+        }
+    for name, data in files.items():
+        with open(str(tmp_path/name),'wb') as f:
+            f.write(data)
+    file_list = scan_file_list(str(tmp_path))
+
+    report = header_check(set(files),file_list)
+
+    assert report['header_date_mismatch'] == {
+        'M00001001-3.txt : date 2024-04-01, other files 2024-03-05'
+        }
+    assert report['header_id_mismatch'] == set()
+    assert report['header_unreadable'] == set()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the live watch: FileWatcher events applied to an IncrementalAudit
+"""
+
+import os
+import time
+from types import SimpleNamespace
+
+import pandas
+
+from KOMP_Audit_Core import KOMP_PROTOCOLS, FileWatcher, IncrementalAudit
+from KOMP_Audit_Core import WatchEventHandler, ScanEntry
+from KOMP_Audit_Core import filename_audit, scan_file_list
+
+
+
+def write_file(path,data=b'x'):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,'wb') as f:
+        f.write(data)
+
+
+
+def touch_directory(path):
+    # make sure the folder mtime differs on coarse clocks
+    stat = os.stat(path)
+    os.utime(path,(stat.st_atime,stat.st_mtime+10))
+
+
+
+def collect_changes(watcher,count,timeout=10):
+    changes = []
+    deadline = time.monotonic()+timeout
+    while len(changes) < count and time.monotonic() < deadline:
+        changes.extend(watcher.get_changes(0.1))
+    return sorted((kind,entry.filename) for kind, entry in changes)
+
+
+
+def apply_changes(audit,watcher,count):
+    changes = collect_changes(watcher,count)
+    for kind, filename in changes:
+        if kind == 'created':
+            audit.add_files([filename])
+        else:
+            audit.remove_files([filename])
+    return changes
+
+
+
+def current_file_list(watcher):
+    with watcher.lock:
+        return pandas.DataFrame(
+            {'filename':[e.filename for e in watcher.files.values()]}
+            )
+
+
+
+def test_polling_watch_keeps_the_audit_current(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'a'/'M00001001.csv'))
+    write_file(str(root/'a'/'M00009999.csv'))
+    mouse_list = pandas.DataFrame({'parsed_mouse_list':['1001','1002','1003']})
+    file_list = scan_file_list(str(root))
+    settings = KOMP_PROTOCOLS['std']
+    audit = IncrementalAudit(mouse_list,file_list,**settings)
+    watcher = FileWatcher(
+        str(root),
+        [
+            ScanEntry(*r) for r in file_list[list(ScanEntry._fields)].itertuples(
+                index=False,
+                name=None
+                )
+            ],
+        poll_interval=0.05,
+        use_watchdog=False
+        )
+    watcher.start()
+    try:
+        assert watcher.ready.wait(10)
+        assert watcher.get_changes(0.1) == []
+
+        write_file(str(root/'a'/'M00001002.csv'))
+        os.remove(str(root/'a'/'M00009999.csv'))
+        touch_directory(str(root/'a'))
+        write_file(str(root/'b'/'M00001003.csv'))
+        touch_directory(str(root))
+        assert apply_changes(audit,watcher,3) == [
+            ('created','M00001002.csv'),
+            ('created','M00001003.csv'),
+            ('deleted','M00009999.csv')
+            ]
+        assert audit.results() == filename_audit(
+            mouse_list,
+            current_file_list(watcher),
+            **settings
+            )
+        assert audit.missing_files == set()
+        assert audit.passing_mice == {'1001','1002','1003'}
+    finally:
+        watcher.stop()
+
+
+
+def test_watchdog_events_update_the_index(tmp_path):
+    root = tmp_path/'data'
+    write_file(str(root/'a'/'M00001001.csv'))
+    watcher = FileWatcher(str(root))
+    handler = WatchEventHandler(watcher)
+
+    write_file(str(root/'b'/'M00001002.csv'))
+    write_file(str(root/'b'/'c'/'M00001003.csv'))
+    handler.dispatch(
+        SimpleNamespace(
+            event_type='created',
+            is_directory=True,
+            src_path=str(root/'b')
+            )
+        )
+    handler.dispatch(
+        SimpleNamespace(
+            event_type='created',
+            is_directory=False,
+            src_path=str(root/'a'/'M00001001.csv')
+            )
+        )
+    assert collect_changes(watcher,3) == [
+        ('created','M00001001.csv'),
+        ('created','M00001002.csv'),
+        ('created','M00001003.csv')
+        ]
+
+    os.rename(str(root/'a'/'M00001001.csv'),str(root/'a'/'M00001004.csv'))
+    handler.dispatch(
+        SimpleNamespace(
+            event_type='moved',
+            is_directory=False,
+            src_path=str(root/'a'/'M00001001.csv'),
+            dest_path=str(root/'a'/'M00001004.csv')
+            )
+        )
+    handler.dispatch(
+        SimpleNamespace(
+            event_type='deleted',
+            is_directory=False,
+            src_path=str(root/'b')
+            )
+        )
+    assert collect_changes(watcher,4) == [
+        ('created','M00001004.csv'),
+        ('deleted','M00001001.csv'),
+        ('deleted','M00001002.csv'),
+        ('deleted','M00001003.csv')
+        ]
+    assert [e.filename for e in watcher.files.values()] == ['M00001004.csv']
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the report exports of KOMP_Audit_Core
+"""
+
+import csv
+import os
+
+import pandas
+import pytest
+
+from KOMP_Audit_Core import write_report, write_report_excel
+
+
+
+def test_excel_sheets_are_sharded(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    pytest.importorskip('xlsxwriter')
+    output_path = str(tmp_path/'report.xlsx')
+    report = {
+        'passing_files':{f'M{i:08d}.csv' for i in range(7)},
+        'missing_files':set()
+        }
+    tables = {
+        'near_miss_files':pandas.DataFrame(
+            {'unexpected_file':list('abcde'),'reason':['zero padding']*5}
+            )
+        }
+
+    write_report_excel(report,output_path,max_rows=3,tables=tables)
+
+    workbook = openpyxl.load_workbook(output_path)
+    assert workbook.sheetnames == [
+        'passing_files','passing_files_2','passing_files_3','missing_files',
+        'near_miss_files','near_miss_files_2','near_miss_files_3'
+        ]
+    values = [
+        row[0] for name in ['passing_files','passing_files_2','passing_files_3']
+        for row in workbook[name].iter_rows(values_only=True)
+        ]
+    assert values == sorted(report['passing_files'])
+    # each table shard repeats the header row
+    rows = [
+        list(workbook[name].iter_rows(values_only=True))
+        for name in ['near_miss_files','near_miss_files_2','near_miss_files_3']
+        ]
+    assert [len(r) for r in rows] == [3,3,2]
+    assert all(r[0] == ('unexpected_file','reason') for r in rows)
+    assert [r[0] for shard in rows for r in shard[1:]] == list('abcde')
+
+
+
+def test_long_sheet_names_are_truncated(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    pytest.importorskip('xlsxwriter')
+    output_path = str(tmp_path/'report.xlsx')
+
+    write_report_excel(
+        {'xray-faxitron header_date_mismatch':{'a','b'}},
+        output_path,
+        max_rows=1
+        )
+
+    assert [len(n) for n in openpyxl.load_workbook(output_path).sheetnames] == \
+        [31,31]
+
+
+
+def test_csv_report_and_table_files(tmp_path):
+    output_path = str(tmp_path/'report.csv')
+    report = {
+        'std passing_files':{'M00001001.csv'},
+        'std missing_files':{'M00001003.csv','M00001002.csv'},
+        'std near_miss_files':pandas.DataFrame(
+            {'unexpected_file':['1002.csv'],'suggested_file':['M00001002.csv']}
+            ),
+        'mouse_test_matrix':pandas.DataFrame({'barcode':['1001'],'std':['passing']})
+        }
+
+    write_report(report,output_path)
+
+    with open(output_path,newline='') as f:
+        assert list(csv.reader(f)) == [
+            ['category','value'],
+            ['std passing_files','M00001001.csv'],
+            ['std missing_files','M00001002.csv'],
+            ['std missing_files','M00001003.csv']
+            ]
+    assert sorted(os.listdir(str(tmp_path))) == [
+        'report.csv',
+        'report_mouse_test_matrix.csv',
+        'report_std_near_miss_files.csv'
+        ]
+    assert pandas.read_csv(
+        str(tmp_path/'report_std_near_miss_files.csv')
+        )['suggested_file'].tolist() == ['M00001002.csv']
+
+
+
+def test_parquet_report_and_table_files(tmp_path):
+    pytest.importorskip('pyarrow')
+    output_path = str(tmp_path/'report.parquet')
+    report = {
+        'body comp missing_files':{'M00001002.jpg','M00001002.txt'},
+        'body comp near_miss_files':pandas.DataFrame({'unexpected_file':['x']})
+        }
+
+    write_report(report,output_path)
+
+    assert pandas.read_parquet(output_path)['value'].tolist() == \
+        ['M00001002.jpg','M00001002.txt']
+    assert os.path.exists(str(tmp_path/'report_body_comp_near_miss_files.parquet'))
+
+
+
+def test_unknown_format_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        write_report({'passing_files':set()},str(tmp_path/'report.txt'))